@@ -0,0 +1,121 @@
+"""
+伺服器端警示引擎：與瀏覽器 session 脫鉤，依觀察清單定時掃描所有 (symbol, interval)。
+
+重用 v19.py 的 prefetch_data / fetch_data / evaluate_alerts / alert_seen / send_telegram，
+整個引擎共用一份去重表，每則新警示寫入 JSONL 事件檔並推送 Telegram 一次；
+頁面開啟「改用伺服器端警示引擎」後只訂閱事件檔，不再各自計算與推送。
+
+用法：
+    python alert_engine.py --symbols TSLA,AAPL,NVDA --intervals 5m,15m,1d --every 60
+觀察清單也可用環境變數 ALERT_WATCHLIST / ALERT_INTERVALS 指定。
+加上 --stream 時 1 分鐘 K 線改由即時串流更新（來源見 STREAM_SOURCE），掃描間隔可縮到數秒：
+    python alert_engine.py --intervals 1m,5m --stream --every 5
+行情來源見 DATA_PROVIDER；離線壓測可用合成數據，不需網路：
+    DATA_PROVIDER=synthetic python alert_engine.py --symbols S1,S2,S3 --once
+"""
+import argparse
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import v19
+
+log = logging.getLogger("alert_engine")
+
+TELEGRAM_FLUSH_SEC = 15.0   # 結束前等 Telegram 佇列送完的上限（秒）
+
+
+def _evaluate(pair: tuple) -> tuple:
+    symbol, interval = pair
+    df = v19.fetch_data(symbol, interval)
+    if df.empty:
+        return symbol, interval, None, []
+    return symbol, interval, df.index[-1], v19.evaluate_alerts(df, interval)
+
+
+def scan_once(symbols: list, intervals: list, seen: OrderedDict,
+              pool: ThreadPoolExecutor) -> list:
+    """掃描一輪：批次更新 K 線 → 工作池平行套用警示規則 → 去重後發布"""
+    v19.prefetch_data(symbols, intervals)
+    pairs   = [(sym, itvl) for itvl in intervals for sym in symbols]
+    results = list(pool.map(_evaluate, pairs))
+
+    events = []
+    for symbol, interval, bar_ts, hits in results:
+        period = v19.INTERVAL_LABELS[interval]
+        if bar_ts is not None:
+            v19.alert_rearm(seen, symbol, period, [h[0] for h in hits])
+        for rule, msg, atype in hits:
+            if v19.alert_seen(seen, v19.alert_key(symbol, period, rule, bar_ts)):
+                continue
+            event = {
+                "ts": time.time(), "time": datetime.now().strftime("%H:%M:%S"),
+                "symbol": symbol, "interval": interval, "period": period,
+                "rule": rule, "msg": msg, "atype": atype, "bar_ts": str(bar_ts),
+            }
+            v19.publish_alert_event(event)
+            v19.send_telegram(f"📊 [{symbol} {period}] {msg}")
+            events.append(event)
+    return events
+
+
+def run(symbols: list, intervals: list, every: float, workers: int, once: bool = False,
+        stream: bool = False):
+    seen = OrderedDict()
+    if stream:
+        v19.prefetch_data(symbols, [v19.STREAM_INTERVAL])
+        v19.start_stream(symbols, owner="alert_engine")
+        log.info("1 分鐘 K 線改由即時串流更新：%s", ", ".join(symbols))
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="alert-engine") as pool:
+            while True:
+                t0     = time.perf_counter()
+                events = scan_once(symbols, intervals, seen, pool)
+                elapsed = time.perf_counter() - t0
+                log.info("掃描 %d 檔 × %d 週期，%.2fs，新警示 %d 則",
+                         len(symbols), len(intervals), elapsed, len(events))
+                if once:
+                    return
+                time.sleep(max(0.0, every - elapsed))
+    finally:
+        _flush_telegram()
+
+
+def _flush_telegram():
+    """送完還在佇列裡的 Telegram 警示再結束；worker 是 daemon 執行緒，行程結束就跟著消失"""
+    if not v19.flush_telegram(TELEGRAM_FLUSH_SEC):
+        log.warning("Telegram 佇列 %.0f 秒內沒送完，剩下的警示未送出", TELEGRAM_FLUSH_SEC)
+
+
+def _split(text: str) -> list:
+    return [s.strip().upper() for s in text.replace("，", ",").split(",") if s.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="美股監控：伺服器端警示引擎")
+    parser.add_argument("--symbols",   default=os.environ.get("ALERT_WATCHLIST", "TSLA,AAPL,NVDA"))
+    parser.add_argument("--intervals", default=os.environ.get("ALERT_INTERVALS", "5m,15m,1d"))
+    parser.add_argument("--every",     type=float, default=60, help="掃描間隔（秒）")
+    parser.add_argument("--workers",   type=int,   default=8,  help="規則計算工作池大小")
+    parser.add_argument("--once",      action="store_true",    help="只掃描一輪就結束")
+    parser.add_argument("--stream",    action="store_true",    help="1 分鐘 K 線改用即時串流")
+    args = parser.parse_args()
+
+    symbols   = _split(args.symbols)
+    intervals = [i.strip() for i in args.intervals.split(",") if i.strip()]
+    unknown   = [i for i in intervals if i not in v19.INTERVAL_MAP]
+    if unknown:
+        parser.error(f"不支援的週期：{', '.join(unknown)}（可用：{', '.join(v19.ALL_INTERVALS)}）")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    try:
+        run(symbols, intervals, args.every, args.workers, once=args.once, stream=args.stream)
+    finally:
+        _flush_telegram()
+
+
+if __name__ == "__main__":
+    main()
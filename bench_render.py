@@ -0,0 +1,241 @@
+"""
+渲染流程壓測：以 Streamlit AppTest 無頭執行 v19.py，K 線用合成或回放數據（不需網路），
+掃過 觀察清單檔數 × 每張圖 K 線根數 × 週期組合 × 單一/多週期模式，
+從 v19 的 STAGE_LOG 讀出每輪重跑各階段（fetch / indicators / alerts / chart / serialize …）的耗時。
+
+每組設定先清空快取跑一次（冷啟動），再重跑 --repeat 次（熱快取）取中位數，
+結果寫成 JSON，方便不同版本之間比對是否退步。
+
+用法：
+    python bench_render.py --symbols 1,10,50 --max-bars 90,300 --intervals "1d;5m,15m,1d"
+    python bench_render.py --data ./replay_bars --tickers TSLA,AAPL   # export_replay_bars 錄下的數據
+週期組合以分號分隔；單一週期模式只取每組的第一個週期。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly
+import streamlit as st
+import streamlit.logger
+from streamlit.testing.v1 import AppTest
+
+import v19
+
+log = logging.getLogger("bench_render")
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "v19.py")
+STAGES   = ("fetch", "indicators", "alerts", "chart", "serialize", "market", "screener")
+MODES    = {"single": "單一週期", "mtf": "多週期同時監控"}
+
+
+def _toggle(at: AppTest, label: str):
+    return next(t for t in at.sidebar.toggle if t.label == label)
+
+
+def _read_stage_line(path: str, seen: int) -> tuple:
+    """回傳 (第 seen 行之後的最後一筆紀錄或 None, 目前行數)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None, seen
+    rec = json.loads(lines[-1]) if len(lines) > seen else None
+    return rec, len(lines)
+
+
+def _sample(at: AppTest, stage_log: str, seen: int) -> tuple:
+    """重跑一次，回傳 (樣本, 行數)；樣本含 wall/total/各階段秒數/圖表數/圖表大小/例外"""
+    t0 = time.perf_counter()
+    at.run()
+    wall = time.perf_counter() - t0
+    rec, seen = _read_stage_line(stage_log, seen)
+    charts = at.get("plotly_chart")
+    sample = {
+        "wall":        wall,
+        "total":       rec["total"] if rec else None,
+        "stages":      {k: rec["stages"].get(k, {}).get("sec", 0.0) for k in STAGES} if rec else {},
+        "calls":       {k: rec["stages"].get(k, {}).get("n", 0) for k in STAGES} if rec else {},
+        "charts":      len(charts),
+        "chart_bytes": sum(len(c.proto.spec) for c in charts),
+        "errors":      [str(e.value) for e in at.exception],
+    }
+    if rec:
+        sample["stages"]["other"] = max(0.0, rec["total"] - sum(sample["stages"].values()))
+    return sample, seen
+
+
+def _median(samples: list) -> dict:
+    ok = [s for s in samples if s["total"] is not None]
+    if not ok:
+        return {"runs": len(samples)}
+    return {
+        "runs":   len(samples),
+        "wall":   statistics.median(s["wall"] for s in samples),
+        "total":  statistics.median(s["total"] for s in ok),
+        "stages": {k: statistics.median(s["stages"][k] for s in ok) for k in ok[0]["stages"]},
+    }
+
+
+def run_config(symbols: list, intervals: list, mode: str, max_bars: int, repeat: int,
+               stage_log: str, cache_dir: str, market: bool, ai: bool, timeout: float) -> dict:
+    """跑一組設定：設定好側欄 → 清空快取冷跑一次 → 熱跑 repeat 次"""
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    at.run()
+    # 第一次執行時 streamlit 解析設定會重設 log level，之後再關掉每輪的棄用提示
+    streamlit.logger.set_log_level("error")
+    at.sidebar.text_area[0].input(",".join(symbols))
+    at.sidebar.radio[0].set_value(MODES[mode])
+    at.sidebar.number_input[0].set_value(max_bars)
+    _toggle(at, "顯示市場環境面板").set_value(market)
+    _toggle(at, "啟用 AI 技術分析").set_value(ai)
+    if mode == "single":
+        at.sidebar.selectbox[0].set_value(intervals[0])
+    at.run()
+    if mode == "mtf":
+        for itvl in v19.ALL_INTERVALS:
+            at.checkbox(key=f"cb_{itvl}").set_value(itvl in intervals)
+
+    # 冷啟動：K 線儲存、指標/圖表 LRU、磁碟快取全部清空
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    _, seen = _read_stage_line(stage_log, 0)
+    cold, seen = _sample(at, stage_log, seen)
+
+    warm = []
+    for _ in range(repeat):
+        sample, seen = _sample(at, stage_log, seen)
+        warm.append(sample)
+
+    errors = cold["errors"] + [e for s in warm for e in s["errors"]]
+    return {
+        "mode": mode, "symbols": len(symbols), "intervals": intervals, "max_bars": max_bars,
+        "charts": cold["charts"], "chart_bytes": cold["chart_bytes"], "calls": cold["calls"],
+        "cold": {k: cold[k] for k in ("wall", "total", "stages")},
+        "warm": _median(warm),
+        "errors": sorted(set(errors)),
+    }
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=os.path.dirname(APP_PATH), timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _replay_symbols(root: str, interval: str, n: int) -> list:
+    names = sorted(os.path.splitext(f)[0] for f in os.listdir(os.path.join(root, interval)))
+    return names[:n]
+
+
+def _ints(text: str) -> list:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="美股監控：渲染流程壓測")
+    parser.add_argument("--symbols",   default="1,10,50", help="觀察清單檔數（逗號分隔）")
+    parser.add_argument("--max-bars",  default="90,300",  help="每張圖 K 線根數（逗號分隔）")
+    parser.add_argument("--intervals", default="1d;5m,15m,1d", help="週期組合，分號分隔")
+    parser.add_argument("--modes",     default="single,mtf", help="single / mtf")
+    parser.add_argument("--repeat",    type=int, default=3, help="每組熱快取重跑次數")
+    parser.add_argument("--data",      default="synthetic",
+                        help='行情來源（DATA_PROVIDER）："synthetic[:seed]" 或回放目錄')
+    parser.add_argument("--tickers",   default="", help="指定代號；預設合成 S0000… 或回放目錄內的檔案")
+    parser.add_argument("--no-market", action="store_true", help="關閉市場環境面板")
+    parser.add_argument("--ai",        action="store_true", help="開啟 AI 面板（只渲染，不送出分析）")
+    parser.add_argument("--timeout",   type=float, default=600, help="單次重跑逾時（秒）")
+    parser.add_argument("--out",       default="bench_render.json")
+    args = parser.parse_args()
+
+    counts   = _ints(args.symbols)
+    bars     = _ints(args.max_bars)
+    combos   = [[i.strip() for i in c.split(",") if i.strip()] for c in args.intervals.split(";")]
+    combos   = [c for c in combos if c]
+    modes    = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown  = sorted({i for c in combos for i in c if i not in v19.INTERVAL_MAP})
+    if unknown:
+        parser.error(f"不支援的週期：{', '.join(unknown)}（可用：{', '.join(v19.ALL_INTERVALS)}）")
+    if set(modes) - set(MODES):
+        parser.error(f"不支援的模式：{', '.join(set(modes) - set(MODES))}（可用：single, mtf）")
+    if args.data == "yahoo":
+        parser.error("壓測只用離線來源：synthetic 或回放目錄")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    work      = tempfile.mkdtemp(prefix="bench_render_")
+    stage_log = os.path.join(work, "stages.jsonl")
+    cache_dir = os.path.join(work, "bar_cache")
+    os.environ["DATA_PROVIDER"] = args.data
+    os.environ["BAR_CACHE_DIR"] = cache_dir
+    os.environ["STAGE_LOG"]     = stage_log
+
+    pool = [s.strip().upper() for s in args.tickers.split(",") if s.strip()]
+    if not pool:
+        if args.data.startswith("synthetic"):
+            pool = [f"S{i:04d}" for i in range(max(counts))]
+        else:
+            pool = _replay_symbols(args.data, combos[0][0], max(counts))
+
+    # 單一週期模式只取每組的第一個週期，去掉重複的設定
+    configs = []
+    for mode in modes:
+        for combo in combos:
+            itvls = combo[:1] if mode == "single" else combo
+            for n in counts:
+                for mb in bars:
+                    cfg = (mode, tuple(itvls), n, mb)
+                    if cfg not in configs:
+                        configs.append(cfg)
+
+    results = []
+    try:
+        for mode, itvls, n, mb in configs:
+            res = run_config(pool[:n], list(itvls), mode, mb, args.repeat, stage_log, cache_dir,
+                             market=not args.no_market, ai=args.ai, timeout=args.timeout)
+            results.append(res)
+            warm = res["warm"].get("total")
+            log.info("%-6s %-12s %4d 檔 %3d 根  冷 %.2fs  熱 %s  圖表 %d%s",
+                     mode, ",".join(itvls), res["symbols"], mb, res["cold"]["total"] or 0,
+                     f"{warm:.2f}s" if warm is not None else "—", res["charts"],
+                     f"  錯誤 {len(res['errors'])}" if res["errors"] else "")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "created":   datetime.now().isoformat(timespec="seconds"),
+            "git":       _git_rev(),
+            "data":      args.data,
+            "repeat":    args.repeat,
+            "market":    not args.no_market,
+            "ai":        args.ai,
+            "python":    platform.python_version(),
+            "streamlit": st.__version__,
+            "pandas":    pd.__version__,
+            "numpy":     np.__version__,
+            "plotly":    plotly.__version__,
+            "cpus":      os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log.info("已寫入 %s（%d 組設定）", args.out, len(results))
+
+
+if __name__ == "__main__":
+    main()
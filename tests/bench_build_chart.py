@@ -0,0 +1,56 @@
+"""
+build_chart 微基準：量能異常分段與 MACD 交叉，向量化版本 vs 逐根迴圈（test_build_chart 的基準版本），
+以及整張圖（_make_chart）換用兩種版本的耗時。
+
+用法：
+    python tests/bench_build_chart.py [--bars 500] [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import v19
+from test_build_chart import anomaly_peaks_loop, macd_crosses_loop, random_bars
+
+
+def best(fn, repeat: int) -> float:
+    """最快一輪的單次耗時（µs）"""
+    return min(timeit.repeat(fn, number=repeat, repeat=3)) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build_chart 微基準")
+    parser.add_argument("--bars",   type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    df   = random_bars(0, args.bars)
+    vol  = df["Volume"]
+    mask = (vol > vol.rolling(5).mean() * 2).values
+    ind  = v19.calc_indicators(df)
+    dif, dea = ind["DIF"].values, ind["DEA"].values
+
+    rows = [
+        ("異常分段", lambda: anomaly_peaks_loop(mask, vol.values), lambda: v19._anomaly_peaks(mask, vol.values)),
+        ("MACD 交叉", lambda: macd_crosses_loop(dif, dea), lambda: v19._macd_crosses(dif, dea)),
+    ]
+    print(f"{args.bars} 根 K 線")
+    print(f"{'項目':<10}{'迴圈 µs':>12}{'向量化 µs':>12}{'倍數':>8}")
+    for name, loop_fn, vec_fn in rows:
+        loop, vec = best(loop_fn, args.repeat), best(vec_fn, args.repeat)
+        print(f"{name:<10}{loop:>12.1f}{vec:>12.1f}{loop / vec:>7.1f}x")
+
+    n = max(1, args.repeat // 20)
+    v19.get_indicators(df)   # 指標走快取，只量畫圖本身
+    vec = best(lambda: v19._make_chart("BENCH", df, "日K", False, args.bars), n)
+    v19._anomaly_peaks, v19._macd_crosses = anomaly_peaks_loop, macd_crosses_loop
+    loop = best(lambda: v19._make_chart("BENCH", df, "日K", False, args.bars), n)
+    print(f"{'整張圖':<10}{loop:>12.1f}{vec:>12.1f}{loop / vec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
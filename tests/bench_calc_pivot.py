@@ -0,0 +1,34 @@
+"""
+calc_pivot 微基準：向量化版本 vs 逐根迴圈（test_calc_pivot.calc_pivot_loop）
+
+用法：
+    python tests/bench_calc_pivot.py [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import v19
+from test_calc_pivot import calc_pivot_loop, random_ohlc
+
+
+def main():
+    parser = argparse.ArgumentParser(description="calc_pivot 微基準")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    df = random_ohlc(0, 500)
+    print(f"{'週期':<6}{'迴圈 µs':>10}{'向量化 µs':>12}{'倍數':>8}")
+    for interval in v19.PIVOT_CFG:
+        loop = min(timeit.repeat(lambda: calc_pivot_loop(df, interval), number=args.repeat, repeat=3))
+        vec  = min(timeit.repeat(lambda: v19.calc_pivot(df, interval), number=args.repeat, repeat=3))
+        loop, vec = loop / args.repeat * 1e6, vec / args.repeat * 1e6
+        print(f"{interval:<6}{loop:>10.1f}{vec:>12.1f}{loop / vec:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+RSS 解析基準：fixtures/large_feed.xml（600 則、約 450KB）
+比較 regex 整份解析與 XMLPullParser 串流解析，取全部與只取前 8 則兩種情況。
+
+用法：
+    python tests/bench_feed_parse.py [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import v19
+from test_feed_parse import FIXTURE, chunks, parse_feed_regex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RSS 解析基準")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(FIXTURE, "rb") as f:
+        feed = f.read()
+
+    cases = {
+        "regex 全部":  lambda: parse_feed_regex(feed.decode("utf-8"), "src", 10 ** 9, {}),
+        "串流 全部":   lambda: v19._parse_feed_items(chunks(feed), "src", None, {}),
+        "regex 前 8":  lambda: parse_feed_regex(feed.decode("utf-8"), "src", 8, {}),
+        "串流 前 8":   lambda: v19._parse_feed_items(chunks(feed), "src", 8, {}),
+    }
+    print(f"{len(feed) / 1024:.0f} KB")
+    for name, fn in cases.items():
+        sec = min(timeit.repeat(fn, number=args.repeat, repeat=3)) / args.repeat
+        print(f"{name:<10}{sec * 1e3:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""AI 競速：本機 http.server 假扮三家供應商，第一個有效回覆勝出、其餘放著跑完、全失敗回傳各家錯誤"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import v19
+
+KEYS = {"groq": "k-groq", "gemini": "k-gemini", "claude": "k-claude"}
+
+
+def reply_body(name: str, text: str) -> dict:
+    return {"groq":   {"choices": [{"message": {"content": text}}]},
+            "gemini": {"candidates": [{"content": {"parts": [{"text": text}]}}]},
+            "claude": {"content": [{"text": text}]}}[name]
+
+
+class Stub:
+    """一家供應商：delay 秒後回覆；status 非 200 回錯誤碼，bad 時回非 JSON 文字"""
+
+    def __init__(self, name: str):
+        self.name, self.delay, self.status, self.bad = name, 0.0, 200, False
+        self.hits, self.done = [], []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.hits.append(time.monotonic())
+                time.sleep(stub.delay)
+                text = "not json" if stub.bad else json.dumps({"verdict": "做多", "who": stub.name})
+                data = json.dumps(reply_body(stub.name, text)).encode()
+                self.send_response(stub.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except OSError:
+                    pass
+                stub.done.append(time.monotonic())
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url    = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def set(self, delay: float = 0.0, status: int = 200, bad: bool = False):
+        self.delay, self.status, self.bad = delay, status, bad
+
+
+def wait_for(cond, timeout: float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    servers = {name: Stub(name) for name in v19.AI_RACE_PROVIDERS}
+    for name, stub in servers.items():
+        monkeypatch.setenv(f"{name.upper()}_BASE_URL", stub.url)
+    # 不讓限速的發送間隔影響計時
+    monkeypatch.setattr(v19, "AI_RATE_LIMITS", {p: (2, 60000) for p in v19.AI_RACE_PROVIDERS})
+    v19._ai_runner.clear()
+    v19._ai_stats.clear()
+    yield servers
+    # 等落後的請求跑完，免得它們的統計寫進下一個測試
+    wait_for(lambda: all(len(s.done) == len(s.hits) for s in servers.values()))
+    time.sleep(0.1)
+    for stub in servers.values():
+        stub.server.shutdown()
+        stub.server.server_close()
+    v19._ai_runner.clear()
+    v19._ai_stats.clear()
+
+
+def race(api_keys: dict = KEYS) -> tuple:
+    t0     = time.monotonic()
+    result = v19.race_ai_analysis(v19._ai_runner(), "prompt", api_keys)
+    return result, time.monotonic() - t0
+
+
+def test_fastest_valid_reply_wins(stubs):
+    stubs["groq"].set(delay=0.05)
+    stubs["gemini"].set(delay=1.0)
+    stubs["claude"].set(delay=1.5)
+    result, sec = race()
+    assert result["who"] == "groq"
+    assert result["_provider"] == "groq"
+    assert 0 < result["_latency"] < 1.0
+    assert sec < 1.0
+    assert all(len(s.hits) == 1 for s in stubs.values())
+
+
+def test_invalid_reply_does_not_win(stubs):
+    stubs["gemini"].set(delay=0.05, bad=True)
+    stubs["groq"].set(delay=0.3)
+    stubs["claude"].set(delay=1.5)
+    result, _ = race()
+    assert result["_provider"] == "groq"
+
+
+def test_losers_are_abandoned(stubs):
+    stubs["groq"].set(delay=0.05)
+    stubs["gemini"].set(delay=1.0)
+    stubs["claude"].set(delay=1.0)
+    result, sec = race()
+    assert result["_provider"] == "groq"
+    # 回傳時落後的請求還沒回覆，不等它們
+    assert sec < 1.0
+    assert not stubs["gemini"].done and not stubs["claude"].done
+    # 它們在背景跑完，只拿來更新統計，不影響已回傳的結果
+    assert wait_for(lambda: v19.ai_provider_stats("gemini")["n"] == 1
+                    and v19.ai_provider_stats("claude")["n"] == 1)
+    assert v19.ai_provider_stats("gemini")["latency"] >= 1.0
+    assert result["who"] == "groq"
+
+
+def test_all_fail_returns_combined_error(stubs):
+    stubs["groq"].set(status=500)
+    stubs["gemini"].set(delay=0.1, bad=True)
+    stubs["claude"].set(delay=0.2, status=401)
+    result, _ = race()
+    assert set(result) == {"error"}
+    parts = result["error"].split("；")
+    assert len(parts) == 3
+    names = {p: v19.PROVIDER_INFO[p]["name"] for p in KEYS}
+    assert parts[0].startswith(f"{names['groq']}：Groq 錯誤 500")
+    assert parts[1].startswith(f"{names['gemini']}：JSON 解析失敗")
+    assert parts[2] == f"{names['claude']}：Claude API Key 無效，請確認後重新輸入"
+
+
+def test_only_providers_with_keys(stubs):
+    result, _ = race({"claude": "k"})
+    assert result["_provider"] == "claude"
+    assert not stubs["groq"].hits and not stubs["gemini"].hits
+    assert v19.race_ai_analysis(v19._ai_runner(), "prompt", {}) == {"error": "NO_KEY"}
+
+
+def test_rank_by_fail_rate_then_latency(stubs):
+    calls = v19._ai_stats()["calls"]
+    calls["groq"].extend([(True, 0.3), (False, 0.1)])
+    calls["gemini"].extend([(True, 0.8), (True, 0.9)])
+    assert v19.rank_ai_providers(["groq", "gemini", "claude"]) == ["claude", "gemini", "groq"]
+    calls["claude"].append((True, 1.2))
+    assert v19.rank_ai_providers(["groq", "gemini", "claude"]) == ["gemini", "claude", "groq"]
+
+
+def test_race_updates_ranking(stubs):
+    stubs["groq"].set(status=500)
+    stubs["gemini"].set(delay=0.3)
+    stubs["claude"].set(delay=0.05)
+    race()
+    assert wait_for(lambda: all(v19.ai_provider_stats(p)["n"] == 1 for p in KEYS))
+    assert v19.rank_ai_providers(list(KEYS)) == ["claude", "gemini", "groq"]
+
+
+def seed_latency(**latency):
+    calls = v19._ai_stats()["calls"]
+    for p, sec in latency.items():
+        calls[p].append((True, sec))
+
+
+def test_ranked_leader_answers_alone(stubs):
+    seed_latency(groq=0.3, gemini=0.8, claude=1.0)
+    stubs["groq"].set(delay=0.05)
+    result, _ = race()
+    assert result["_provider"] == "groq"
+    assert not stubs["gemini"].hits and not stubs["claude"].hits
+
+
+def test_slow_leader_is_hedged_after_its_median(stubs):
+    seed_latency(groq=0.2, gemini=0.5, claude=0.6)
+    stubs["groq"].set(delay=1.5)
+    stubs["gemini"].set(delay=0.05)
+    result, sec = race()
+    assert result["_provider"] == "gemini"
+    assert stubs["gemini"].hits[0] - stubs["groq"].hits[0] >= 0.15
+    assert sec < 1.0
+    assert not stubs["claude"].hits   # gemini 在自己的中位數內就回覆了
+
+
+def test_failed_leader_falls_through_immediately(stubs):
+    seed_latency(groq=1.0, gemini=1.5, claude=2.0)
+    stubs["groq"].set(status=500)
+    stubs["gemini"].set(delay=0.05)
+    result, sec = race()
+    assert result["_provider"] == "gemini"
+    assert sec < 0.8
+    assert not stubs["claude"].hits
+
+
+def test_cancel_before_send_returns_slot(stubs, monkeypatch):
+    monkeypatch.setattr(v19, "AI_RATE_LIMITS", {p: (2, 60) for p in v19.AI_RACE_PROVIDERS})
+    v19._ai_runner.clear()
+    runner = v19._ai_runner()
+    assert v19._ai_call_limited(runner, "p", "groq", "k")["who"] == "groq"
+    reserved = runner["limits"]["groq"]["next"]
+
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    t0     = time.monotonic()
+    result = v19._ai_call_limited(runner, "p", "groq", "k", cancel)
+    assert result == {"error": v19.AI_CANCELLED}
+    assert time.monotonic() - t0 < 0.5
+    assert len(stubs["groq"].hits) == 1
+    assert runner["limits"]["groq"]["next"] == reserved
+    assert v19.ai_provider_stats("groq")["n"] == 1   # 取消不算失敗
+
+
+def test_races_share_bounded_pool(stubs):
+    for _ in range(5):
+        race()
+    names = {t.name for t in threading.enumerate() if t.name.startswith("v19-ai-race")}
+    assert 0 < len(names) <= v19.AI_RACE_WORKERS
@@ -0,0 +1,60 @@
+"""警示去重：狀態型規則整段只發一次，轉為不成立後才重新觸發；邊緣觸發規則逐根去重"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import alert_engine
+import v19
+
+BARS = pd.date_range("2026-10-16 09:30", periods=6, freq="min")
+# 每根 K 線成立的規則：多頭排列在第 0-2、4-5 根成立，第 3 根中斷
+SCRIPT = [
+    ["ema_stack_bull"],
+    ["ema_stack_bull", "vol_spike"],
+    ["ema_stack_bull", "vol_spike"],
+    ["macd_dead"],
+    ["ema_stack_bull"],
+    ["ema_stack_bull"],
+]
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    state = {"t": 0}
+    monkeypatch.setattr(v19, "prefetch_data", lambda *a, **k: {})
+    monkeypatch.setattr(v19, "fetch_data",
+                        lambda sym, itvl: pd.DataFrame({"Close": range(state["t"] + 1)},
+                                                       index=BARS[:state["t"] + 1]))
+    monkeypatch.setattr(v19, "evaluate_alerts",
+                        lambda df, itvl: [(r, r, "info") for r in SCRIPT[len(df) - 1]])
+    monkeypatch.setattr(v19, "publish_alert_event", lambda event: None)
+    monkeypatch.setattr(v19, "send_telegram", lambda msg: None)
+
+    seen = OrderedDict()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        def scan(t):
+            state["t"] = t
+            return [(e["rule"], BARS.get_loc(pd.Timestamp(e["bar_ts"])))
+                    for e in alert_engine.scan_once(["AAA"], ["1m"], seen, pool)]
+        yield scan
+
+
+def test_state_rule_fires_once_per_episode(engine):
+    fired = []
+    for t in range(len(BARS)):
+        fired += engine(t)
+        fired += engine(t)          # 同一根 K 線重複掃描不會再發
+    assert fired == [
+        ("ema_stack_bull", 0),
+        ("vol_spike", 1),
+        ("vol_spike", 2),
+        ("macd_dead", 3),
+        ("ema_stack_bull", 4),      # 第 3 根中斷後重新觸發，第 5 根不再發
+    ]
+
+
+def test_alert_key():
+    assert v19.alert_key("A", "1分鐘", "ema_stack_bull", BARS[0]) == ("A", "1分鐘", "ema_stack_bull", None)
+    assert v19.alert_key("A", "1分鐘", "macd_gold", BARS[0]) == ("A", "1分鐘", "macd_gold", str(BARS[0]))
@@ -0,0 +1,82 @@
+"""警示事件檔：輪替後的讀取位置處理"""
+import json
+import os
+
+import v19
+
+
+def publish(path, *ids, pad=""):
+    for i in ids:
+        v19.publish_alert_event({"id": i, "pad": pad}, path=path)
+
+
+def ids(events) -> list:
+    return [e["id"] for e in events]
+
+
+def test_incremental(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    publish(path, 1, 2)
+    events, cur = v19.read_alert_feed(None, path)
+    assert ids(events) == [1, 2]
+    publish(path, 3)
+    events, cur = v19.read_alert_feed(cur, path)
+    assert ids(events) == [3]
+    assert v19.read_alert_feed(cur, path)[0] == []
+
+
+def test_partial_line_waits(tmp_path):
+    path = str(tmp_path / "alerts.jsonl")
+    publish(path, 1)
+    with open(path, "a") as f:
+        f.write('{"id": 2')
+    events, cur = v19.read_alert_feed(None, path)
+    assert ids(events) == [1]
+    with open(path, "a") as f:
+        f.write("}\n")
+    assert ids(v19.read_alert_feed(cur, path)[0]) == [2]
+
+
+def test_rotation_to_new_larger_file_reads_from_start(tmp_path, monkeypatch):
+    path = str(tmp_path / "alerts.jsonl")
+    monkeypatch.setattr(v19, "ALERT_FEED_MAX_BYTES", 200)
+    publish(path, 1, 2)
+    _, cur = v19.read_alert_feed(None, path)
+
+    # 輪替：舊檔滿了換成 .1，新檔寫入比舊 offset 更長的內容
+    publish(path, *range(3, 6), pad="x" * 80)
+    publish(path, *range(6, 12), pad="x" * 80)
+    assert os.path.exists(path + ".1")
+    assert os.path.getsize(path) > cur[1]
+
+    events, _ = v19.read_alert_feed(cur, path)
+    with open(path) as f:
+        assert ids(events) == [json.loads(line)["id"] for line in f]
+
+
+def test_copytruncate_reads_new_content_from_start(tmp_path):
+    # 以 copytruncate 方式輪替（inode 不變）後又長過舊 offset：第一行不同，從頭讀
+    path = str(tmp_path / "alerts.jsonl")
+    publish(path, 1, 2)
+    _, cur = v19.read_alert_feed(None, path)
+    with open(path, "w") as f:
+        f.write(json.dumps({"id": 10, "pad": "y" * (cur[1] + 5)}) + "\n")
+        f.write(json.dumps({"id": 11}) + "\n")
+    events, cur2 = v19.read_alert_feed(cur, path)
+    assert ids(events) == [10, 11]
+    assert cur2[:2] == (cur[0], os.path.getsize(path))
+
+
+def test_offset_mid_line_skips_partial(tmp_path):
+    # 第一行相同但後面被改寫，舊 offset 落在行中間：跳到下一個換行，不解析半行
+    path = str(tmp_path / "alerts.jsonl")
+    publish(path, 1, 2)
+    _, cur = v19.read_alert_feed(None, path)
+    with open(path) as f:
+        first = f.readline()
+    with open(path, "w") as f:
+        f.write(first)
+        f.write(json.dumps({"id": 11, "pad": "z" * cur[1]}) + "\n")
+        f.write(json.dumps({"id": 12}) + "\n")
+    events, _ = v19.read_alert_feed(cur, path)
+    assert ids(events) == [12]
@@ -0,0 +1,104 @@
+"""build_chart 的量能異常分段與 MACD 交叉：向量化版本與原本逐根迴圈的等價性"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import v19
+from test_calc_pivot import random_ohlc
+
+
+def anomaly_peaks_loop(mask, vol):
+    """向量化前的異常放量分段（基準版本，僅供比對）"""
+    groups, in_group, g_start = [], False, 0
+    for i, flag in enumerate(mask):
+        if flag and not in_group:
+            in_group, g_start = True, i
+        elif not flag and in_group:
+            groups.append((g_start, i - 1))
+            in_group = False
+    if in_group:
+        groups.append((g_start, len(mask) - 1))
+
+    rep_pos = []
+    for g0, g1 in groups:
+        seg_vals = vol[g0:g1+1]
+        rep_pos.append(g0 + int(seg_vals.argmax()))
+    return rep_pos
+
+
+def macd_crosses_loop(dif, dea):
+    """向量化前的金叉/死叉掃描（基準版本，僅供比對；照原本逐根走 Series.iloc）"""
+    dif, dea = pd.Series(dif), pd.Series(dea)
+    raw_crosses = []
+    for i in range(1, len(dif)):
+        if dif.iloc[i] > dea.iloc[i] and dif.iloc[i-1] <= dea.iloc[i-1]:
+            raw_crosses.append((i, "gold"))
+        elif dif.iloc[i] < dea.iloc[i] and dif.iloc[i-1] >= dea.iloc[i-1]:
+            raw_crosses.append((i, "dead"))
+    return raw_crosses
+
+
+def random_bars(seed: int, n: int, vol: float = 0.02, tick: float = None) -> pd.DataFrame:
+    """random_ohlc 加上成交量：對數常態底量，隨機插入連續數根的爆量段"""
+    df  = random_ohlc(seed, n, vol, tick)
+    rng = np.random.default_rng(seed + 1000)
+    v   = rng.lognormal(13, 0.3, n)
+    for start in rng.integers(0, n, max(1, n // 25)):
+        v[start:start + rng.integers(1, 5)] *= rng.uniform(2, 6)
+    if tick:
+        v = np.round(v, -5)   # 取整製造段內同量（平手）
+    df["Volume"] = v
+    return df
+
+
+CASES = [(seed, n, vol, tick)
+         for seed in range(6)
+         for n, vol, tick in [(500, 0.02, None), (200, 0.01, 0.5), (60, 0.05, None), (12, 0.02, 1.0)]]
+
+
+@pytest.mark.parametrize("seed,n,vol,tick", CASES)
+def test_anomaly_peaks_match_loop(seed, n, vol, tick):
+    df   = random_bars(seed, n, vol, tick)
+    v    = df["Volume"]
+    mask = (v > v.rolling(5).mean() * 2).values
+    if not mask.any():
+        pytest.skip("沒有異常放量")
+    assert v19._anomaly_peaks(mask, v.values) == anomaly_peaks_loop(mask, v.values)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_anomaly_peaks_ties_and_edges(seed):
+    rng  = np.random.default_rng(seed)
+    n    = int(rng.integers(1, 80))
+    mask = rng.random(n) < 0.5
+    mask[0], mask[-1] = rng.random() < 0.5, True     # 段落貼齊頭尾
+    vol  = rng.integers(0, 4, n).astype(float)        # 大量平手
+    assert v19._anomaly_peaks(mask, vol) == anomaly_peaks_loop(mask, vol)
+
+
+@pytest.mark.parametrize("seed,n,vol,tick", CASES)
+def test_macd_crosses_match_loop(seed, n, vol, tick):
+    ind = v19.calc_indicators(random_bars(seed, n, vol, tick))
+    dif, dea = ind["DIF"].values, ind["DEA"].values
+    assert v19._macd_crosses(dif, dea) == macd_crosses_loop(dif, dea)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_macd_crosses_ties_and_nan(seed):
+    rng = np.random.default_rng(seed)
+    n   = int(rng.integers(2, 80))
+    dif = rng.integers(-2, 3, n).astype(float)       # 常出現 DIF == DEA
+    dea = rng.integers(-2, 3, n).astype(float)
+    dif[rng.random(n) < 0.1] = np.nan
+    assert v19._macd_crosses(dif, dea) == macd_crosses_loop(dif, dea)
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("seed,n,max_bars", [(0, 500, 500), (1, 300, 90), (2, 40, 90), (3, 700, 200)])
+def test_figure_matches_loop(monkeypatch, seed, n, max_bars, compact):
+    df  = random_bars(seed, n)
+    new = v19._make_chart("TEST", df, "日K", compact, max_bars).to_json()
+    monkeypatch.setattr(v19, "_anomaly_peaks", anomaly_peaks_loop)
+    monkeypatch.setattr(v19, "_macd_crosses", macd_crosses_loop)
+    old = v19._make_chart("TEST", df, "日K", compact, max_bars).to_json()
+    assert new == old
@@ -0,0 +1,60 @@
+"""calc_pivot 向量化版本與原本逐根迴圈的等價性"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import v19
+
+
+def calc_pivot_loop(df, interval: str = "1d"):
+    """向量化前的 calc_pivot（基準版本，僅供比對）"""
+    left, right, tail_n = v19.PIVOT_CFG.get(interval, (3, 3, 60))
+
+    sub = df.tail(tail_n)
+    if len(sub) < left + right + 2:
+        return [], []
+
+    hi, lo, idx = sub["High"].values, sub["Low"].values, sub.index
+    current_price = float(df["Close"].iloc[-1])
+    price_lo = current_price * 0.70
+    price_hi = current_price * 1.30
+
+    highs, lows = [], []
+    for i in range(left, len(sub) - right):
+        if hi[i] == max(hi[i-left:i+right+1]) and price_lo <= hi[i] <= price_hi:
+            highs.append((idx[i], float(hi[i])))
+        if lo[i] == min(lo[i-left:i+right+1]) and price_lo <= lo[i] <= price_hi:
+            lows.append((idx[i], float(lo[i])))
+    return highs, lows
+
+
+def random_ohlc(seed: int, n: int, vol: float = 0.02, tick: float = None) -> pd.DataFrame:
+    """隨機漫步 OHLC；給 tick 時價格取整到跳動單位，製造相同高低點（平手）的情況"""
+    rng   = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, vol, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high  = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, vol / 2, n)))
+    low   = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2, n)))
+    if tick:
+        high, low, close = (np.round(a / tick) * tick for a in (high, low, close))
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close},
+                        index=pd.date_range("2024-01-01", periods=n, freq="h"))
+
+
+CASES = [(seed, n, vol, tick)
+         for seed in range(8)
+         for n, vol, tick in [(300, 0.02, None), (150, 0.01, 0.5), (40, 0.2, None), (9, 0.02, 1.0)]]
+
+
+@pytest.mark.parametrize("interval", list(v19.PIVOT_CFG) + ["unknown"])
+@pytest.mark.parametrize("seed,n,vol,tick", CASES)
+def test_matches_loop(interval, seed, n, vol, tick):
+    df = random_ohlc(seed, n, vol, tick)
+    assert v19.calc_pivot(df, interval) == calc_pivot_loop(df, interval)
+
+
+@pytest.mark.parametrize("interval", list(v19.PIVOT_CFG))
+def test_too_short(interval):
+    left, right, _ = v19.PIVOT_CFG[interval]
+    df = random_ohlc(0, left + right + 1)
+    assert v19.calc_pivot(df, interval) == ([], [])
@@ -0,0 +1,107 @@
+"""RSS 串流解析（XMLPullParser）與原本整份 regex 解析的結果比對"""
+import html as html_lib
+import os
+import re
+from email.utils import parsedate_to_datetime
+
+import pytest
+
+import v19
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "large_feed.xml")
+
+
+def parse_feed_regex(text: str, src_name: str, max_items: int, guids: dict) -> list:
+    """改用 XMLPullParser 前的 regex 版本（基準版本，僅供比對）"""
+    items = []
+    item_blocks = re.findall(r"<item>(.*?)</item>", text, re.DOTALL)
+    for block in item_blocks:
+        if len(items) >= max_items:
+            break
+        g_match = re.search(r"<guid[^>]*>(.*?)</guid>", block)
+        guid    = g_match.group(1).strip() if g_match else ""
+        if guid and (src_name, guid) in guids:
+            items.append(guids[(src_name, guid)])
+            continue
+
+        t_match = re.search(r"<title>(.*?)</title>", block, re.DOTALL)
+        if not t_match:
+            continue
+        title = t_match.group(1)
+        title = re.sub(r"<!\[CDATA\[(.*?)\]\]>", r"", title)
+        title = re.sub(r"<[^>]+>", "", title)
+        title = html_lib.unescape(title).strip()
+        if not title or len(title) < 10:
+            continue
+
+        l_match = re.search(r"<link>(.*?)</link>", block)
+        link = l_match.group(1).strip() if l_match else (guid or "#")
+
+        d_match = re.search(r"<pubDate>(.*?)</pubDate>", block)
+        raw_date = d_match.group(1).strip() if d_match else ""
+        try:
+            date_str = parsedate_to_datetime(raw_date).strftime("%m/%d %H:%M")
+        except Exception:
+            date_str = raw_date[:16]
+
+        item = {
+            "title": title, "link": link,
+            "date": date_str, "sentiment": v19._news_sentiment(title),
+            "source": src_name,
+        }
+        if guid:
+            guids[(src_name, guid)] = item
+        items.append(item)
+    return items
+
+
+def chunks(data: bytes, size: int = v19.NEWS_CHUNK_BYTES):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+@pytest.fixture(scope="module")
+def feed() -> bytes:
+    with open(FIXTURE, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("max_items", [1, 8, 50, None])
+def test_stream_matches_regex(feed, max_items):
+    limit    = max_items if max_items is not None else 10 ** 9
+    expected = parse_feed_regex(feed.decode("utf-8"), "src", limit, {})
+    got      = v19._parse_feed_items(chunks(feed), "src", max_items, {})
+    assert got == expected
+    assert len(got) == (600 if max_items is None else max_items)
+
+
+def test_stream_matches_regex_with_guid_cache(feed):
+    warm = {}
+    v19._parse_feed_items(chunks(feed), "src", 100, warm)
+    expected = parse_feed_regex(feed.decode("utf-8"), "src", 10 ** 9, dict(warm))
+    assert v19._parse_feed_items(chunks(feed), "src", None, dict(warm)) == expected
+
+
+def test_tiny_chunks(feed):
+    assert (v19._parse_feed_items(chunks(feed, 97), "src", None, {})
+            == v19._parse_feed_items(chunks(feed), "src", None, {}))
+
+
+def test_stops_reading_after_max_items(feed):
+    read = []
+
+    def counting():
+        for c in chunks(feed):
+            read.append(len(c))
+            yield c
+
+    v19._parse_feed_items(counting(), "src", 8, {})
+    assert sum(read) < len(feed) // 10
+
+
+def test_cdata_title_kept():
+    # regex 版本會把 CDATA 標題整段刪掉；XML 解析器直接還原成文字
+    feed = (b"<rss><channel><item><title><![CDATA[Stocks rally & yields drop]]></title>"
+            b"<link>https://e.com/1</link><guid>a</guid></item></channel></rss>")
+    items = v19._parse_feed_items(chunks(feed), "src", None, {})
+    assert [it["title"] for it in items] == ["Stocks rally & yields drop"]
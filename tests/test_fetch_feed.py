@@ -0,0 +1,113 @@
+"""_fetch_feed 條件式請求：只解析需要的條目，304 / 抓取失敗時沿用快取"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import v19
+
+ETAG = '"v1"'
+
+
+def make_feed(n: int) -> bytes:
+    items = "".join(
+        f"<item><title>Headline number {i} for the market</title>"
+        f"<link>https://example.com/{i}</link><guid>g{i}</guid>"
+        f"<pubDate>Mon, 12 Oct 2026 14:{i % 60:02d}:00 GMT</pubDate></item>"
+        for i in range(n))
+    return f'<?xml version="1.0"?><rss><channel><title>t</title>{items}</channel></rss>'.encode()
+
+
+def links(items: list) -> list:
+    return [it["link"] for it in items]
+
+
+def expected(n: int) -> list:
+    return [f"https://example.com/{i}" for i in range(n)]
+
+
+@pytest.fixture
+def feed_server():
+    body, hits, mode = make_feed(20), [], {"status": 200}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            hits.append(self.headers.get("If-None-Match"))
+            if mode["status"] != 200:
+                self.send_response(mode["status"])
+                self.end_headers()
+                return
+            if self.headers.get("If-None-Match") == ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    v19._feed_state.clear()
+    yield f"http://127.0.0.1:{srv.server_address[1]}/rss", hits, mode
+    srv.shutdown()
+
+
+def test_parses_and_caches_only_max_items(feed_server):
+    url, _, _ = feed_server
+    assert links(v19._fetch_feed("src", url, 3)) == expected(3)
+    cached = v19._feed_state()["feeds"][url]
+    assert links(cached["items"]) == expected(3)
+    assert not cached["complete"]
+
+
+def test_304_when_cache_covers_request(feed_server):
+    url, hits, _ = feed_server
+    v19._fetch_feed("src", url, 8)
+    assert links(v19._fetch_feed("src", url, 8)) == expected(8)
+    assert links(v19._fetch_feed("src", url, 5)) == expected(5)
+    assert hits == [None, ETAG, ETAG]
+
+
+def test_more_items_than_cached_refetches(feed_server):
+    url, hits, _ = feed_server
+    v19._fetch_feed("src", url, 3)
+    more = v19._fetch_feed("src", url, 10)
+    assert hits == [None, None]          # 快取不夠，不帶條件標頭整份重抓
+    assert links(more) == expected(10)
+    assert links(v19._fetch_feed("src", url, 10)) == expected(10)
+    assert hits[-1] == ETAG
+
+
+def test_complete_feed_uses_304_for_any_size(feed_server):
+    url, hits, _ = feed_server
+    assert len(v19._fetch_feed("src", url, 50)) == 20
+    assert v19._feed_state()["feeds"][url]["complete"]
+    assert len(v19._fetch_feed("src", url, 100)) == 20
+    assert hits == [None, ETAG]
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_error_status_falls_back_to_cache(feed_server, status):
+    url, _, mode = feed_server
+    v19._fetch_feed("src", url, 8)
+    mode["status"] = status
+    assert links(v19._fetch_feed("src", url, 5)) == expected(5)
+
+
+def test_error_status_without_cache_is_empty(feed_server):
+    url, _, mode = feed_server
+    mode["status"] = 429
+    assert v19._fetch_feed("src", url, 5) == []
+
+
+def test_network_error_falls_back_to_cache(feed_server):
+    url, _, _ = feed_server
+    v19._fetch_feed("src", url, 20)
+    state = v19._feed_state()
+    state["feeds"]["http://127.0.0.1:9/rss"] = state["feeds"][url]
+    assert len(v19._fetch_feed("src", "http://127.0.0.1:9/rss", 5)) == 5
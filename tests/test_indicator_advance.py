@@ -0,0 +1,99 @@
+"""指標遞推：K 線只在尾端變動時逐根遞推的結果，與整段 calc_indicators 重算一致（浮點誤差內）"""
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import v19
+from test_build_chart import random_bars
+
+KEY = ("TEST", "1m")
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    for fn in (v19._bar_store, v19._indicator_cache, v19._indicator_state):
+        fn.clear()
+    yield
+    for fn in (v19._bar_store, v19._indicator_cache, v19._indicator_state):
+        fn.clear()
+
+
+def put(df: pd.DataFrame) -> pd.DataFrame:
+    """換掉儲存中的 K 線（與 apply_ticks 一樣整筆換新物件）"""
+    store = v19._bar_store()
+    now   = time.time()
+    with store["lock"]:
+        store["bars"][KEY] = {"df": df, "fetched": now, "full_at": now}
+    return df
+
+
+def tick(df: pd.DataFrame, rng) -> pd.DataFrame:
+    """未收盤 K 線跳動：改最後一根的收盤/高低/量"""
+    out = df.copy()
+    px  = float(out["Close"].iloc[-1]) * (1 + rng.normal(0, 0.002))
+    out.iloc[-1, out.columns.get_loc("Close")]  = px
+    out.iloc[-1, out.columns.get_loc("High")]   = max(out["High"].iloc[-1], px)
+    out.iloc[-1, out.columns.get_loc("Low")]    = min(out["Low"].iloc[-1], px)
+    out.iloc[-1, out.columns.get_loc("Volume")] += float(rng.integers(100, 5000))
+    return out
+
+
+def append(df: pd.DataFrame, k: int, rng) -> pd.DataFrame:
+    """新增 k 根 K 線"""
+    last  = float(df["Close"].iloc[-1])
+    close = last * np.exp(np.cumsum(rng.normal(0, 0.002, k)))
+    idx   = pd.date_range(df.index[-1], periods=k + 1, freq=df.index[-1] - df.index[-2])[1:]
+    new   = pd.DataFrame({"Open": np.r_[last, close[:-1]], "High": close * 1.001,
+                          "Low": close * 0.999, "Close": close,
+                          "Volume": rng.lognormal(13, 0.3, k)}, index=idx)
+    return pd.concat([df, new[df.columns]])
+
+
+def assert_matches_full(df: pd.DataFrame):
+    pd.testing.assert_frame_equal(v19.get_indicators(df), v19.calc_indicators(df),
+                                  check_exact=False, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tail_updates_match_full_recompute(seed):
+    rng = np.random.default_rng(seed)
+    df  = put(random_bars(seed, 300)[["Open", "High", "Low", "Close", "Volume"]])
+    assert_matches_full(df)
+    for _ in range(60):
+        df = put(tick(df, rng) if rng.random() < 0.7 else append(df, int(rng.integers(1, 4)), rng))
+        assert_matches_full(df)
+    stats = v19._indicator_state()["stats"]
+    assert stats["incremental"] == 60 and stats["full"] == 1
+
+
+def test_one_bar_at_a_time(seed=7):
+    rng = np.random.default_rng(seed)
+    df  = put(random_bars(seed, 120)[["Open", "High", "Low", "Close", "Volume"]])
+    v19.get_indicators(df)
+    for _ in range(40):
+        df = put(append(df, 1, rng))
+        assert_matches_full(df)
+
+
+def test_rewritten_history_falls_back_to_full():
+    rng = np.random.default_rng(1)
+    df  = put(random_bars(1, 200)[["Open", "High", "Low", "Close", "Volume"]])
+    v19.get_indicators(df)
+
+    adj = df.copy()
+    adj.iloc[50, adj.columns.get_loc("Close")] *= 1.05   # 資料修正改寫中段，同時來了新 K 線
+    adj = put(append(adj, 1, rng))
+    assert_matches_full(adj)
+
+    trimmed = put(append(adj, 1, rng).iloc[1:])           # 前端裁切
+    assert_matches_full(trimmed)
+    assert v19._indicator_state()["stats"]["full"] == 3
+
+
+def test_copy_is_not_advanced():
+    df = put(random_bars(2, 200)[["Open", "High", "Low", "Close", "Volume"]])
+    v19.get_indicators(df)
+    assert_matches_full(tick(df, np.random.default_rng(0)))   # 不在儲存中的複本
+    assert v19._indicator_state()["stats"]["incremental"] == 0
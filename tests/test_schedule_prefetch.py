@@ -0,0 +1,48 @@
+"""schedule_prefetch：同一組工作不重複排程，跑完的工作不會一直留在表裡"""
+import threading
+
+import pytest
+
+import v19
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    out, gate = [], threading.Event()
+
+    def prefetch_data(symbols, intervals, lead):
+        out.append((tuple(symbols), tuple(intervals)))
+        gate.wait(5)
+
+    monkeypatch.setattr(v19, "prefetch_data", prefetch_data)
+    v19._background_jobs.clear()
+    yield out, gate
+    gate.set()
+    v19._background_jobs.clear()
+
+
+def test_running_job_is_reused(calls):
+    out, gate = calls
+    first = v19.schedule_prefetch(["TSLA"], ["1d"])
+    assert v19.schedule_prefetch(["TSLA"], ["1d"]) is first
+    gate.set()
+    first.result(5)
+    assert out == [(("TSLA",), ("1d",))]
+
+
+def test_finished_jobs_are_dropped(calls):
+    _, gate = calls
+    gate.set()
+    for i in range(50):
+        v19.schedule_prefetch([f"S{i}"], ["1d"]).result(5)
+    v19.schedule_prefetch(["LAST"], ["1d"])
+    jobs = v19._background_jobs()["jobs"]
+    assert set(jobs) <= {(("LAST",), ("1d",))}
+
+
+def test_rerun_after_done(calls):
+    out, gate = calls
+    gate.set()
+    v19.schedule_prefetch(["TSLA"], ["1d"]).result(5)
+    v19.schedule_prefetch(["TSLA"], ["1d"]).result(5)
+    assert len(out) == 2
@@ -0,0 +1,105 @@
+"""即時串流訂閱：各 session 各自訂閱，串流聯集，只有最後一個訂閱者離開才斷線"""
+import threading
+import time
+
+import pytest
+
+import v19
+
+
+def wait_for(cond, timeout: float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return cond()
+
+
+class FakeSource:
+    """記錄每次連線訂閱的股票，阻塞到 stop"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, symbols, emit, stop):
+        self.calls.append(tuple(symbols))
+        stop.wait()
+
+
+def feeds() -> list:
+    return [t for t in threading.enumerate() if t.name == "v19-stream-feed"]
+
+
+@pytest.fixture
+def source(monkeypatch):
+    monkeypatch.setattr(v19, "STREAM_FLUSH_SEC", 0.02)
+    v19._stream_state.clear()
+    src = FakeSource()
+    yield src
+    state = v19._stream_state()
+    with state["lock"]:
+        owners = list(state["subs"])
+    for owner in owners:
+        v19.stop_stream(owner)
+    v19._stream_state.clear()
+
+
+def test_union_of_sessions(source):
+    state = v19.start_stream(["TSLA"], source, owner="a")
+    v19.start_stream(["AAPL", "TSLA"], owner="b")
+    assert state["symbols"] == ("AAPL", "TSLA")
+    assert wait_for(lambda: source.calls[-1:] == [("AAPL", "TSLA")])
+
+
+def test_same_union_does_not_reconnect(source):
+    v19.start_stream(["TSLA", "AAPL"], source, owner="a")
+    assert wait_for(lambda: len(source.calls) == 1)
+    stop = v19._stream_state()["stop"]
+    v19.start_stream(["AAPL"], owner="b")
+    v19.start_stream(["TSLA", "AAPL"], owner="a")   # 頁面續約
+    assert v19._stream_state()["stop"] is stop
+    assert not stop.is_set()
+
+
+def test_stop_from_other_session_keeps_stream(source):
+    state = v19.start_stream(["TSLA"], source, owner="a")
+    stop  = state["stop"]
+    v19.stop_stream("b")   # 沒開串流的 session 每次重跑都會呼叫
+    assert not stop.is_set()
+    assert state["symbols"] == ("TSLA",)
+
+
+def test_last_subscriber_stops_stream(source):
+    state = v19.start_stream(["TSLA"], source, owner="a")
+    v19.start_stream(["AAPL"], owner="b")
+    v19.stop_stream("a")
+    assert state["symbols"] == ("AAPL",)
+    assert state["stop"] is not None and not state["stop"].is_set()
+    stop = state["stop"]
+    v19.stop_stream("b")
+    assert stop.is_set()
+    assert state["stop"] is None and state["symbols"] == ()
+
+
+def test_expired_session_is_dropped(source):
+    state = v19.start_stream(["TSLA"], source, owner="engine")
+    v19.start_stream(["AAPL"], owner="tab", ttl=0.05)
+    assert state["symbols"] == ("AAPL", "TSLA")
+    assert wait_for(lambda: state["symbols"] == ("TSLA",))
+    assert "tab" not in state["subs"]
+
+
+def test_expired_last_session_stops(source):
+    state = v19.start_stream(["TSLA"], source, owner="tab", ttl=0.05)
+    assert wait_for(lambda: state["stop"] is None)
+    assert wait_for(lambda: not feeds())
+
+
+def test_missing_websocket_is_fatal(source, monkeypatch):
+    monkeypatch.delattr(v19.yf, "WebSocket", raising=False)
+    monkeypatch.setattr(v19, "STREAM_RETRY_SEC", 0.01)
+    state = v19.start_stream(["TSLA"], v19.yahoo_tick_source, owner="a")
+    assert wait_for(lambda: state["fatal"])
+    assert "WebSocket" in state["error"]
+    assert wait_for(lambda: not feeds())   # 不會一直重試
@@ -0,0 +1,88 @@
+"""Telegram 發送佇列：清空 cache_resource 後不會留下多餘的 worker"""
+import threading
+import time
+
+import pytest
+
+import v19
+
+
+def workers() -> list:
+    return [t for t in threading.enumerate() if t.name == "v19-telegram"]
+
+
+def wait_for(cond, timeout: float = 5.0) -> bool:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return cond()
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    out = []
+    monkeypatch.setattr(v19, "TG_COALESCE_SEC", 0.05)
+    monkeypatch.setattr(v19, "TG_MIN_INTERVAL", 0.0)
+    monkeypatch.setattr(v19, "_telegram_post", lambda sess, token, chat_id, text: out.append(text) or True)
+    v19._telegram_outbox.clear()
+    yield out
+    v19._telegram_outbox.clear()
+
+
+def test_clear_retires_old_worker(sent):
+    old = v19._telegram_outbox()
+    old["queue"].put(("t", "c", "before clear"))
+    v19._telegram_outbox.clear()
+    new = v19._telegram_outbox()
+    assert new is not old
+    new["queue"].put(("t", "c", "after clear"))
+
+    # 舊 worker 送完佇列裡的訊息後結束，只剩一條
+    assert wait_for(lambda: len(workers()) == 1)
+    assert wait_for(lambda: sorted(sent) == ["after clear", "before clear"])
+
+
+def test_repeated_clear_keeps_one_worker(sent):
+    for _ in range(5):
+        v19._telegram_outbox.clear()
+        v19._telegram_outbox()
+    assert wait_for(lambda: len(workers()) == 1)
+
+
+def test_flush_sends_queued_without_waiting(sent, monkeypatch):
+    monkeypatch.setattr(v19, "TG_COALESCE_SEC", 30.0)
+    v19._telegram_outbox()["queue"].put(("t", "c", "queued before exit"))
+    t0 = time.monotonic()
+    assert v19.flush_telegram(timeout=5.0)
+    assert time.monotonic() - t0 < 5.0
+    assert sent == ["queued before exit"]
+    assert not workers()
+
+
+def test_flush_without_worker_is_noop(sent):
+    assert v19.flush_telegram(timeout=1.0)
+    assert not workers()
+
+
+def test_send_after_flush_starts_new_worker(sent):
+    v19._telegram_outbox()
+    assert v19.flush_telegram(timeout=5.0)
+    v19._telegram_outbox()["queue"].put(("t", "c", "after flush"))
+    assert wait_for(lambda: sent == ["after flush"])
+
+
+def test_engine_once_flushes_before_return(sent, monkeypatch):
+    import alert_engine
+
+    monkeypatch.setattr(v19, "TG_COALESCE_SEC", 30.0)
+
+    def scan_once(symbols, intervals, seen, pool):
+        v19._telegram_outbox()["queue"].put(("t", "c", "engine alert"))
+        return []
+
+    monkeypatch.setattr(alert_engine, "scan_once", scan_once)
+    alert_engine.run(["TSLA"], ["1d"], every=0, workers=1, once=True)
+    assert sent == ["engine alert"]
+    assert not workers()
@@ -1,17 +1,35 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import yfinance as yf
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pyarrow as pa
+import pyarrow.feather as feather
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from collections import OrderedDict, deque
 from datetime import datetime
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import wraps
+import hashlib
+import html as html_lib
+import json
+import os
+import queue
+import re
+import threading
 import time
 import requests
+import xml.etree.ElementTree as ET
+import zlib
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 頁面設定
 # ══════════════════════════════════════════════════════════════════════════════
-st.set_page_config(
+PAGE_CONFIG = dict(
     page_title="美股即時監控系統",
     page_icon="📈",
     layout="wide",
@@ -21,7 +39,7 @@ st.set_page_config(
 # ══════════════════════════════════════════════════════════════════════════════
 # CSS
 # ══════════════════════════════════════════════════════════════════════════════
-st.markdown("""
+PAGE_CSS = """
 <style>
     .block-container { padding-top: 1rem; }
 
@@ -194,7 +212,7 @@ st.markdown("""
     @keyframes ai-pulse { 0%,100%{opacity:1} 50%{opacity:0.4} }
     .ai-loading-dot { animation: ai-pulse 1.2s infinite; }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 常數
@@ -211,6 +229,13 @@ INTERVAL_MAP = {
 ALL_INTERVALS   = list(INTERVAL_MAP.keys())
 INTERVAL_LABELS = {k: v[0] for k, v in INTERVAL_MAP.items()}
 
+# 各資料來源的新鮮度（秒）：超過才重新抓取，刷新時只讓過期的來源失效
+FRESHNESS = {
+    "1m":  60,   "5m":  60,   "15m": 120,  "30m": 300,
+    "1d":  300,  "1wk": 1800, "1mo": 3600,
+    "market": 120, "news": 300,
+}
+
 EMA_CONFIGS = [
     (5,   "#00ff88"), (10,  "#ccff00"), (20,  "#ffaa00"),
     (30,  "#ff5500"), (40,  "#cc00ff"), (60,  "#0088ff"),
@@ -218,11 +243,62 @@ EMA_CONFIGS = [
 ]
 MA_CONFIGS = [(5, "#ffffff", "dash"), (15, "#ffdd66", "dot")]
 
-# ══════════════════════════════════════════════════════════════════════════════
-# Session State
-# ══════════════════════════════════════════════════════════════════════════════
-if "alert_log"   not in st.session_state: st.session_state.alert_log   = []
-if "sent_alerts" not in st.session_state: st.session_state.sent_alerts = set()
+# ── 階段計時：各階段累計「扣掉巢狀子階段」的耗時，設定 STAGE_LOG 時每次重跑寫一行 JSON ──
+# 模組在每次重跑都重新執行，所以 _stage_totals 就是本輪的統計
+_stage_totals = {}                 # 階段 -> [秒, 次數]
+_stage_lock   = threading.Lock()
+_stage_local  = threading.local()
+
+@contextmanager
+def stage_timer(name: str):
+    stack = _stage_local.__dict__.setdefault("stack", [])
+    stack.append(0.0)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        dt    = time.perf_counter() - t0
+        child = stack.pop()
+        if stack:
+            stack[-1] += dt
+        with _stage_lock:
+            tot = _stage_totals.setdefault(name, [0.0, 0])
+            tot[0] += dt - child
+            tot[1] += 1
+
+def timed_stage(name: str):
+    """函式版 stage_timer"""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def write_stage_log(total: float):
+    """secrets / 環境變數 STAGE_LOG 指定 JSONL 路徑時，附加本輪 {time, total, stages}"""
+    try:
+        path = st.secrets["STAGE_LOG"]
+    except Exception:
+        path = os.environ.get("STAGE_LOG")
+    if not path:
+        return
+    with _stage_lock:
+        stages = {k: {"sec": round(v[0], 6), "n": v[1]} for k, v in _stage_totals.items()}
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "total": round(total, 6),
+                                "stages": stages}, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+# 警示去重：同一 (股票, 週期, 規則, K 線時間) 在 TTL 內只發一次，最多記 N 筆
+ALERT_DEDUP_TTL  = 6 * 3600
+ALERT_DEDUP_SIZE = 2000
+# 狀態型規則：條件可能連續成立很多根 K 線，整段只發一次，條件轉為不成立後才重新觸發；
+# 其餘（交叉、突破、放量）是邊緣觸發，依 K 線時間去重
+ALERT_STATE_RULES = {"ema_stack_bull"}
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 市場環境數據
@@ -239,46 +315,72 @@ MARKET_TICKERS = {
     "UUP":  ("美元指數ETF", "uup"),
 }
 
-@st.cache_data(ttl=120)
+MARKET_HISTORY_PERIOD = "30d"   # 一次涵蓋大盤卡片（最後兩根）與 VIX 近 30 日走勢
+
+def _fetch_market_close(ticker: str):
+    """單一代號備援：先試 Ticker.history，空的再試 yf.download，回傳收盤價序列或 None"""
+    try:
+        df = yf.Ticker(ticker).history(period=MARKET_HISTORY_PERIOD, interval="1d",
+                                       auto_adjust=True)
+        if df.empty:
+            df = yf.download(ticker, period=MARKET_HISTORY_PERIOD, interval="1d",
+                             auto_adjust=True, progress=False)
+        df.columns = [str(c[0]).strip() if isinstance(c, tuple) else str(c).strip()
+                      for c in df.columns]
+        if "Close" not in df.columns:
+            return None
+        close = df["Close"].dropna()
+        return close if len(close) else None
+    except Exception:
+        return None
+
+@st.cache_data(ttl=FRESHNESS["market"])
+def fetch_market_history() -> dict:
+    """
+    所有 MARKET_TICKERS 經 data_provider 一次批次抓近 30 日日K，回傳 {ticker: 收盤價序列}。
+    用 yfinance 時批次中缺漏的代號才個別備援，且備援請求彼此並行。
+    """
+    tickers  = list(MARKET_TICKERS)
+    closes   = {}
+    provider = data_provider()
+    try:
+        for t, df in provider(tickers, "1d", period=MARKET_HISTORY_PERIOD).items():
+            if "Close" in df.columns:
+                close = df["Close"].dropna()
+                if len(close):
+                    closes[t] = close
+    except Exception:
+        pass
+
+    failed = [t for t in tickers if t not in closes]
+    if failed and provider is yahoo_bar_provider:
+        with ThreadPoolExecutor(max_workers=len(failed)) as pool:
+            for t, close in zip(failed, pool.map(_fetch_market_close, failed)):
+                if close is not None:
+                    closes[t] = close
+    return closes
+
+@timed_stage("market")
 def fetch_market_data() -> dict:
-    """抓取大盤環境數據，快取 2 分鐘"""
+    """大盤環境數據（由 fetch_market_history 的批次結果整理，快取 2 分鐘）"""
+    closes = fetch_market_history()
     result = {}
     for ticker, (name, key) in MARKET_TICKERS.items():
-        try:
-            t  = yf.Ticker(ticker)
-            df = t.history(period="5d", interval="1d", auto_adjust=True)
-            if df.empty:
-                # fallback: try download
-                df = yf.download(ticker, period="5d", interval="1d",
-                                 auto_adjust=True, progress=False)
-                if df.empty:
-                    continue
-                df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
-            # normalize columns
-            df.columns = [str(c[0]).strip() if isinstance(c, tuple) else str(c).strip()
-                          for c in df.columns]
-            if "Close" not in df.columns:
-                continue
-            last  = float(df["Close"].dropna().iloc[-1])
-            prev  = float(df["Close"].dropna().iloc[-2]) if len(df["Close"].dropna()) > 1 else last
-            chg   = last - prev
-            pct   = chg / prev * 100 if prev else 0
-            result[key] = {"name": name, "ticker": ticker,
-                           "last": last, "chg": chg, "pct": pct}
-        except Exception:
-            pass
+        close = closes.get(ticker)
+        if close is None:
+            continue
+        last  = float(close.iloc[-1])
+        prev  = float(close.iloc[-2]) if len(close) > 1 else last
+        chg   = last - prev
+        pct   = chg / prev * 100 if prev else 0
+        result[key] = {"name": name, "ticker": ticker,
+                       "last": last, "chg": chg, "pct": pct}
     return result
 
-@st.cache_data(ttl=120)
 def fetch_vix_history() -> pd.Series:
-    """VIX 近 30 日歷史，用於趨勢判斷"""
-    try:
-        df = yf.download("^VIX", period="30d", interval="1d",
-                         auto_adjust=True, progress=False)
-        df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
-        return df["Close"].dropna()
-    except Exception:
-        return pd.Series(dtype=float)
+    """VIX 近 30 日歷史，用於趨勢判斷（與大盤數據同一次批次下載）"""
+    close = fetch_market_history().get("^VIX")
+    return close if close is not None else pd.Series(dtype=float)
 
 def get_vix_regime(vix: float) -> tuple:
     """回傳 (狀態描述, 顏色, 條寬%) """
@@ -289,91 +391,172 @@ def get_vix_regime(vix: float) -> tuple:
     if vix < 40:   return ("恐慌模式 🔴",  "#ff4444", 78)
     return             ("極度恐慌 💀",    "#cc0000", 95)
 
-@st.cache_data(ttl=300)
-def fetch_news(max_items: int = 8) -> list:
+NEWS_FEEDS = [
+    ("Google Finance News",
+     "https://news.google.com/rss/search?q=stock+market+wall+street&hl=en-US&gl=US&ceid=US:en"),
+    ("Google Economy News",
+     "https://news.google.com/rss/search?q=fed+interest+rate+inflation+nasdaq&hl=en-US&gl=US&ceid=US:en"),
+    ("MarketWatch",
+     "https://feeds.content.dowjones.io/public/rss/mw_marketpulse"),
+]
+NEWS_BEAR_KW = ["crash","fall","drop","decline","slump","fear","recession","selloff",
+                "inflation","rate hike","sell-off","warning","risk","loss","tumble",
+                "plunge","weak","concern","worry","tariff","yield surge"]
+NEWS_BULL_KW = ["rally","surge","gain","rise","record","growth","beat","strong",
+                "upgrade","buy","bull","positive","profit","rebound","recover",
+                "outperform","soar","climb","boost","optimism"]
+NEWS_HEADERS = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+                              "AppleWebKit/537.36 (KHTML, like Gecko) "
+                              "Chrome/120.0.0.0 Safari/537.36"}
+NEWS_GUID_CACHE_SIZE = 500
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    """跨 session 共用的 keep-alive 連線池"""
+    sess    = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    sess.mount("https://", adapter)
+    sess.mount("http://", adapter)
+    return sess
+
+@st.cache_resource
+def _feed_state() -> dict:
     """
-    多來源財經新聞抓取：
-    1. Google News RSS（最可靠，免費）
-    2. MarketWatch RSS fallback
-    回傳 list of dict: {title, link, date, sentiment}
+    RSS 條件式請求狀態：
+      feeds: {url: {etag, last_modified, items, complete}}  → 304 時直接沿用上次結果
+      guids: {(來源, guid): item}                            → 內容沒變的條目不重新解析
     """
-    import re, html as html_lib
+    return {"feeds": {}, "guids": OrderedDict(), "lock": threading.Lock()}
 
-    FEEDS = [
-        ("Google Finance News",
-         "https://news.google.com/rss/search?q=stock+market+wall+street&hl=en-US&gl=US&ceid=US:en"),
-        ("Google Economy News",
-         "https://news.google.com/rss/search?q=fed+interest+rate+inflation+nasdaq&hl=en-US&gl=US&ceid=US:en"),
-        ("MarketWatch",
-         "https://feeds.content.dowjones.io/public/rss/mw_marketpulse"),
-    ]
-    BEAR_KW = ["crash","fall","drop","decline","slump","fear","recession","selloff",
-               "inflation","rate hike","sell-off","warning","risk","loss","tumble",
-               "plunge","weak","concern","worry","tariff","yield surge"]
-    BULL_KW = ["rally","surge","gain","rise","record","growth","beat","strong",
-               "upgrade","buy","bull","positive","profit","rebound","recover",
-               "outperform","soar","climb","boost","optimism"]
-
-    headers = {"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-                              "AppleWebKit/537.36 (KHTML, like Gecko) "
-                              "Chrome/120.0.0.0 Safari/537.36"}
-    items = []
+def _news_sentiment(title: str) -> str:
+    tl = title.lower()
+    if   any(w in tl for w in NEWS_BEAR_KW): return "bear"
+    elif any(w in tl for w in NEWS_BULL_KW): return "bull"
+    return "neu"
 
-    for src_name, feed_url in FEEDS:
-        if len(items) >= max_items:
-            break
-        try:
-            resp = requests.get(feed_url, timeout=8, headers=headers)
-            if resp.status_code != 200:
-                continue
-            text = resp.text
-
-            # Parse <item> blocks
-            item_blocks = re.findall(r"<item>(.*?)</item>", text, re.DOTALL)
-            for block in item_blocks:
-                if len(items) >= max_items:
-                    break
-                # Title
-                t_match = re.search(r"<title>(.*?)</title>", block, re.DOTALL)
-                if not t_match:
-                    continue
-                title = t_match.group(1)
-                title = re.sub(r"<!\[CDATA\[(.*?)\]\]>", r"", title)
-                title = re.sub(r"<[^>]+>", "", title)
+NEWS_CHUNK_BYTES = 16 * 1024
+
+def _iter_feed_items(chunks):
+    """
+    以 XMLPullParser 邊下載邊解析，逐一產出 <item> 的 {子標籤: 文字}。
+    CDATA 由 XML 解析器直接還原成文字；呼叫端停止迭代就不再讀取剩餘內容。
+    """
+    parser = ET.XMLPullParser(events=("end",))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            if elem.tag == "item":
+                yield {child.tag: (child.text or "") for child in elem}
+                elem.clear()
+
+def _parse_feed_items(chunks, src_name: str, max_items, guids: dict) -> list:
+    """
+    解析 RSS 串流；guid 已在快取中的條目直接沿用，不再做標題/日期/情緒處理。
+    max_items 為 None 時解析整份 feed，否則取滿就停止讀取。
+    """
+    items = []
+    try:
+        for fields in _iter_feed_items(chunks):
+            guid = fields.get("guid", "").strip()
+            if guid and (src_name, guid) in guids:
+                items.append(guids[(src_name, guid)])
+            else:
+                # Title（去除殘留 HTML 標籤與二次跳脫的實體）
+                title = re.sub(r"<[^>]+>", "", fields.get("title", ""))
                 title = html_lib.unescape(title).strip()
                 if not title or len(title) < 10:
                     continue
 
-                # Link
-                l_match = re.search(r"<link>(.*?)</link>", block)
-                if not l_match:
-                    l_match = re.search(r"<guid[^>]*>(.*?)</guid>", block)
-                link = l_match.group(1).strip() if l_match else "#"
+                link = fields.get("link", "").strip() or guid or "#"
 
-                # Date
-                d_match = re.search(r"<pubDate>(.*?)</pubDate>", block)
-                raw_date = d_match.group(1).strip() if d_match else ""
+                raw_date = fields.get("pubDate", "").strip()
                 try:
-                    from email.utils import parsedate_to_datetime
-                    dt = parsedate_to_datetime(raw_date)
-                    date_str = dt.strftime("%m/%d %H:%M")
+                    date_str = parsedate_to_datetime(raw_date).strftime("%m/%d %H:%M")
                 except Exception:
                     date_str = raw_date[:16]
 
-                # Sentiment
-                tl = title.lower()
-                if   any(w in tl for w in BEAR_KW): sentiment = "bear"
-                elif any(w in tl for w in BULL_KW): sentiment = "bull"
-                else:                                sentiment = "neu"
-
-                items.append({
+                item = {
                     "title": title, "link": link,
-                    "date": date_str, "sentiment": sentiment,
+                    "date": date_str, "sentiment": _news_sentiment(title),
                     "source": src_name,
-                })
+                }
+                if guid:
+                    guids[(src_name, guid)] = item
+                items.append(item)
+            if max_items is not None and len(items) >= max_items:
+                break
+    except ET.ParseError:
+        pass   # 格式錯誤的 feed：保留已解析的條目
+    return items
+
+def _fetch_feed(src_name: str, feed_url: str, max_items: int) -> list:
+    """
+    抓單一 RSS：帶 ETag / If-Modified-Since，304 時回傳上次解析結果。
+    只解析到 max_items 則就停（快取也只存這些）；之後有人要更多條目、
+    而快取不夠時就不帶條件標頭整份重抓，免得 304 回傳的條目變少。
+    抓取失敗（網路錯誤、429、5xx）時沿用上次的結果。
+    """
+    state = _feed_state()
+    with state["lock"]:
+        prev = state["feeds"].get(feed_url)
+    headers = dict(NEWS_HEADERS)
+    if prev and (prev["complete"] or len(prev["items"]) >= max_items):
+        if prev.get("etag"):
+            headers["If-None-Match"] = prev["etag"]
+        if prev.get("last_modified"):
+            headers["If-Modified-Since"] = prev["last_modified"]
+    fallback = prev["items"][:max_items] if prev else []
+    try:
+        resp = _http_session().get(feed_url, timeout=8, headers=headers, stream=True)
+    except Exception:
+        return fallback
+
+    with resp:
+        if resp.status_code == 304 and prev:
+            return fallback
+        if resp.status_code != 200:
+            return fallback
+
+        with state["lock"]:
+            guids = dict(state["guids"])
+        try:
+            items = _parse_feed_items(resp.iter_content(chunk_size=NEWS_CHUNK_BYTES),
+                                      src_name, max_items, guids)
         except Exception:
-            continue
+            return fallback
+
+    with state["lock"]:
+        state["feeds"][feed_url] = {
+            "etag":          resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "items":         items,
+            "complete":      len(items) < max_items,   # 整份 feed 都在快取裡
+        }
+        cache = state["guids"]
+        for it_key, it in guids.items():
+            if it_key not in cache:
+                cache[it_key] = it
+        while len(cache) > NEWS_GUID_CACHE_SIZE:
+            cache.popitem(last=False)
+    return items
+
+def fetch_news(max_items: int = 8) -> list:
+    """
+    多來源財經新聞抓取：
+    1. Google News RSS（最可靠，免費）
+    2. MarketWatch RSS fallback
+    三個來源以共用連線池並行請求（條件式 GET，沒更新的回 304），
+    再依來源順序取滿 max_items。
+    回傳 list of dict: {title, link, date, sentiment}
+    """
+    with ThreadPoolExecutor(max_workers=len(NEWS_FEEDS)) as pool:
+        per_feed = list(pool.map(lambda f: _fetch_feed(f[0], f[1], max_items), NEWS_FEEDS))
 
+    items = []
+    for feed_items in per_feed:
+        items.extend(feed_items[:max_items - len(items)])
+        if len(items) >= max_items:
+            break
     return items
 
 def calc_sentiment_score(mkt: dict, vix_hist: pd.Series) -> dict:
@@ -485,8 +668,9 @@ def render_market_environment():
                 showlegend=False, xaxis=dict(visible=False),
                 yaxis=dict(showgrid=False, tickfont=dict(size=9, color="#556688")),
             )
-            st.plotly_chart(vix_fig, use_container_width=True,
-                            config={"displayModeBar": False}, key="vix_mini")
+            with stage_timer("serialize"):
+                st.plotly_chart(vix_fig, use_container_width=True,
+                                config={"displayModeBar": False}, key="vix_mini")
 
     with col_sent:
         sent = calc_sentiment_score(mkt, vix_hist)
@@ -615,13 +799,14 @@ def build_analysis_prompt(symbol: str, interval_label: str, df: pd.DataFrame,
     low_  = float(df["Low"].iloc[-1])
     vol   = int(df["Volume"].iloc[-1])
 
+    ind   = get_indicators(df).iloc[-1]
+
     # EMA 數值
-    ema_vals = {n: round(float(calc_ema(close, n).iloc[-1]), 2) for n, _ in EMA_CONFIGS}
+    ema_vals = {n: round(float(ind[f"EMA{n}"]), 2) for n, _ in EMA_CONFIGS}
     # MACD
-    dif, dea, hist = calc_macd(close)
-    dif_val  = round(float(dif.iloc[-1]), 4)
-    dea_val  = round(float(dea.iloc[-1]), 4)
-    hist_val = round(float(hist.iloc[-1]), 4)
+    dif_val  = round(float(ind["DIF"]), 4)
+    dea_val  = round(float(ind["DEA"]), 4)
+    hist_val = round(float(ind["HIST"]), 4)
     # 金叉死叉
     macd_sig = "金叉(多)" if dif_val > dea_val else "死叉(空)"
     # 支撐阻力
@@ -629,7 +814,7 @@ def build_analysis_prompt(symbol: str, interval_label: str, df: pd.DataFrame,
     resist  = round(max(p[1] for p in pivots_h), 2) if pivots_h else None
     support = round(min(p[1] for p in pivots_l), 2) if pivots_l else None
     # 成交量
-    vol_ma5    = float(df["Volume"].rolling(5).mean().iloc[-1])
+    vol_ma5    = float(ind["VOL_MA5"])
     vol_ratio  = round(vol / vol_ma5, 2) if vol_ma5 > 0 else 1
     # 趨勢
     trend = detect_trend(df)
@@ -706,12 +891,99 @@ def build_analysis_prompt(symbol: str, interval_label: str, df: pd.DataFrame,
     return prompt
 
 
+# 多週期精簡 prompt：每個週期一列數字，欄位說明只寫一次
+MTF_PROMPT_COLS = ["px", "r5", "atr", "trend", "stack", "above", "d20", "d60", "d200",
+                   "dif", "dea", "hist", "macd", "R", "S", "vr"]
+MTF_PROMPT_LEGEND = ("px 最新價 | r5 近5根漲跌% | atr 近20根平均波幅 | trend 均線趨勢 | "
+                     "stack EMA 由高到低排列 | above 價格站上幾條EMA(共8) | "
+                     "d20/d60/d200 價格相對該EMA % | dif/dea/hist MACD(12,26,9) | "
+                     "macd 訊號 | R/S 最近阻力/支撐 | vr 量/5均量")
+
+def _prompt_features(df: pd.DataFrame, interval: str) -> list:
+    """單一週期的指標摘要，順序同 MTF_PROMPT_COLS；指標沿用 get_indicators 快取"""
+    ind   = get_indicators(df)
+    row   = ind.iloc[-1]
+    close = df["Close"]
+    last  = float(close.iloc[-1])
+    n     = len(df)
+
+    emas  = {span: float(row[f"EMA{span}"]) for span, _ in EMA_CONFIGS}
+    stack = ">".join(str(s) for s in sorted(emas, key=emas.get, reverse=True))
+    dif   = ind["DIF"].to_numpy()[-2:]
+    dea   = ind["DEA"].to_numpy()[-2:]
+    pivots_h, pivots_l = calc_pivot(df, interval)
+    vol_ma5 = float(row["VOL_MA5"])
+    pct     = lambda v: round((last / v - 1) * 100, 2) if v else None
+    return [
+        round(last, 2),
+        round((last / float(close.iloc[-6]) - 1) * 100, 2) if n > 6 else 0,
+        round(float((df["High"] - df["Low"]).tail(20).mean()), 2),
+        detect_trend(df),
+        stack,
+        sum(last > v for v in emas.values()),
+        pct(emas[20]), pct(emas[60]), pct(emas[200]),
+        round(float(dif[-1]), 4), round(float(dea[-1]), 4), round(float(row["HIST"]), 4),
+        _macd_of(n, dif, dea),
+        round(max(p[1] for p in pivots_h), 2) if pivots_h else None,
+        round(min(p[1] for p in pivots_l), 2) if pivots_l else None,
+        round(float(df["Volume"].iloc[-1]) / vol_ma5, 2) if vol_ma5 > 0 else 1,
+    ]
+
+def build_mtf_prompt(symbol: str, frames: dict, mkt: dict = None) -> str:
+    """
+    多週期合併成一個 prompt：frames 為 {週期: df}，每週期一列緊湊 JSON，
+    一次請求取得跨週期的判斷，取代每個週期各問一次。
+    """
+    rows = {INTERVAL_MAP[itvl][0]: _prompt_features(df, itvl)
+            for itvl, df in frames.items() if not df.empty}
+    if not rows:
+        return ""
+    payload = {"sym": symbol, "cols": MTF_PROMPT_COLS, "tf": rows}
+    if mkt:
+        spy, vix = mkt.get("spy", {}), mkt.get("vix", {})
+        if spy: payload["spy"] = [round(spy.get("last", 0), 2), round(spy.get("pct", 0), 2)]
+        if vix: payload["vix"] = round(vix.get("last", 20), 1)
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    tfs  = "/".join(rows)
+
+    return f"""你是專業美股技術分析師。以下是 {symbol} 的多週期技術指標（{tfs}，由短到長），請綜合各週期是否共振，給出一個操作建議。
+欄位：{MTF_PROMPT_LEGEND}
+{data}
+只回覆 JSON：{{"verdict":"做多/做空/觀望","confidence":0-100,"tf_bias":{{"週期":"多/空/盤"}},"trend_analysis":"2-3句，說明各週期方向","entry_price":數字,"entry_note":"進場條件","take_profit_1":數字,"take_profit_2":數字,"stop_loss":數字,"risk_reward":"1:x","key_risks":"1-2點","reasoning":"繁體中文150字內"}}
+價位依較長週期的支撐阻力與 ATR 計算；止損做多設在支撐下方、做空設在阻力上方。"""
+
+def build_ai_prompt(symbol: str, intervals: list, mkt: dict = None) -> str:
+    """一個週期用完整 prompt，多個週期合併成精簡 prompt（只發一次請求）"""
+    if len(intervals) == 1:
+        itvl = intervals[0]
+        df   = fetch_data(symbol, itvl)
+        return "" if df.empty else build_analysis_prompt(symbol, INTERVAL_MAP[itvl][0], df, mkt)
+    return build_mtf_prompt(symbol, {itvl: fetch_data(symbol, itvl) for itvl in intervals}, mkt)
+
+
 # ── AI 供應商設定 ────────────────────────────────────────────────────────────
 AI_PROVIDERS = {
     "Groq LLaMA 3.3（免費）":  "groq",
     "Gemini 2.0 Flash（免費）": "gemini",
     "Claude Sonnet（付費）":   "claude",
+    "⚡ 最快回應（多家競速）":  "race",
 }
+AI_RACE_PROVIDERS = ["groq", "gemini", "claude"]
+
+# API 位址可用 secrets / 環境變數 {GROQ,GEMINI,CLAUDE}_BASE_URL 覆寫（代理或本機測試用）
+AI_BASE_URLS = {
+    "groq":   "https://api.groq.com",
+    "gemini": "https://generativelanguage.googleapis.com",
+    "claude": "https://api.anthropic.com",
+}
+
+def _ai_base_url(provider: str) -> str:
+    name = f"{provider.upper()}_BASE_URL"
+    try:
+        return st.secrets[name].rstrip("/")
+    except Exception:
+        pass
+    return os.environ.get(name, AI_BASE_URLS[provider]).rstrip("/")
 
 def get_ai_key(provider: str) -> str:
     """從 secrets 或 session_state 取得指定供應商的 API Key"""
@@ -728,13 +1000,15 @@ def get_ai_key(provider: str) -> str:
     return st.session_state.get(f"ai_key_{provider}", "")
 
 
-def call_ai_analysis(prompt: str, provider: str) -> dict:
-    """呼叫指定 AI 供應商進行技術分析"""
-    import json
-
-    api_key = get_ai_key(provider)
+def call_ai_analysis(prompt: str, provider: str, api_key: str = None) -> dict:
+    """
+    呼叫指定 AI 供應商進行技術分析（走共用連線池）。
+    在背景執行緒呼叫時要由主執行緒先取好 api_key 傳入，背景讀不到 session_state。
+    """
+    api_key = api_key or get_ai_key(provider)
     if not api_key:
         return {"error": "NO_KEY"}
+    sess = _http_session()
 
     system_msg = (
         "你是專業美股技術分析師，擅長解讀均線、MACD、支撐阻力。"
@@ -745,7 +1019,7 @@ def call_ai_analysis(prompt: str, provider: str) -> dict:
         # ── Gemini ───────────────────────────────────────────────────────────
         if provider == "gemini":
             url = (
-                f"https://generativelanguage.googleapis.com/v1beta/models/"
+                f"{_ai_base_url('gemini')}/v1beta/models/"
                 f"gemini-2.0-flash:generateContent?key={api_key}"
             )
             body = {
@@ -757,7 +1031,7 @@ def call_ai_analysis(prompt: str, provider: str) -> dict:
                     "temperature": 0.3,
                 },
             }
-            resp = requests.post(url, json=body, timeout=30)
+            resp = sess.post(url, json=body, timeout=30)
             if resp.status_code == 400:
                 return {"error": "Gemini API Key 無效，請確認後重新輸入"}
             if resp.status_code != 200:
@@ -767,8 +1041,8 @@ def call_ai_analysis(prompt: str, provider: str) -> dict:
 
         # ── Groq ─────────────────────────────────────────────────────────────
         elif provider == "groq":
-            resp = requests.post(
-                "https://api.groq.com/openai/v1/chat/completions",
+            resp = sess.post(
+                f"{_ai_base_url('groq')}/openai/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {api_key}",
                     "Content-Type": "application/json",
@@ -794,8 +1068,8 @@ def call_ai_analysis(prompt: str, provider: str) -> dict:
 
         # ── Claude ───────────────────────────────────────────────────────────
         elif provider == "claude":
-            resp = requests.post(
-                "https://api.anthropic.com/v1/messages",
+            resp = sess.post(
+                f"{_ai_base_url('claude')}/v1/messages",
                 headers={
                     "Content-Type": "application/json",
                     "x-api-key": api_key,
@@ -834,6 +1108,187 @@ def get_anthropic_key(): return get_ai_key("claude")
 def call_claude_analysis(prompt): return call_ai_analysis(prompt, "claude")
 
 
+# ── AI 工作池：背景執行、結果快取、各供應商限速 ─────────────────────────────
+# 同一根 K 線的 prompt 內容不變，以 sha256(供應商 + prompt) 當快取鍵，
+# 重按「執行分析」或其他 session 分析同一檔同一根 K 線都直接取用結果。
+AI_WORKERS      = 6
+AI_RACE_WORKERS = 6     # 競速模式各供應商呼叫共用的執行緒上限
+AI_CACHE_SIZE   = 200
+AI_POLL_SEC     = 1.5
+AI_CANCELLED    = "CANCELLED"
+# 每個供應商 (同時請求數, 每分鐘請求數)
+AI_RATE_LIMITS = {"groq": (2, 30), "gemini": (2, 60), "claude": (2, 50)}
+
+@st.cache_resource
+def _ai_runner() -> dict:
+    """
+    跨 session 共用：分析工作池、競速用的供應商呼叫池、結果 LRU {key: result}、
+    進行中工作 {key: Future}、限速狀態
+    """
+    return {"pool":    ThreadPoolExecutor(max_workers=AI_WORKERS, thread_name_prefix="v19-ai"),
+            "race":    ThreadPoolExecutor(max_workers=AI_RACE_WORKERS, thread_name_prefix="v19-ai-race"),
+            "results": OrderedDict(), "jobs": {}, "lock": threading.Lock(),
+            "limits":  {p: {"sem": threading.Semaphore(c), "next": 0.0}
+                        for p, (c, _) in AI_RATE_LIMITS.items()}}
+
+def ai_job_key(prompt: str, provider: str) -> str:
+    return hashlib.sha256(f"{provider}\n{prompt}".encode("utf-8")).hexdigest()
+
+# ── 供應商統計：最近 AI_STATS_WINDOW 次呼叫的成敗與延遲，決定競速/備援順序 ─────
+AI_STATS_WINDOW = 20
+
+@st.cache_resource
+def _ai_stats() -> dict:
+    return {"calls": {p: deque(maxlen=AI_STATS_WINDOW) for p in AI_RACE_PROVIDERS},
+            "lock": threading.Lock()}
+
+def ai_provider_stats(provider: str) -> dict:
+    """{n, fail_rate, latency}；latency 為成功呼叫的延遲中位數，沒有紀錄時為 None"""
+    stats = _ai_stats()
+    with stats["lock"]:
+        calls = list(stats["calls"].get(provider, ()))
+    ok = sorted(sec for good, sec in calls if good)
+    return {"n": len(calls),
+            "fail_rate": 1 - len(ok) / len(calls) if calls else 0.0,
+            "latency":   ok[len(ok) // 2] if ok else None}
+
+def rank_ai_providers(providers: list) -> list:
+    """失敗率低的優先、再比延遲；沒有紀錄的排在同失敗率的最前面，讓它有機會被量測"""
+    def score(p):
+        s = ai_provider_stats(p)
+        return (s["fail_rate"], s["latency"] or 0.0)
+    return sorted(providers, key=score)
+
+def _ai_call_limited(runner: dict, prompt: str, provider: str, api_key: str,
+                     cancel: threading.Event = None) -> dict:
+    """
+    取得該供應商的併發名額與下一個發送時段後呼叫 API，並記錄成敗與延遲。
+    cancel 在送出前被設定（競速已有結果）就不送，並把預約的發送時段還回去。
+    """
+    limit   = runner["limits"][provider]
+    spacing = 60.0 / AI_RATE_LIMITS[provider][1]
+    cancel  = cancel or threading.Event()
+    with limit["sem"]:
+        if cancel.is_set():
+            return {"error": AI_CANCELLED}
+        with runner["lock"]:
+            start = max(time.time(), limit["next"])
+            limit["next"] = start + spacing
+        if cancel.wait(max(0.0, start - time.time())):
+            with runner["lock"]:
+                if limit["next"] == start + spacing:   # 之後沒人再預約才還得回去
+                    limit["next"] = start
+            return {"error": AI_CANCELLED}
+        t0 = time.perf_counter()
+        try:
+            result = call_ai_analysis(prompt, provider, api_key)
+        except Exception as e:
+            result = {"error": str(e)}
+        sec = time.perf_counter() - t0
+    if result.get("error") != "NO_KEY":
+        stats = _ai_stats()
+        with stats["lock"]:
+            stats["calls"][provider].append(("error" not in result, sec))
+    return result
+
+def race_ai_analysis(runner: dict, prompt: str, api_keys: dict) -> dict:
+    """
+    依 rank_ai_providers 的順序競速：排第一的立刻送出，它超過近期延遲中位數還沒回覆
+    （或已經失敗）才加問下一家，第一個有效 JSON 勝出。沒有延遲紀錄的供應商不等，直接加問。
+    勝出後還沒送出的請求取消；已送出的 HTTP 請求無法中斷，讓它在背景跑完，
+    結果只用來更新延遲/失敗統計。全部失敗時回傳各家的錯誤。
+    """
+    providers = rank_ai_providers([p for p in AI_RACE_PROVIDERS if api_keys.get(p)])
+    if not providers:
+        return {"error": "NO_KEY"}
+    t0      = time.perf_counter()
+    cancel  = threading.Event()
+    waiting = list(providers)
+    pending = {}
+    errors  = {}
+
+    def launch() -> float:
+        """送出下一家，回傳等它多久再加問（近期延遲中位數，沒有紀錄為 0）"""
+        p = waiting.pop(0)
+        pending[runner["race"].submit(_ai_call_limited, runner, prompt, p, api_keys[p], cancel)] = p
+        return ai_provider_stats(p)["latency"] or 0.0
+
+    try:
+        hedge = launch()
+        while pending:
+            done, _ = wait(pending, timeout=hedge if waiting else None, return_when=FIRST_COMPLETED)
+            if not done:
+                hedge = launch()
+                continue
+            for fut in done:
+                p, result = pending.pop(fut), fut.result()
+                if "error" not in result:
+                    return {**result, "_provider": p, "_latency": time.perf_counter() - t0}
+                errors[p] = result["error"]
+            if waiting:
+                hedge = launch()
+    finally:
+        cancel.set()
+        for fut in pending:
+            fut.cancel()
+    return {"error": "；".join(f"{PROVIDER_INFO[p]['name']}：{e}" for p, e in errors.items())}
+
+def _ai_job(runner: dict, key: str, prompt: str, provider: str, api_key) -> dict:
+    """背景執行；provider 為 race 時 api_key 是 {供應商: Key}"""
+    try:
+        if provider == "race":
+            result = race_ai_analysis(runner, prompt, api_key)
+        else:
+            result = _ai_call_limited(runner, prompt, provider, api_key)
+    except Exception as e:
+        result = {"error": str(e)}
+    with runner["lock"]:
+        runner["results"][key] = result
+        while len(runner["results"]) > AI_CACHE_SIZE:
+            runner["results"].popitem(last=False)
+        runner["jobs"].pop(key, None)
+    return result
+
+def submit_ai_job(prompt: str, provider: str, api_key) -> str:
+    """
+    送出分析工作並立即回傳快取鍵，不等待結果（race 模式的 api_key 為 {供應商: Key}）。
+    已有成功結果或同一工作進行中就不重送；失敗的結果不算數，再按一次會重試。
+    """
+    runner = _ai_runner()
+    key    = ai_job_key(prompt, provider)
+    with runner["lock"]:
+        hit = runner["results"].get(key)
+        if hit is not None and "error" not in hit:
+            runner["results"].move_to_end(key)
+            return key
+        if key not in runner["jobs"]:
+            runner["results"].pop(key, None)
+            runner["jobs"][key] = runner["pool"].submit(_ai_job, runner, key, prompt,
+                                                        provider, api_key)
+    return key
+
+def ai_job_result(key: str) -> tuple:
+    """回傳 ("done", result) / ("running", None) / ("missing", None)"""
+    runner = _ai_runner()
+    with runner["lock"]:
+        if key in runner["results"]:
+            return "done", runner["results"][key]
+        if key in runner["jobs"]:
+            return "running", None
+    return "missing", None
+
+def submit_ai_batch(symbols: list, intervals: list, provider: str, api_key,
+                    mkt: dict = None) -> list:
+    """觀察清單每檔各送一個分析工作（多週期合併成一個 prompt），回傳快取鍵列表；實際併發由供應商限速決定"""
+    prefetch_data(symbols, intervals)
+    keys = []
+    for sym in symbols:
+        prompt = build_ai_prompt(sym, intervals, mkt)
+        if prompt:
+            keys.append(submit_ai_job(prompt, provider, api_key))
+    return keys
+
+
 # 各供應商說明
 PROVIDER_INFO = {
     "groq": {
@@ -864,12 +1319,26 @@ PROVIDER_INFO = {
         "secret_key":  "ANTHROPIC_API_KEY",
         "guide":       "前往 console.anthropic.com → API Keys → Create Key",
     },
+    "race": {
+        "name":        "最快回應",
+        "free":        True,
+        "quota":       "近期最快最穩的先問，逾時或失敗才加問下一家，取第一個有效回覆",
+        "url":         "",
+        "placeholder": "",
+        "secret_key":  "",
+        "guide":       "",
+    },
 }
 
 
 def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
-                       mkt: dict = None):
-    """渲染 AI 技術分析面板（支援 Gemini / Groq / Claude）"""
+                       mkt: dict = None, watchlist: list = None, intervals: list = None):
+    """
+    渲染 AI 技術分析面板（支援 Gemini / Groq / Claude）；分析在背景執行，不卡住頁面。
+    intervals 有多個週期時合併成一個精簡 prompt，df 只在單一週期時使用。
+    """
+    if not intervals:
+        intervals = [{v[0]: k for k, v in INTERVAL_MAP.items()}.get(interval_label, "1d")]
 
     # ── 供應商選擇（放在 session，跨 symbol 共用）─────────────────────────
     provider_labels = list(AI_PROVIDERS.keys())
@@ -894,11 +1363,29 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
         st.markdown("<br>", unsafe_allow_html=True)
         btn_key = f"ai_btn_{symbol}_{interval_label}"
         run_ai  = st.button("🔍 執行分析", key=btn_key, use_container_width=True)
+        run_all = (len(watchlist or []) > 1 and
+                   st.button("🔍 全部分析", key=f"ai_all_{symbol}_{interval_label}",
+                             use_container_width=True,
+                             help="觀察清單每檔都在背景分析，切換股票時直接顯示結果"))
 
     result_key = f"ai_result_{symbol}_{interval_label}_{provider}"
 
+    # ── 競速模式：用所有已設定的 Key，依近期失敗率/延遲排序決定先問誰 ────────
+    if provider == "race":
+        api_key = {p: k for p in AI_RACE_PROVIDERS if (k := get_ai_key(p))}
+        if not api_key:
+            st.warning("⚠️ 請先在任一供應商設定 API Key，才能使用競速模式")
+            return
+        ranked = []
+        for p in rank_ai_providers(list(api_key)):
+            stat = ai_provider_stats(p)
+            lat  = f"{stat['latency']:.1f}s" if stat["latency"] is not None else "—"
+            ranked.append(f"{PROVIDER_INFO[p]['name']} {lat}・失敗 {stat['fail_rate']:.0%}")
+        st.caption("　|　".join(ranked))
+
     # ── 若無 API Key，顯示設定引導 ───────────────────────────────────────
-    api_key = get_ai_key(provider)
+    else:
+        api_key = get_ai_key(provider)
     if not api_key:
         st.markdown(
             f'<div class="ai-panel">'
@@ -924,15 +1411,42 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
             st.rerun()
         return
 
+    # 目前這根 K 線的 prompt 已有結果（含其他 session 或批次分析）就直接顯示；
+    # 否則沿用本 session 上次送出的工作
+    if len(intervals) > 1:
+        prompt = build_mtf_prompt(symbol, {i: fetch_data(symbol, i) for i in intervals}, mkt)
+    else:
+        prompt = build_analysis_prompt(symbol, interval_label, df, mkt)
+    job_key = ai_job_key(prompt, provider)
     if run_ai:
-        st.session_state[result_key] = None
-        with st.spinner(f"🤖 {pinfo['name']} 正在分析..."):
-            prompt = build_analysis_prompt(symbol, interval_label, df, mkt)
-            result = call_ai_analysis(prompt, provider)
-            st.session_state[result_key] = result
-
-    # ── 顯示結果 ────────────────────────────────────────────────────────────
-    result = st.session_state.get(result_key)
+        st.session_state[result_key] = submit_ai_job(prompt, provider, api_key)
+    if run_all:
+        st.session_state["ai_batch"] = submit_ai_batch(watchlist, intervals,
+                                                       provider, api_key, mkt)
+    status, result = ai_job_result(job_key)
+    if status == "missing" and st.session_state.get(result_key):
+        job_key = st.session_state[result_key]
+        status, result = ai_job_result(job_key)
+
+    batch = st.session_state.get("ai_batch") or []
+    if status == "running" or any(ai_job_result(k)[0] == "running" for k in batch):
+        waiting = status == "running"
+
+        @st.fragment(run_every=AI_POLL_SEC)
+        def ai_progress():
+            # 背景工作完成才整頁重跑一次顯示結果，等待期間只有這個片段在輪詢
+            states = [ai_job_result(k)[0] for k in batch]
+            cur    = ai_job_result(job_key)[0]
+            if (waiting and cur != "running") or (not waiting and "running" not in states):
+                st.rerun(scope="app")
+            if waiting:
+                st.info(f"🤖 {pinfo['name']} 正在分析 {symbol}...")
+            if batch:
+                st.caption(f"批次分析 {states.count('done')}/{len(batch)} 完成")
+
+        ai_progress()
+        if waiting:
+            return
 
     if not result:
         st.markdown(
@@ -951,6 +1465,9 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
             st.rerun()
         st.error(f"❌ AI 分析失敗：{err}")
         return
+    if result.get("_provider"):
+        st.caption(f"⚡ {PROVIDER_INFO[result['_provider']]['name']} 最先回覆"
+                   f"（{result['_latency']:.1f}s）")
 
     # ── 解析結果 ────────────────────────────────────────────────────────────
     verdict      = result.get("verdict", "觀望")
@@ -964,6 +1481,7 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
     rr           = result.get("risk_reward", "—")
     risks        = result.get("key_risks", "")
     reasoning    = result.get("reasoning", "")
+    tf_bias      = result.get("tf_bias") or {}
 
     verdict_cls  = {"做多": "ai-verdict-bull",
                     "做空": "ai-verdict-bear"}.get(verdict, "ai-verdict-side")
@@ -1002,6 +1520,11 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
         f'<div class="ai-reasoning">{trend_txt}</div>'
         f'</div>'
 
+        + (f'<div class="ai-section">'
+           f'<div class="ai-section-title">🕒 各週期方向</div>'
+           f'<div class="ai-reasoning">{"　".join(f"{k} {v}" for k, v in tf_bias.items())}</div>'
+           f'</div>' if isinstance(tf_bias, dict) and tf_bias else '') +
+
         # 價位建議
         f'<div class="ai-section">'
         f'<div class="ai-section-title">💰 操作價位</div>'
@@ -1067,43 +1590,842 @@ def render_ai_analysis(symbol: str, interval_label: str, df: pd.DataFrame,
 # ══════════════════════════════════════════════════════════════════════════════
 # Telegram
 # ══════════════════════════════════════════════════════════════════════════════
+# 警示不在渲染路徑上送出：放進佇列由背景執行緒批次發送
+TG_COALESCE_SEC = 2.0    # 第一則進佇列後等待的秒數，期間同一 chat 的警示合併成一則
+TG_MIN_INTERVAL = 1.0    # 同一 chat 兩則訊息最少間隔（Telegram 每 chat 約 1 則/秒）
+TG_MAX_RETRY    = 5
+TG_MAX_LEN      = 4000   # Telegram 單則上限 4096 字，預留空間
+
+def _telegram_post(sess: requests.Session, token: str, chat_id: str, text: str) -> bool:
+    """送出一則訊息；429 依 retry_after 等待、5xx/網路錯誤指數退避後重試"""
+    backoff = 1.0
+    for _ in range(TG_MAX_RETRY):
+        try:
+            resp = sess.post(
+                f"https://api.telegram.org/bot{token}/sendMessage",
+                data={"chat_id": chat_id, "text": text, "parse_mode": "HTML"}, timeout=5,
+            )
+        except Exception:
+            time.sleep(backoff)
+            backoff *= 2
+            continue
+        if resp.status_code == 200:
+            return True
+        if resp.status_code == 429:
+            try:
+                wait = float(resp.json()["parameters"]["retry_after"])
+            except Exception:
+                wait = backoff
+            time.sleep(wait)
+            backoff *= 2
+            continue
+        if resp.status_code >= 500:
+            time.sleep(backoff)
+            backoff *= 2
+            continue
+        return False   # 其他 4xx（token/chat_id 錯誤等）重試也沒用
+    return False
+
+def _telegram_batches(msgs: list) -> list:
+    """把同一 chat 的多則警示合併，超過長度上限再切成多則"""
+    if len(msgs) == 1:
+        return msgs
+    batches, cur = [], f"🔔 {len(msgs)} 則新警示"
+    for m in msgs:
+        if len(cur) + len(m) + 1 > TG_MAX_LEN:
+            batches.append(cur)
+            cur = m
+        else:
+            cur += "\n" + m
+    batches.append(cur)
+    return batches
+
+def _telegram_worker(state: dict, stop: threading.Event):
+    """
+    stop 被設定後把佇列裡剩下的訊息送完才結束；佇列裡的 None 只用來叫醒 worker，
+    收到時不再等合併窗口，直接送出手上的訊息。
+    """
+    q, sess, last_sent = state["queue"], state["session"], {}
+    while True:
+        try:
+            item = q.get(block=not stop.is_set(), timeout=1.0)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is None:
+            continue
+        token, chat_id, msg = item
+        pending  = {(token, chat_id): [msg]}
+        deadline = time.monotonic() + TG_COALESCE_SEC
+        while (remaining := deadline - time.monotonic()) > 0:
+            try:
+                item = q.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                break
+            token, chat_id, msg = item
+            pending.setdefault((token, chat_id), []).append(msg)
+
+        for (token, chat_id), msgs in pending.items():
+            for text in _telegram_batches(msgs):
+                wait = TG_MIN_INTERVAL - (time.monotonic() - last_sent.get(chat_id, -TG_MIN_INTERVAL))
+                if wait > 0:
+                    time.sleep(wait)
+                ok = _telegram_post(sess, token, chat_id, text)
+                last_sent[chat_id] = time.monotonic()
+                state["sent" if ok else "failed"] += 1
+
+def _telegram_workers() -> list:
+    return [th for th in threading.enumerate()
+            if th.name == "v19-telegram" and getattr(th, "stop", None) is not None]
+
+@st.cache_resource
+def _telegram_outbox() -> dict:
+    """
+    跨 session 共用的 Telegram 發送佇列與背景執行緒。
+    st.cache_resource 被清空後會再建一次：先通知舊的 worker 送完手上的訊息就結束，
+    避免每清一次就多一條執行緒守著沒人寫入的佇列。
+    """
+    for th in _telegram_workers():
+        th.stop.set()
+        th.queue.put(None)
+    state = {"queue": queue.Queue(), "session": _http_session(), "sent": 0, "failed": 0}
+    stop  = threading.Event()
+    th    = threading.Thread(target=_telegram_worker, args=(state, stop),
+                             daemon=True, name="v19-telegram")
+    th.stop, th.queue = stop, state["queue"]
+    th.start()
+    return state
+
+def flush_telegram(timeout: float = 10.0) -> bool:
+    """
+    程式結束前呼叫：不等合併窗口，把佇列裡剩下的訊息送完並停掉 worker。
+    worker 是 daemon 執行緒，不呼叫的話行程一結束還沒送出的警示就丟了。
+    timeout 秒內送完回傳 True；之後再 send_telegram 會重建新的 worker。
+    """
+    deadline = time.monotonic() + timeout
+    workers  = _telegram_workers()
+    for th in workers:
+        th.stop.set()
+        th.queue.put(None)
+    for th in workers:
+        th.join(max(0.0, deadline - time.monotonic()))
+    _telegram_outbox.clear()
+    return not any(th.is_alive() for th in workers)
+
 def send_telegram(msg: str):
+    """把訊息放進發送佇列後立即返回，不阻塞頁面渲染"""
     try:
         token   = st.secrets["TELEGRAM_BOT_TOKEN"]
         chat_id = st.secrets["TELEGRAM_CHAT_ID"]
-        requests.post(
-            f"https://api.telegram.org/bot{token}/sendMessage",
-            data={"chat_id": chat_id, "text": msg, "parse_mode": "HTML"}, timeout=5,
-        )
     except Exception:
-        pass
+        return
+    _telegram_outbox()["queue"].put((token, chat_id, msg))
 
-def add_alert(symbol: str, period: str, msg: str, atype: str = "info"):
+def alert_seen(seen: OrderedDict, key: tuple, ttl: float = ALERT_DEDUP_TTL,
+               maxsize: int = ALERT_DEDUP_SIZE) -> bool:
+    """
+    有界去重表：key 在 ttl 秒內出現過回傳 True，否則記錄下來回傳 False。
+    每次命中/寫入都移到尾端並更新時間，所以表頭永遠是最舊的，
+    過期清理與超量淘汰（LRU）都只需從表頭 pop。
+    """
+    now = time.time()
+    while seen:
+        oldest = next(iter(seen))
+        if now - seen[oldest] < ttl:
+            break
+        seen.popitem(last=False)
+
+    hit = key in seen
+    seen[key] = now
+    seen.move_to_end(key)
+    while len(seen) > maxsize:
+        seen.popitem(last=False)
+    return hit
+
+def alert_key(symbol: str, period: str, rule: str, bar_ts=None) -> tuple:
+    """去重鍵：邊緣觸發規則含 K 線時間；狀態型規則不含，狀態持續期間都算同一則"""
+    if rule in ALERT_STATE_RULES:
+        return (symbol, period, rule, None)
+    return (symbol, period, rule, str(bar_ts) if bar_ts is not None else None)
+
+def alert_rearm(seen: OrderedDict, symbol: str, period: str, hit_rules):
+    """本輪沒成立的狀態型規則從去重表移除，下次成立時再發"""
+    for rule in ALERT_STATE_RULES.difference(hit_rules):
+        seen.pop((symbol, period, rule, None), None)
+
+def add_alert(symbol: str, period: str, msg: str, atype: str = "info",
+              rule: str = None, bar_ts=None):
+    """
+    記錄並推送警示。去重依據是 alert_key（股票, 週期, 規則[, K 線時間]）而非訊息文字，
+    避免「成交量暴增 2.3x」這類帶數值的訊息每次都變成新 key。
+    """
     now = datetime.now().strftime("%H:%M:%S")
-    key = f"{symbol}|{period}|{msg}"
-    if key not in st.session_state.sent_alerts:
+    key = alert_key(symbol, period, rule or msg, bar_ts)
+    if not alert_seen(st.session_state.alert_dedup, key):
         st.session_state.alert_log.insert(0,
             {"時間": now, "股票": symbol, "週期": period, "訊息": msg, "類型": atype})
         st.session_state.alert_log = st.session_state.alert_log[:200]
-        st.session_state.sent_alerts.add(key)
         send_telegram(f"📊 [{symbol} {period}] {msg}")
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 數據抓取
 # ══════════════════════════════════════════════════════════════════════════════
-@st.cache_data(ttl=60)
-def fetch_data(symbol: str, interval: str) -> pd.DataFrame:
-    _, period = INTERVAL_MAP[interval]
+def _normalize_ohlcv(df: pd.DataFrame) -> pd.DataFrame:
+    """攤平 yfinance 的 MultiIndex 欄位並去除空值列"""
+    if df is None or df.empty:
+        return pd.DataFrame()
+    df = df.copy()
+    df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
+    df.dropna(inplace=True)
+    return df
+
+# ── 行情來源：provider(symbols, interval, period=None, start=None) -> {symbol: DataFrame} ──
+# 一次處理整批代號；start 為 None 時抓 period（預設 INTERVAL_MAP 期間），否則只回 start 之後的 K 線。
+# 缺資料的代號直接略過，不丟例外。
+def yahoo_bar_provider(symbols, interval, period=None, start=None) -> dict:
+    """yfinance multi-ticker 下載"""
+    span = {"start": start} if start is not None else {"period": period or INTERVAL_MAP[interval][1]}
+    raw  = yf.download(symbols, interval=interval, auto_adjust=True,
+                       progress=False, group_by="ticker", threads=True, **span)
+    if raw is None or raw.empty:
+        return {}
+
+    result = {}
+    tickers = set(raw.columns.get_level_values(0)) if isinstance(raw.columns, pd.MultiIndex) else set()
+    for sym in symbols:
+        if sym not in tickers:
+            continue
+        df = _normalize_ohlcv(raw[sym])
+        if not df.empty:
+            result[sym] = df
+    return result
+
+def _slice_bars(df: pd.DataFrame, period=None, start=None) -> pd.DataFrame:
+    """離線來源共用：依 start 或 period 截取 K 線"""
+    if start is not None:
+        start = pd.Timestamp(start)
+        if df.index.tz is not None and start.tzinfo is None:
+            start = start.tz_localize(df.index.tz)
+        elif df.index.tz is None and start.tzinfo is not None:
+            start = start.tz_localize(None)
+        return df[df.index >= start]
+    return _trim_to_period(df, period) if period else df
+
+MARKET_TZ = "America/New_York"   # 離線來源的 K 線時區（與 yfinance 美股一致）
+
+def replay_bar_provider(root: str):
+    """
+    回放本機錄好的 K 線：{root}/{interval}/{symbol}.parquet 或 .csv（第一欄為時間），
+    可用 export_replay_bars 從目前的 K 線儲存產生。period 以檔案最後一根往回算。
+    """
+    def provider(symbols, interval, period=None, start=None):
+        period = period or INTERVAL_MAP[interval][1]
+        result = {}
+        for sym in symbols:
+            base = os.path.join(root, interval, sym.replace("/", "_").replace("\\", "_"))
+            try:
+                if os.path.exists(f"{base}.parquet"):
+                    df = pd.read_parquet(f"{base}.parquet")
+                elif os.path.exists(f"{base}.csv"):
+                    df = pd.read_csv(f"{base}.csv", index_col=0)
+                    try:
+                        df.index = pd.to_datetime(df.index)
+                    except (ValueError, TypeError):
+                        # 跨夏令時間的時間偏移不一致，統一轉成美東時間
+                        df.index = pd.to_datetime(df.index, utc=True).tz_convert(MARKET_TZ)
+                else:
+                    continue
+            except Exception:
+                continue
+            df = _slice_bars(_normalize_ohlcv(df), period, start)
+            if not df.empty:
+                result[sym] = df
+        return result
+    return provider
+
+SYNTH_SESSION       = 390     # 每個交易日的分鐘數（09:30 開盤）
+SYNTH_DAILY_VOL     = 0.02    # 日K 報酬標準差，其他週期依 √時間 縮放
+SYNTH_BARS_PER_YEAR = {"1d": 252, "1wk": 52, "1mo": 12}
+
+def _synth_index(interval: str, period: str, end: pd.Timestamp) -> pd.DatetimeIndex:
+    """合成 K 線時間軸：盤中只排交易時段，日/週/月K 依 period 年數決定根數"""
+    n = int(period[:-1])
+    if interval.endswith("m") and not interval.endswith("mo"):
+        days  = pd.bdate_range(end=end.tz_localize(None), periods=n)
+        slots = pd.to_timedelta(np.arange(570, 570 + SYNTH_SESSION, int(interval[:-1])), unit="min")
+        return pd.DatetimeIndex((days.values[:, None] + slots.values[None, :]).ravel()).tz_localize(MARKET_TZ)
+    bars = n * SYNTH_BARS_PER_YEAR[interval] if period.endswith("y") else n
+    freq = {"1d": "B", "1wk": "W-MON", "1mo": "MS"}[interval]
+    return pd.date_range(end=end, periods=bars, freq=freq)
+
+def synthetic_bar_provider(seed: int = 0, end=None):
+    """
+    隨機漫步合成 K 線，離線壓測用。同一 (seed, 代號, 週期) 永遠產生同一組數據，
+    K 線收在 end（預設最近一個交易日收盤），所以增量補抓與完整重抓結果一致。
+    """
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now(tz=MARKET_TZ)
+    if end.tzinfo is None:
+        end = end.tz_localize(MARKET_TZ)
+    end = pd.bdate_range(end=end.tz_convert(MARKET_TZ).normalize(), periods=1)[0]
+
+    def provider(symbols, interval, period=None, start=None):
+        period = period or INTERVAL_MAP[interval][1]
+        idx    = _synth_index(interval, period, end)
+        n      = len(idx)
+        if interval.endswith("m") and not interval.endswith("mo"):
+            scale = np.sqrt(int(interval[:-1]) / SYNTH_SESSION)
+        else:
+            scale = np.sqrt(252 / SYNTH_BARS_PER_YEAR[interval])
+        sigma  = SYNTH_DAILY_VOL * scale
+        result = {}
+        for sym in symbols:
+            rng   = np.random.default_rng([seed, zlib.crc32(f"{sym}|{interval}".encode())])
+            base  = float(np.exp(rng.uniform(np.log(10), np.log(500))))
+            close = base * np.exp(np.cumsum(rng.normal(0, sigma, n)))
+            open_ = np.empty(n)
+            open_[0], open_[1:] = base, close[:-1]
+            wick  = np.abs(rng.normal(0, sigma / 2, (2, n)))
+            high  = np.maximum(open_, close) * (1 + wick[0])
+            low   = np.minimum(open_, close) * (1 - wick[1])
+            vol   = np.round(rng.lognormal(13, 0.5, n) * scale)
+            vol[rng.random(n) < 0.03] *= 4     # 偶爾放量，讓成交量警示有機會觸發
+            df = pd.DataFrame({"Open": open_, "High": high, "Low": low,
+                               "Close": close, "Volume": vol}, index=idx)
+            df.index.name = "Datetime" if interval.endswith("m") and not interval.endswith("mo") else "Date"
+            result[sym] = _slice_bars(df, start=start)
+        return result
+    return provider
+
+def data_provider_spec() -> str:
+    """secrets / 環境變數 DATA_PROVIDER："yahoo"（預設）、"synthetic[:seed]" 或回放目錄路徑"""
+    try:
+        return str(st.secrets["DATA_PROVIDER"])
+    except Exception:
+        return os.environ.get("DATA_PROVIDER", "yahoo")
+
+def data_provider():
+    """依 DATA_PROVIDER 回傳行情來源函式"""
+    spec = data_provider_spec()
+    if spec == "yahoo":
+        return yahoo_bar_provider
+    if spec == "synthetic" or spec.startswith("synthetic:"):
+        return synthetic_bar_provider(int(spec.partition(":")[2] or 0))
+    return replay_bar_provider(spec)
+
+def export_replay_bars(root: str, symbols: list, intervals: list) -> int:
+    """把 K 線儲存的數據寫成回放目錄（Parquet），回傳寫出的檔案數"""
+    n = 0
+    for itvl in intervals:
+        os.makedirs(os.path.join(root, itvl), exist_ok=True)
+        for sym in symbols:
+            df = fetch_data(sym, itvl)
+            if not df.empty:
+                df.to_parquet(os.path.join(root, itvl, f"{sym.replace('/', '_')}.parquet"))
+                n += 1
+    return n
+
+def _download_batch(symbols: list, interval: str, start=None) -> dict:
+    """
+    同一週期多檔股票一次批次下載（經由 data_provider），回傳 {symbol: DataFrame}
+    start 為 None 時抓完整 INTERVAL_MAP 期間，否則只抓 start 之後的 K 線
+    """
     try:
-        df = yf.download(symbol, period=period, interval=interval,
-                         auto_adjust=True, progress=False)
+        return data_provider()(symbols, interval, start=start)
+    except Exception:
+        return {}
+
+# ── K 線儲存：每組 (symbol, interval) 常駐記憶體，刷新時只補新 K 線 ─────────
+FULL_RELOAD_SEC = 6 * 3600     # 安全網：每隔一段時間強制完整重抓一次
+ADJ_RTOL        = 1e-4         # 重疊 K 線收盤價差異超過此比例視為除權息/分割調整
+
+@st.cache_resource
+def _bar_store() -> dict:
+    """跨 session 共用的 K 線儲存：{(symbol, interval): {df, fetched, full_at}}"""
+    return {"bars": {}, "lock": threading.Lock(), "single_sec": []}
+
+# ── 磁碟快取：每組 (symbol, interval) 一個未壓縮 Feather 檔，重啟後以 memory map 秒讀 ─
+def _bar_cache_dir() -> str:
+    """
+    快取目錄：secrets / 環境變數 BAR_CACHE_DIR，預設 .bar_cache；
+    非 yfinance 來源各用一個子目錄，切換 DATA_PROVIDER 不會讀到別的來源的 K 線
+    """
+    try:
+        root = st.secrets["BAR_CACHE_DIR"]
+    except Exception:
+        root = os.environ.get("BAR_CACHE_DIR", ".bar_cache")
+    spec = data_provider_spec()
+    if spec == "yahoo":
+        return root
+    return os.path.join(root, "provider-" + hashlib.sha1(spec.encode()).hexdigest()[:10])
+
+def _bar_cache_path(symbol: str, interval: str) -> str:
+    safe = symbol.replace("/", "_").replace("\\", "_")
+    return os.path.join(_bar_cache_dir(), interval, f"{safe}.feather")
+
+def _load_bars_disk(symbol: str, interval: str):
+    """讀磁碟快取，回傳 {df, fetched, full_at} 或 None"""
+    path = _bar_cache_path(symbol, interval)
+    try:
+        table = feather.read_table(path, memory_map=True)
+        meta  = table.schema.metadata or {}
+        df    = table.to_pandas()
         if df.empty:
-            return pd.DataFrame()
-        df.columns = [c[0] if isinstance(c, tuple) else c for c in df.columns]
-        df.dropna(inplace=True)
+            return None
+        return {"df": df, "fetched": os.path.getmtime(path),
+                "full_at": float(meta.get(b"full_at", 0))}
+    except Exception:
+        return None
+
+def _save_bars_disk(symbol: str, interval: str, entry: dict):
+    """寫入磁碟快取（先寫暫存檔再 os.replace，避免讀到寫一半的檔案）"""
+    path = _bar_cache_path(symbol, interval)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(entry["df"])
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"full_at": str(entry["full_at"]).encode(),
+        })
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        feather.write_feather(table, tmp, compression="uncompressed")
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+def _trim_to_period(df: pd.DataFrame, period: str) -> pd.DataFrame:
+    """把累積的 K 線裁回 INTERVAL_MAP 對應期間（Nd = 最近 N 個交易日，Ny = N 年）"""
+    if df.empty:
         return df
+    n = int(period[:-1])
+    if period.endswith("d"):
+        days = df.index.normalize().unique()
+        if len(days) <= n:
+            return df
+        return df[df.index >= days[-n]]
+    if period.endswith("y"):
+        return df[df.index >= df.index[-1] - pd.DateOffset(years=n)]
+    return df
+
+def _merge_bars(old: pd.DataFrame, chunk: pd.DataFrame):
+    """
+    把增量抓到的 chunk 接到舊資料後面。
+    chunk 從舊資料倒數第二根（最後一根已收盤 K 線）開始，用它來對帳：
+      - chunk 沒涵蓋這根 → 中間有缺口，回傳 None 要求完整重抓
+      - 這根收盤價對不上 → 發生除權息/分割調整，回傳 None
+    否則以 chunk 取代舊資料的未收盤 K 線並附加新 K 線。
+    """
+    if chunk.empty:
+        return old
+    anchor = old.index[-2]
+    if anchor not in chunk.index:
+        return None
+    if not np.isclose(float(chunk.at[anchor, "Close"]), float(old.at[anchor, "Close"]),
+                      rtol=ADJ_RTOL, atol=0):
+        return None
+    return pd.concat([old[old.index < anchor], chunk[chunk.index >= anchor]])
+
+def _update_bars(symbols: list, interval: str, lead: float = 0.0) -> dict:
+    """
+    更新同一週期一批股票：有舊資料的只抓倒數第二根之後的 K 線（一次 multi-ticker），
+    沒有舊資料、對帳失敗或超過 FULL_RELOAD_SEC 的才完整重抓。
+    lead > 0 時把「lead 秒內會過期」的也視為過期（背景預熱下一輪用）。
+    回傳 {incremental, full, fetched}
+    """
+    store = _bar_store()
+    _, period = INTERVAL_MAP[interval]
+    ttl = FRESHNESS[interval]
+    now = time.time() + lead
+
+    with store["lock"]:
+        entries = {sym: store["bars"].get((sym, interval)) for sym in symbols}
+    # 記憶體沒有的先從磁碟快取補上，之後只需補尾端缺少的 K 線
+    from_disk = {}
+    for sym in symbols:
+        if entries[sym] is None and (e := _load_bars_disk(sym, interval)):
+            entries[sym] = from_disk[sym] = e
+    if from_disk:
+        with store["lock"]:
+            for sym, e in from_disk.items():
+                store["bars"].setdefault((sym, interval), e)
+
+    incr = [sym for sym, e in entries.items()
+            if e and len(e["df"]) >= 2 and now - e["full_at"] < FULL_RELOAD_SEC
+            and now - e["fetched"] >= ttl]
+    full = [sym for sym, e in entries.items()
+            if sym not in incr and not (e and now - e["fetched"] < ttl)]
+
+    updated = {}   # sym -> (df, 是否完整重抓)
+    if incr:
+        start  = min(entries[sym]["df"].index[-2] for sym in incr)
+        chunks = _download_batch(incr, interval, start=start)
+        for sym in incr:
+            if sym not in chunks:
+                continue
+            merged = _merge_bars(entries[sym]["df"], chunks[sym])
+            if merged is None:
+                full.append(sym)
+            else:
+                updated[sym] = (_trim_to_period(merged, period), False)
+
+    if full:
+        t0  = time.perf_counter()
+        got = _download_batch(full, interval)
+        if len(full) == 1:
+            with store["lock"]:
+                store["single_sec"] = (store["single_sec"] + [time.perf_counter() - t0])[-50:]
+        for sym, df in got.items():
+            updated[sym] = (df, True)
+
+    fetched_at = time.time()
+    new_entries = {}
+    for sym, (df, is_full) in updated.items():
+        prev = entries.get(sym)
+        new_entries[sym] = {
+            "df": df, "fetched": fetched_at,
+            "full_at": fetched_at if is_full or not prev else prev["full_at"],
+        }
+    with store["lock"]:
+        for sym, entry in new_entries.items():
+            store["bars"][(sym, interval)] = entry
+    for sym, entry in new_entries.items():
+        _save_bars_disk(sym, interval, entry)
+    n_full = sum(1 for _, f in updated.values() if f)
+    return {"incremental": len(updated) - n_full, "full": n_full, "fetched": len(updated)}
+
+def _stale_symbols(symbols: list, interval: str, lead: float = 0.0) -> list:
+    """依 FRESHNESS[interval] 找出需要更新的股票（從未抓過、已過期或 lead 秒內過期）"""
+    store = _bar_store()
+    ttl   = FRESHNESS[interval]
+    now   = time.time() + lead
+    with store["lock"]:
+        return [sym for sym in symbols
+                if not (e := store["bars"].get((sym, interval))) or now - e["fetched"] >= ttl]
+
+@timed_stage("fetch")
+def prefetch_data(symbols: list, intervals: list, lead: float = 0.0) -> dict:
+    """
+    預載階段：收集 sidebar 要求的所有 (symbol, interval)，
+    每個週期一次 multi-ticker 下載（有舊資料者只補增量），各週期之間再以執行緒池並行，
+    在任何分頁渲染前先填滿 K 線儲存。
+    回傳報告 {pairs, fetched, incremental, full, elapsed, serial_est, saved}
+    """
+    store = _bar_store()
+    todo  = {itvl: stale for itvl in intervals
+             if (stale := _stale_symbols(symbols, itvl, lead))}
+    if not todo:
+        return {"pairs": 0}
+
+    def _job(itvl):
+        t0 = time.perf_counter()
+        res = _update_bars(todo[itvl], itvl, lead)
+        return res, time.perf_counter() - t0
+
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(8, len(todo))) as pool:
+        results = list(pool.map(_job, todo))
+    elapsed = time.perf_counter() - t_start
+
+    with store["lock"]:
+        single = list(store["single_sec"])
+    # 序列路徑估計：每組 (symbol, interval) 各跑一次 yf.download
+    # 有實測單檔延遲就用實測平均，否則以各批次耗時當作單次請求延遲
+    if single:
+        per_req = sum(single) / len(single)
+    else:
+        per_req = sum(r[1] for r in results) / len(results)
+    n_pairs    = sum(len(v) for v in todo.values())
+    serial_est = per_req * n_pairs
+
+    report = {"pairs": n_pairs, "elapsed": elapsed,
+              "fetched":     sum(r[0]["fetched"] for r in results),
+              "incremental": sum(r[0]["incremental"] for r in results),
+              "full":        sum(r[0]["full"] for r in results),
+              "serial_est": serial_est, "saved": max(0.0, serial_est - elapsed)}
+    return report
+
+# ── 背景預熱：自動刷新前先在背景執行緒補齊下一輪要用的 K 線 ──────────────
+REFRESH_TICK = 5    # 刷新計時 fragment 每幾秒檢查一次
+REFRESH_LEAD = 15   # 距離刷新還剩幾秒時開始背景預熱
+
+@st.cache_resource
+def _background_jobs() -> dict:
+    """跨 session 共用的背景執行緒池與進行中工作 {key: Future}"""
+    return {"pool": ThreadPoolExecutor(max_workers=4, thread_name_prefix="v19-bg"),
+            "jobs": {}, "lock": threading.Lock()}
+
+def schedule_prefetch(symbols: list, intervals: list, lead: float = REFRESH_LEAD):
+    """
+    在背景執行 prefetch_data；同一組 symbols × intervals 進行中就不重複排程。
+    跑完的工作順手清掉，觀察清單一直換也只留進行中的那幾筆。
+    """
+    bg  = _background_jobs()
+    key = (tuple(symbols), tuple(intervals))
+    with bg["lock"]:
+        for k in [k for k, fut in bg["jobs"].items() if fut.done()]:
+            del bg["jobs"][k]
+        job = bg["jobs"].get(key)
+        if job is None:
+            job = bg["jobs"][key] = bg["pool"].submit(prefetch_data, list(symbols),
+                                                       list(intervals), lead)
+        return job
+
+@timed_stage("fetch")
+def fetch_data(symbol: str, interval: str) -> pd.DataFrame:
+    """
+    從 K 線儲存取數據，超過 FRESHNESS[interval] 才補抓。
+    回傳的是共用物件，呼叫端只讀不改。
+    """
+    if _stale_symbols([symbol], interval):
+        _update_bars([symbol], interval)
+    store = _bar_store()
+    with store["lock"]:
+        entry = store["bars"].get((symbol, interval))
+    return entry["df"] if entry else pd.DataFrame()
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 即時串流：1 分鐘 K 線由成交推播即時聚合進 K 線儲存，不再每分鐘重抓整天
+# ══════════════════════════════════════════════════════════════════════════════
+STREAM_INTERVAL  = "1m"
+STREAM_FLUSH_SEC = 1.0   # tick 先進佇列，每秒整批併入 K 線儲存一次
+STREAM_RETRY_SEC = 5     # 來源斷線 / 例外後幾秒重連
+STREAM_TICK      = 3     # 頁面串流面板與 1 分鐘警示的檢查間隔（秒）
+STREAM_SUB_TTL   = 60    # 頁面訂閱多久沒續約就視為分頁已關閉（秒）
+
+class StreamUnavailable(RuntimeError):
+    """來源在這個環境根本無法使用（缺套件、版本太舊），重連也沒用"""
+
+# 來源介面：source(symbols, emit, stop) 阻塞執行，每筆成交呼叫
+# emit(symbol, 時間, 價格, 成交量增量)，stop 被設定時盡快返回
+def yahoo_tick_source(symbols, emit, stop):
+    """Yahoo Finance WebSocket 推播；day_volume 是當日累計量，換算成逐筆增量"""
+    if not hasattr(yf, "WebSocket"):
+        raise StreamUnavailable(f"yfinance {yf.__version__} 沒有 WebSocket，請升級到 0.2.55 以上")
+    day_vol = {}
+    done    = threading.Event()
+    ws      = yf.WebSocket(verbose=False)
+
+    def on_message(m):
+        sym = m.get("id")
+        if not sym or "price" not in m:
+            return
+        vol  = int(m.get("day_volume") or 0)
+        size = max(0, vol - day_vol.get(sym, vol))
+        day_vol[sym] = vol
+        emit(sym, pd.Timestamp(int(m["time"]), unit="ms", tz="UTC"), float(m["price"]), size)
+
+    def closer():
+        while not done.wait(1):
+            if stop.is_set():
+                ws.close()
+                return
+
+    threading.Thread(target=closer, daemon=True, name="v19-stream-close").start()
+    try:
+        ws.subscribe(list(symbols))
+        ws.listen(on_message)
+    finally:
+        done.set()
+
+def replay_tick_source(path: str, speed: float = 1.0):
+    """
+    回放 CSV（欄位 symbol,time,price,size）當作串流來源，測試與離線展示用。
+    speed 為回放倍速，0 表示不等待一次送完；送完後停住，不會被當成斷線重播。
+    """
+    def source(symbols, emit, stop):
+        ticks = pd.read_csv(path, parse_dates=["time"])
+        ticks = ticks[ticks["symbol"].isin(symbols)].sort_values("time", kind="stable")
+        prev  = None
+        for sym, ts, px, size in ticks[["symbol", "time", "price", "size"]].itertuples(index=False):
+            wait = (ts - prev).total_seconds() / speed if speed and prev is not None else 0
+            if stop.wait(max(0.0, wait)):
+                return
+            prev = ts
+            emit(sym, ts, float(px), float(size))
+        stop.wait()
+    return source
+
+def stream_source():
+    """串流來源：secrets / 環境變數 STREAM_SOURCE，"yahoo"（預設）或回放 CSV 路徑"""
+    try:
+        spec = st.secrets["STREAM_SOURCE"]
     except Exception:
-        return pd.DataFrame()
+        spec = os.environ.get("STREAM_SOURCE", "yahoo")
+    if spec == "yahoo":
+        return yahoo_tick_source
+    return replay_tick_source(spec, float(os.environ.get("STREAM_REPLAY_SPEED", 1.0)))
+
+def _fold_ticks(df: pd.DataFrame, ticks: list) -> pd.DataFrame:
+    """
+    把同一檔的 [(時間, 價格, 量)] 併入 1 分鐘 K 線：同一分鐘更新未收盤 K 線，
+    跨分鐘附加新 K 線，早於最後一根的遲到 tick 忽略。沒有變動就回傳原物件。
+    """
+    tz    = df.index.tz
+    cols  = {c: df[c].to_numpy(copy=True) for c in df.columns}
+    o, h, l, c, v = (cols[k] for k in ("Open", "High", "Low", "Close", "Volume"))
+    last  = df.index[-1]
+    bars  = []   # 新附加的 K 線 [時間, O, H, L, C, V]
+    dirty = False
+    for ts, px, size in ticks:
+        ts = pd.Timestamp(ts)
+        if tz is not None:
+            ts = ts.tz_localize(tz) if ts.tzinfo is None else ts.tz_convert(tz)
+        elif ts.tzinfo is not None:
+            ts = ts.tz_localize(None)
+        ts = ts.floor("min")
+        if ts < last:
+            continue
+        dirty = True
+        if ts > last:
+            bars.append([ts, px, px, px, px, size])
+            last = ts
+        elif bars:
+            b = bars[-1]
+            b[2], b[3], b[4], b[5] = max(b[2], px), min(b[3], px), px, b[5] + size
+        else:
+            h[-1], l[-1], c[-1], v[-1] = max(h[-1], px), min(l[-1], px), px, v[-1] + size
+    if not dirty:
+        return df
+
+    out = pd.DataFrame(cols, index=df.index)
+    if bars:
+        new = pd.DataFrame([b[1:] for b in bars], columns=["Open", "High", "Low", "Close", "Volume"],
+                           index=pd.DatetimeIndex([b[0] for b in bars], name=df.index.name))
+        new = new.reindex(columns=df.columns).astype(df.dtypes.to_dict())
+        out = _trim_to_period(pd.concat([out, new]), INTERVAL_MAP[STREAM_INTERVAL][1])
+    return out
+
+def apply_ticks(ticks: list) -> int:
+    """
+    把一批 (symbol, 時間, 價格, 量) 併入 K 線儲存的 1 分鐘數據，回傳有變動的股票數。
+    儲存中的 DataFrame 是共用唯讀物件：每檔只複製一次再整筆換掉，並刷新 fetched，
+    有在收到 tick 的股票就不會被 fetch_data / prefetch_data 當成過期重抓。
+    還沒有歷史 K 線的股票先略過，等輪詢補齊後才開始接 tick。
+    """
+    by_sym = {}
+    for sym, ts, px, size in ticks:
+        by_sym.setdefault(sym, []).append((ts, px, size))
+    store = _bar_store()
+    now   = time.time()
+    n     = 0
+    with store["lock"]:
+        for sym, rows in by_sym.items():
+            key   = (sym, STREAM_INTERVAL)
+            entry = store["bars"].get(key)
+            if entry is None or entry["df"].empty:
+                continue
+            df = _fold_ticks(entry["df"], rows)
+            if df is not entry["df"]:
+                store["bars"][key] = {**entry, "df": df, "fetched": now}
+                n += 1
+    return n
+
+@st.cache_resource
+def _stream_state() -> dict:
+    """
+    全程序唯一的串流：訂閱者 {owner: (股票, 逾期時間或 None)}、實際串流的聯集、
+    停止旗標與統計。各頁面 session 與 alert_engine 各自訂閱，串流內容是所有人的聯集。
+    """
+    return {"subs": {}, "symbols": (), "source": None, "stop": None, "ticks": 0,
+            "last_tick": 0.0, "error": None, "fatal": False, "lock": threading.Lock()}
+
+def stream_owner() -> str:
+    """目前頁面 session 的訂閱者 id；不在 streamlit 執行環境時回傳 "script" """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return f"session:{ctx.session_id}" if ctx else "script"
+
+def _stream_union(state, now: float) -> tuple:
+    """剔除逾期的訂閱者，回傳其餘訂閱股票的聯集（呼叫端持有 lock）"""
+    subs = state["subs"]
+    for owner in [o for o, (_, exp) in subs.items() if exp is not None and exp < now]:
+        del subs[owner]
+    return tuple(sorted({s for syms, _ in subs.values() for s in syms}))
+
+def _stream_feed(state, q, stop, symbols, source):
+    """來源迴圈：來源結束或丟例外就等 STREAM_RETRY_SEC 重連，直到 stop；StreamUnavailable 不重試"""
+    emit = lambda *tick: q.put(tick)
+    while not stop.is_set():
+        try:
+            source(symbols, emit, stop)
+        except StreamUnavailable as e:
+            with state["lock"]:
+                state["error"], state["fatal"] = str(e), True
+            return
+        except Exception as e:
+            with state["lock"]:
+                state["error"] = str(e)
+        stop.wait(STREAM_RETRY_SEC)
+
+def _stream_pump(state, q, stop):
+    """
+    每 STREAM_FLUSH_SEC 把佇列裡累積的 tick 整批併入 K 線儲存，
+    順便剔除逾期的頁面訂閱（分頁直接關掉不會通知伺服器），聯集變了就重連或停掉。
+    """
+    while not stop.wait(STREAM_FLUSH_SEC):
+        batch = []
+        while True:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            apply_ticks(batch)
+        with state["lock"]:
+            if batch:
+                state["ticks"]    += len(batch)
+                state["last_tick"] = time.time()
+                state["error"]     = None
+            if state["stop"] is stop:
+                _restart_stream(state, _stream_union(state, time.time()))
+
+def _restart_stream(state, symbols: tuple, force: bool = False):
+    """依訂閱聯集重啟來源；聯集不變就不動，聯集為空就停掉（呼叫端持有 lock）"""
+    running = state["stop"] is not None and not state["stop"].is_set()
+    if running and state["symbols"] == symbols and not force:
+        return
+    if running:
+        state["stop"].set()
+    if not symbols:
+        state.update(symbols=(), stop=None)
+        return
+    stop, q = threading.Event(), queue.SimpleQueue()
+    state.update(symbols=symbols, stop=stop, error=None, fatal=False)
+    if not running:
+        state.update(ticks=0, last_tick=0.0)
+    threading.Thread(target=_stream_feed, args=(state, q, stop, symbols, state["source"]),
+                     daemon=True, name="v19-stream-feed").start()
+    threading.Thread(target=_stream_pump, args=(state, q, stop),
+                     daemon=True, name="v19-stream-pump").start()
+
+def start_stream(symbols: list, source=None, owner: str = None, ttl: float = None) -> dict:
+    """
+    以 owner（預設目前頁面 session）訂閱 1 分鐘串流，實際串流所有訂閱者股票的聯集，聯集不變就不重連。
+    ttl 秒內沒再呼叫就視為離開（頁面用來續約）；None 表示直到 stop_stream 為止。
+    """
+    state = _stream_state()
+    owner = owner or stream_owner()
+    now   = time.time()
+    with state["lock"]:
+        force = source is not None and source is not state["source"]
+        if force or state["source"] is None:
+            state["source"] = source or stream_source()
+        state["subs"][owner] = (tuple(symbols), now + ttl if ttl is not None else None)
+        _restart_stream(state, _stream_union(state, now), force)
+    return state
+
+def stop_stream(owner: str = None):
+    """
+    取消 owner（預設目前頁面 session）的訂閱；沒訂閱過就不動作，
+    不會停掉別人的串流，最後一個訂閱者離開才真的斷線。
+    """
+    state = _stream_state()
+    owner = owner or stream_owner()
+    with state["lock"]:
+        if state["subs"].pop(owner, None) is None:
+            return
+        _restart_stream(state, _stream_union(state, time.time()))
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 技術指標
@@ -1116,22 +2438,178 @@ def calc_macd(s, fast=12, slow=26, sig=9):
     dea  = calc_ema(dif, sig)
     return dif, dea, (dif - dea) * 2
 
+# ── 共用指標表：同一份 K 線只算一次 EMA / MA / MACD / 量均線 ───────────────
+IND_CACHE_SIZE = 256
+
+def calc_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    """一次算出所有 EMA{n}、MA{n}、DIF/DEA/HIST、VOL_MA5 欄位"""
+    close = df["Close"]
+    cols  = {f"EMA{n}": calc_ema(close, n) for n, _ in EMA_CONFIGS}
+    cols.update({f"MA{n}": calc_ma(close, n) for n, _, _ in MA_CONFIGS})
+    dif, dea, hist = calc_macd(close)
+    cols.update({"DIF": dif, "DEA": dea, "HIST": hist,
+                 "VOL_MA5": df["Volume"].rolling(5).mean()})
+    return pd.DataFrame(cols, index=df.index)
+
+@st.cache_resource
+def _indicator_cache() -> dict:
+    """跨 rerun 共用的指標表 LRU：{資料指紋: 指標 DataFrame}"""
+    return {"lru": OrderedDict(), "lock": threading.Lock()}
+
+def _frame_key(df: pd.DataFrame) -> tuple:
+    """
+    K 線資料指紋：長度 + 首末時間 + 首根收盤 + 最後一根 OHLCV。
+    未收盤 K 線跳動、新增 K 線、除權息調整都會改變指紋。
+    """
+    # 直接取欄位陣列元素，不建整列 Series（篩選器一次要算上千個指紋）
+    close = df["Close"].values
+    return (len(df), df.index[0], df.index[-1], float(close[0]),
+            float(df["Open"].values[-1]), float(df["High"].values[-1]),
+            float(df["Low"].values[-1]), float(close[-1]), float(df["Volume"].values[-1]))
+
+@timed_stage("indicators")
+def get_indicators(df: pd.DataFrame) -> pd.DataFrame:
+    """取得 df 的指標表，命中快取就不重算（所有指標消費者都走這裡）"""
+    key   = _frame_key(df)
+    cache = _indicator_cache()
+    with cache["lock"]:
+        hit = cache["lru"].get(key)
+        if hit is not None:
+            cache["lru"].move_to_end(key)
+            return hit
+    ind = _advance_indicators(df, key)
+    with cache["lock"]:
+        cache["lru"][key] = ind
+        while len(cache["lru"]) > IND_CACHE_SIZE:
+            cache["lru"].popitem(last=False)
+    return ind
+
+# ── 指標遞推：adjust=False 的 EMA 是一階遞迴，K 線只在尾端變動時不必整段重算 ─────
+# 每組 (symbol, interval) 只記「最後一根已收盤 K 線」的 EMA / MACD 種子值，
+# 未收盤 K 線跳動或新增 K 線時從種子往後遞推幾步；前段歷史被改寫才整段重算。
+IND_INCR_MAX = 64   # 一次遞推超過這麼多根就改走整段向量化計算
+
+def _ema_step(prev: float, x: float, span: int) -> float:
+    """EMA 遞推一步，照 pandas ewm(span, adjust=False) 的算式與運算順序"""
+    alpha = 1. / (1. + (span - 1) / 2.0)
+    if prev == x:
+        return prev
+    old_wt = 1. - alpha
+    return (old_wt * prev + alpha * x) / (old_wt + alpha)
+
+@st.cache_resource
+def _indicator_state() -> dict:
+    """{(symbol, interval): 遞推狀態}；狀態只有幾個浮點數，指標表本身仍放在 LRU"""
+    return {"series": {}, "lock": threading.Lock(), "stats": {"incremental": 0, "full": 0}}
+
+def _history_crc(df: pd.DataFrame, n: int) -> int:
+    """前 n 根 K 線收盤價與量的 CRC，對帳用：已收盤的歷史被改寫（資料修正、除權息）就整段重算"""
+    crc = zlib.crc32(np.ascontiguousarray(df["Close"].values[:n]))
+    return zlib.crc32(np.ascontiguousarray(df["Volume"].values[:n]), crc)
+
+def _indicator_seed(df: pd.DataFrame, ind: pd.DataFrame, key: tuple,
+                    e12: float, e26: float) -> dict:
+    """記下倒數第二根（最後一根已收盤）的種子值與對帳用的首根/錨點/歷史 CRC"""
+    close, a = df["Close"].values, len(df) - 2
+    row  = dict(zip(ind.columns, ind.to_numpy()[a]))
+    seed = {f"EMA{n}": float(row[f"EMA{n}"]) for n, _ in EMA_CONFIGS}
+    seed.update({"DEA": float(row["DEA"]), "E12": e12, "E26": e26})
+    return {"key": key, "n": len(df), "head": (df.index[0], float(close[0])),
+            "anchor": (df.index[a], float(close[a])), "hist": _history_crc(df, a + 1),
+            "seed": seed}
+
+def _bar_key_of(df: pd.DataFrame):
+    """df 若正是 K 線儲存中的某組數據就回傳其 (symbol, interval)；切片、複本一律 None"""
+    store = _bar_store()
+    with store["lock"]:
+        for key, entry in store["bars"].items():
+            if entry["df"] is df:
+                return key
+    return None
+
+def _full_indicators(df: pd.DataFrame, key: tuple, bar_key) -> pd.DataFrame:
+    ind = calc_indicators(df)
+    if bar_key is not None and len(df) >= 2:
+        close = df["Close"]
+        seed  = _indicator_seed(df, ind, key, float(calc_ema(close, 12).values[-2]),
+                                float(calc_ema(close, 26).values[-2]))
+        state = _indicator_state()
+        with state["lock"]:
+            state["series"][bar_key] = seed
+            state["stats"]["full"] += 1
+    return ind
+
+def _advance_indicators(df: pd.DataFrame, key: tuple) -> pd.DataFrame:
+    """
+    df 是 K 線儲存中的那份數據、上次的指標表還在 LRU 且前段歷史沒變時，
+    從上次最後一根已收盤 K 線的種子往後遞推；否則整段 calc_indicators。
+    EMA / MACD 與整段重算的算式相同；MA / VOL_MA5 由視窗直接取平均，
+    rolling 則是累加和，兩者在末幾位會差 ~1e-15，只在浮點誤差內一致。
+    """
+    bar_key = _bar_key_of(df)
+    state   = _indicator_state()
+    with state["lock"]:
+        prev = state["series"].get(bar_key) if bar_key is not None else None
+    if prev is None:
+        return _full_indicators(df, key, bar_key)
+
+    p, m  = prev["n"] - 1, len(df)          # 第 p 根（上次的未收盤 K 線）起重算
+    close = df["Close"].values
+    cache = _indicator_cache()
+    with cache["lock"]:
+        old = cache["lru"].get(prev["key"])
+    if (old is None or not 2 <= p < m or m - p > IND_INCR_MAX
+            or (df.index[0], float(close[0])) != prev["head"]
+            or (df.index[p - 1], float(close[p - 1])) != prev["anchor"]
+            or _history_crc(df, p) != prev["hist"]):
+        return _full_indicators(df, key, bar_key)
+
+    # 舊指標表前 p 列原樣複製，後面逐根遞推；整張表一個 float 區塊直接建 DataFrame
+    vol  = df["Volume"].values
+    col  = {c: j for j, c in enumerate(old.columns)}
+    out  = np.empty((m, len(col)))
+    out[:p] = old.to_numpy()[:p]
+    seed = dict(prev["seed"])
+    e12, e26 = seed["E12"], seed["E26"]      # 只重算未收盤 K 線時種子沿用上次
+    for t in range(p, m):
+        x, row = close[t], out[t]
+        for n, _ in EMA_CONFIGS:
+            seed[f"EMA{n}"] = row[col[f"EMA{n}"]] = _ema_step(seed[f"EMA{n}"], x, n)
+        seed["E12"] = _ema_step(seed["E12"], x, 12)
+        seed["E26"] = _ema_step(seed["E26"], x, 26)
+        dif = seed["E12"] - seed["E26"]
+        seed["DEA"] = _ema_step(seed["DEA"], dif, 9)
+        row[col["DIF"]], row[col["DEA"]] = dif, seed["DEA"]
+        row[col["HIST"]] = (dif - seed["DEA"]) * 2
+        for n, _, _ in MA_CONFIGS:
+            row[col[f"MA{n}"]] = close[t - n + 1:t + 1].mean() if t >= n - 1 else np.nan
+        row[col["VOL_MA5"]] = vol[t - 4:t + 1].mean() if t >= 4 else np.nan
+        if t == m - 2:
+            e12, e26 = seed["E12"], seed["E26"]
+
+    ind = pd.DataFrame(out, index=df.index, columns=old.columns)
+    with state["lock"]:
+        state["series"][bar_key] = _indicator_seed(df, ind, key, e12, e26)
+        state["stats"]["incremental"] += 1
+    return ind
+
+# 依週期決定 left、right、掃描的最近 N 根 K 線
+PIVOT_CFG = {
+    "1m":  (3, 3, 120),
+    "5m":  (3, 3, 100),
+    "15m": (3, 3, 80),
+    "30m": (3, 3, 60),
+    "1d":  (5, 5, 60),
+    "1wk": (3, 3, 40),
+    "1mo": (2, 2, 24),   # 月K只看近24根(2年)，避免抓到5年前低點
+}
+
 def calc_pivot(df, interval: str = "1d"):
     """
     依週期動態調整掃描參數，並用「價格合理範圍過濾（±30%）」
     確保阻力/支撐位一定在當前價格附近，不出現歷史舊極值。
     """
-    # 依週期決定 left、right、掃描的最近 N 根 K 線
-    pivot_cfg = {
-        "1m":  (3, 3, 120),
-        "5m":  (3, 3, 100),
-        "15m": (3, 3, 80),
-        "30m": (3, 3, 60),
-        "1d":  (5, 5, 60),
-        "1wk": (3, 3, 40),
-        "1mo": (2, 2, 24),   # 月K只看近24根(2年)，避免抓到5年前低點
-    }
-    left, right, tail_n = pivot_cfg.get(interval, (3, 3, 60))
+    left, right, tail_n = PIVOT_CFG.get(interval, (3, 3, 60))
 
     sub = df.tail(tail_n)
     if len(sub) < left + right + 2:
@@ -1144,20 +2622,24 @@ def calc_pivot(df, interval: str = "1d"):
     price_lo = current_price * 0.70
     price_hi = current_price * 1.30
 
-    highs, lows = [], []
-    for i in range(left, len(sub) - right):
-        if hi[i] == max(hi[i-left:i+right+1]) and price_lo <= hi[i] <= price_hi:
-            highs.append((idx[i], float(hi[i])))
-        if lo[i] == min(lo[i-left:i+right+1]) and price_lo <= lo[i] <= price_hi:
-            lows.append((idx[i], float(lo[i])))
-
+    # 滑動視窗一次求出每根 K 線左右 left/right 範圍內的極值
+    # 視窗 j 的中心是第 left + j 根，與原本逐根比對 max/min 等價
+    w      = left + right + 1
+    mid_hi = hi[left:len(sub) - right]
+    mid_lo = lo[left:len(sub) - right]
+    is_h = ((mid_hi == sliding_window_view(hi, w).max(axis=1))
+            & (price_lo <= mid_hi) & (mid_hi <= price_hi))
+    is_l = ((mid_lo == sliding_window_view(lo, w).min(axis=1))
+            & (price_lo <= mid_lo) & (mid_lo <= price_hi))
+
+    highs = [(idx[i], float(hi[i])) for i in np.flatnonzero(is_h) + left]
+    lows  = [(idx[i], float(lo[i])) for i in np.flatnonzero(is_l) + left]
     return highs, lows
 
-def detect_trend(df) -> str:
-    if len(df) < 60: return "盤整"
-    c = df["Close"]
-    e5, e20, e60 = calc_ema(c,5).iloc[-1], calc_ema(c,20).iloc[-1], calc_ema(c,60).iloc[-1]
-    e200 = calc_ema(c,200).iloc[-1] if len(df) >= 200 else None
+# 訊號判斷只看最後一兩根的指標值；拆成純函式讓單檔頁面與篩選器批次計算共用
+def _trend_of(n, e5, e20, e60, e200) -> str:
+    if n < 60: return "盤整"
+    e200 = e200 if n >= 200 else None
     if e200:
         if e5>e20>e60>e200: return "多頭"
         if e5<e20<e60<e200: return "空頭"
@@ -1166,51 +2648,70 @@ def detect_trend(df) -> str:
         if e5<e20<e60: return "空頭"
     return "盤整"
 
+def _macd_of(n, dif, dea) -> str:
+    """dif、dea 為 (前一根, 最後一根)"""
+    if n < 30: return "—"
+    if dif[1] > dea[1] and dif[0] <= dea[0]: return "⬆金叉"
+    if dif[1] < dea[1] and dif[0] >= dea[0]: return "⬇死叉"
+    return "DIF↑" if dif[1] > dea[1] else "DIF↓"
+
+def _ema_of(n, e5, e20) -> str:
+    """e5、e20 為 (前一根, 最後一根)"""
+    if n < 20: return "—"
+    if e5[1] > e20[1] and e5[0] <= e20[0]: return "多排↑"
+    if e5[1] < e20[1] and e5[0] >= e20[0]: return "空排↓"
+    return "EMA↑" if e5[1] > e20[1] else "EMA↓"
+
+def detect_trend(df) -> str:
+    if len(df) < 60: return "盤整"
+    ind = get_indicators(df).iloc[-1]
+    return _trend_of(len(df), ind["EMA5"], ind["EMA20"], ind["EMA60"], ind["EMA200"])
+
 def get_macd_signal(df) -> str:
     if len(df) < 30: return "—"
-    dif, dea, _ = calc_macd(df["Close"])
-    if dif.iloc[-1] > dea.iloc[-1] and dif.iloc[-2] <= dea.iloc[-2]: return "⬆金叉"
-    if dif.iloc[-1] < dea.iloc[-1] and dif.iloc[-2] >= dea.iloc[-2]: return "⬇死叉"
-    return "DIF↑" if dif.iloc[-1] > dea.iloc[-1] else "DIF↓"
+    ind = get_indicators(df)
+    return _macd_of(len(df), ind["DIF"].values[-2:], ind["DEA"].values[-2:])
 
 def get_ema_signal(df) -> str:
     if len(df) < 20: return "—"
-    c = df["Close"]
-    e5, e20 = calc_ema(c,5), calc_ema(c,20)
-    if e5.iloc[-1] > e20.iloc[-1] and e5.iloc[-2] <= e20.iloc[-2]: return "多排↑"
-    if e5.iloc[-1] < e20.iloc[-1] and e5.iloc[-2] >= e20.iloc[-2]: return "空排↓"
-    return "EMA↑" if e5.iloc[-1] > e20.iloc[-1] else "EMA↓"
+    ind = get_indicators(df)
+    return _ema_of(len(df), ind["EMA5"].values[-2:], ind["EMA20"].values[-2:])
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 警示邏輯
 # ══════════════════════════════════════════════════════════════════════════════
-def run_alerts(symbol, period_label, df):
-    if len(df) < 30: return
+def evaluate_alerts(df, interval: str = "1d") -> list:
+    """
+    對最後一根 K 線套用所有警示規則，回傳 [(rule, msg, atype)]。
+    純計算、不去重也不推送，頁面上的 run_alerts 與 alert_engine.py 共用。
+    """
+    if len(df) < 30: return []
     close, vol = df["Close"], df["Volume"]
+    ind  = get_indicators(df)
+    hits = []
 
-    dif, dea, _ = calc_macd(close)
+    dif, dea = ind["DIF"], ind["DEA"]
     if dif.iloc[-1] > dea.iloc[-1] and dif.iloc[-2] <= dea.iloc[-2]:
-        add_alert(symbol, period_label, "MACD 金叉 🟢", "bull")
+        hits.append(("macd_gold", "MACD 金叉 🟢", "bull"))
     if dif.iloc[-1] < dea.iloc[-1] and dif.iloc[-2] >= dea.iloc[-2]:
-        add_alert(symbol, period_label, "MACD 死叉 🔴", "bear")
+        hits.append(("macd_dead", "MACD 死叉 🔴", "bear"))
 
-    e5, e20 = calc_ema(close,5), calc_ema(close,20)
+    e5, e20 = ind["EMA5"], ind["EMA20"]
     if e5.iloc[-1] > e20.iloc[-1] and e5.iloc[-2] <= e20.iloc[-2]:
-        add_alert(symbol, period_label, "EMA5 上穿 EMA20 ⬆️", "bull")
+        hits.append(("ema_cross_up", "EMA5 上穿 EMA20 ⬆️", "bull"))
     if e5.iloc[-1] < e20.iloc[-1] and e5.iloc[-2] >= e20.iloc[-2]:
-        add_alert(symbol, period_label, "EMA5 下穿 EMA20 ⬇️", "bear")
+        hits.append(("ema_cross_down", "EMA5 下穿 EMA20 ⬇️", "bear"))
 
-    emas = [calc_ema(close,n).iloc[-1] for n,_ in EMA_CONFIGS]
+    emas = [ind[f"EMA{n}"].iloc[-1] for n,_ in EMA_CONFIGS]
     if all(emas[i] > emas[i+1] for i in range(len(emas)-1)):
-        add_alert(symbol, period_label, "所有 EMA 多頭排列 🚀", "bull")
+        hits.append(("ema_stack_bull", "所有 EMA 多頭排列 🚀", "bull"))
 
-    vol_ma5 = vol.rolling(5).mean().iloc[-1]
+    vol_ma5 = ind["VOL_MA5"].iloc[-1]
     if vol.iloc[-1] > vol_ma5 * 2:
-        add_alert(symbol, period_label, f"成交量暴增 {vol.iloc[-1]/vol_ma5:.1f}x 均量 📊", "vol")
+        hits.append(("vol_spike", f"成交量暴增 {vol.iloc[-1]/vol_ma5:.1f}x 均量 📊", "vol"))
 
     # 支撐/阻力突破警示（含週期參數 + 價格合理性過濾）
-    itvl_key = {v[0]: k for k, v in INTERVAL_MAP.items()}.get(period_label, "1d")
-    pivots_h, pivots_l = calc_pivot(df, interval=itvl_key)
+    pivots_h, pivots_l = calc_pivot(df, interval=interval)
     price      = float(close.iloc[-1])
     prev_price = float(close.iloc[-2]) if len(close) > 1 else price
 
@@ -1218,36 +2719,417 @@ def run_alerts(symbol, period_label, df):
         # 取「剛被突破」的阻力位：prev <= resist < price（由下往上突破）
         broken = [p[1] for p in pivots_h if prev_price <= p[1] < price]
         if broken:
-            add_alert(symbol, period_label, f"突破阻力位 ${max(broken):.2f} ⚡", "bull")
+            hits.append(("break_resist", f"突破阻力位 ${max(broken):.2f} ⚡", "bull"))
 
     if pivots_l:
         # 取「剛被跌破」的支撐位：price < support <= prev（由上往下跌破）
         broken = [p[1] for p in pivots_l if price < p[1] <= prev_price]
         if broken:
-            add_alert(symbol, period_label, f"跌破支撐位 ${min(broken):.2f} ⚠️", "bear")
+            hits.append(("break_support", f"跌破支撐位 ${min(broken):.2f} ⚠️", "bear"))
+    return hits
+
+@timed_stage("alerts")
+def run_alerts(symbol, period_label, df):
+    if len(df) < 30: return
+    itvl_key = {v[0]: k for k, v in INTERVAL_MAP.items()}.get(period_label, "1d")
+    bar_ts   = df.index[-1]
+    hits     = evaluate_alerts(df, itvl_key)
+    alert_rearm(st.session_state.alert_dedup, symbol, period_label, [h[0] for h in hits])
+    for rule, msg, atype in hits:
+        add_alert(symbol, period_label, msg, atype, rule=rule, bar_ts=bar_ts)
+
+# ── 伺服器端警示訂閱：alert_engine.py 寫入 JSONL，頁面只讀取新增的事件 ────────
+ALERT_FEED_MAX_BYTES = 1024 * 1024   # 超過就輪替成 .1，只保留一代
+
+def alert_feed_path() -> str:
+    """警示事件檔：secrets / 環境變數 ALERT_FEED_PATH，預設放在 K 線快取目錄下"""
+    try:
+        return st.secrets["ALERT_FEED_PATH"]
+    except Exception:
+        pass
+    return os.environ.get("ALERT_FEED_PATH", os.path.join(_bar_cache_dir(), "alerts.jsonl"))
+
+def publish_alert_event(event: dict, path: str = None):
+    """附加一筆警示事件（單一寫入者：alert_engine.py）"""
+    path = path or alert_feed_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        if os.path.getsize(path) > ALERT_FEED_MAX_BYTES:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+ALERT_FEED_HEAD_BYTES = 256   # 記住第一行用來辨識輪替（inode 可能被新檔重用）
+
+def read_alert_feed(cursor: tuple = None, path: str = None) -> tuple:
+    """
+    從 cursor = (inode, offset, 第一行) 讀取新事件，回傳 (events, 新 cursor)。
+    檔案被輪替（inode 或第一行改變、或比 offset 小）時從頭讀；offset 若仍落在行中間，
+    先跳到下一個換行，不把半行當成事件。
+    """
+    path = path or alert_feed_path()
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [], None
+    inode, offset, head = cursor or (stat.st_ino, 0, b"")
+    with open(path, "rb") as f:
+        if inode != stat.st_ino or stat.st_size < offset or f.read(len(head)) != head:
+            inode, offset, head = stat.st_ino, 0, b""
+        if offset:
+            f.seek(offset - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        else:
+            f.seek(0)
+        start = f.tell()
+        data  = f.read()
+    end = data.rfind(b"\n") + 1     # 只消化完整的行，寫到一半的留給下次
+    if start == 0:
+        head = data[:min(data.find(b"\n") + 1, ALERT_FEED_HEAD_BYTES)]   # 第一行（最多 256 bytes）
+    events = []
+    for line in data[:end].splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue
+    return events, (inode, start + end, head)
+
+def sync_server_alerts():
+    """把 alert_engine 新發布的事件併入本 session 的警示記錄（推送已由引擎完成）"""
+    events, st.session_state.alert_feed_cursor = read_alert_feed(
+        st.session_state.get("alert_feed_cursor"))
+    for ev in events[-200:]:
+        st.session_state.alert_log.insert(0,
+            {"時間": ev["time"], "股票": ev["symbol"], "週期": ev["period"],
+             "訊息": ev["msg"], "類型": ev["atype"]})
+    st.session_state.alert_log = st.session_state.alert_log[:200]
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 警示回測：所有規則對每一根 K 線一次向量化評估
+# ══════════════════════════════════════════════════════════════════════════════
+BACKTEST_HORIZONS = (1, 5, 10)
+ALERT_RULE_TYPES = {
+    "macd_gold": "bull", "macd_dead": "bear",
+    "ema_cross_up": "bull", "ema_cross_down": "bear",
+    "ema_stack_bull": "bull", "vol_spike": "vol",
+    "break_resist": "bull", "break_support": "bear",
+}
+
+def _pivot_breaks(df, interval: str):
+    """
+    每根 K 線當下的「剛突破阻力 / 剛跌破支撐」價位（無則 NaN），與 calc_pivot
+    + evaluate_alerts 對 df[:t+1] 的結果逐根一致：
+    pivot i 的極值視窗完全落在 t 的掃描範圍內，所以整段只需算一次 is_pivot，
+    再用長度 tail_n-left-right 的滑動視窗取出每根 t 可見的候選 pivot。
+    """
+    left, right, tail_n = PIVOT_CFG.get(interval, (3, 3, 60))
+    hi, lo = df["High"].values, df["Low"].values
+    close  = df["Close"].values
+    n, w   = len(df), left + right + 1
+    span   = tail_n - left - right
+    res_px = np.full(n, np.nan)
+    sup_px = np.full(n, np.nan)
+    if n < w or span < 1:
+        return res_px, sup_px
+
+    ph = np.full(n, np.nan)
+    pl = np.full(n, np.nan)
+    mid = slice(left, n - right)
+    ph[mid] = np.where(hi[mid] == sliding_window_view(hi, w).max(axis=1), hi[mid], np.nan)
+    pl[mid] = np.where(lo[mid] == sliding_window_view(lo, w).min(axis=1), lo[mid], np.nan)
+
+    # 第 t 根可見的 pivot 位於 [t-tail_n+1+left, t-right]，前面補 NaN 讓早期視窗也等長
+    pad = np.full(span, np.nan)
+    win_h = sliding_window_view(np.concatenate([pad, ph]), span)[1:n + 1]
+    win_l = sliding_window_view(np.concatenate([pad, pl]), span)[1:n + 1]
+    # 第 t 列目前對應的是結尾 t 的視窗，平移 right 根 → 結尾 t-right
+    win_h = np.vstack([np.full((right, span), np.nan), win_h[:n - right]])
+    win_l = np.vstack([np.full((right, span), np.nan), win_l[:n - right]])
+
+    c     = close[:, None]
+    prev  = np.concatenate([[close[0]], close[:-1]])[:, None]
+    in_rng_h = (c * 0.70 <= win_h) & (win_h <= c * 1.30)
+    in_rng_l = (c * 0.70 <= win_l) & (win_l <= c * 1.30)
+    broke_h  = in_rng_h & (prev <= win_h) & (win_h < c)
+    broke_l  = in_rng_l & (c < win_l) & (win_l <= prev)
+
+    has_h, has_l = broke_h.any(axis=1), broke_l.any(axis=1)
+    res_px[has_h] = np.where(broke_h, win_h, -np.inf).max(axis=1)[has_h]
+    sup_px[has_l] = np.where(broke_l, win_l, np.inf).min(axis=1)[has_l]
+    return res_px, sup_px
+
+def backtest_alerts(df, interval: str = "1d", horizons=BACKTEST_HORIZONS) -> tuple:
+    """
+    把 evaluate_alerts 的每條規則套到整段歷史的每一根 K 線（不只最後兩根），
+    回傳 (events, summary)：
+      events : 每次觸發一列 {bar_ts, rule, atype, close, level, ret_{h}}
+      summary: 每條規則的觸發次數、各期前瞻報酬平均與勝率（空方規則以下跌為勝）
+    """
+    cols = ["bar_ts", "rule", "atype", "close", "level"] + [f"ret_{h}" for h in horizons]
+    if len(df) < 30:
+        return pd.DataFrame(columns=cols), pd.DataFrame()
+
+    ind   = get_indicators(df)
+    close = df["Close"].values
+    vol   = df["Volume"].values
+    dif, dea = ind["DIF"].values, ind["DEA"].values
+    e5, e20  = ind["EMA5"].values, ind["EMA20"].values
+
+    def _cross_up(a, b):
+        out = np.zeros(len(a), dtype=bool)
+        out[1:] = (a[1:] > b[1:]) & (a[:-1] <= b[:-1])
+        return out
+
+    def _cross_dn(a, b):
+        out = np.zeros(len(a), dtype=bool)
+        out[1:] = (a[1:] < b[1:]) & (a[:-1] >= b[:-1])
+        return out
+
+    emas  = np.column_stack([ind[f"EMA{n}"].values for n, _ in EMA_CONFIGS])
+    vma5  = ind["VOL_MA5"].values
+    res_px, sup_px = _pivot_breaks(df, interval)
+
+    fired = {
+        "macd_gold":      (_cross_up(dif, dea), None),
+        "macd_dead":      (_cross_dn(dif, dea), None),
+        "ema_cross_up":   (_cross_up(e5, e20), None),
+        "ema_cross_down": (_cross_dn(e5, e20), None),
+        "ema_stack_bull": ((emas[:, :-1] > emas[:, 1:]).all(axis=1), None),
+        "vol_spike":      (vol > vma5 * 2, vol / vma5),
+        "break_resist":   (~np.isnan(res_px), res_px),
+        "break_support":  (~np.isnan(sup_px), sup_px),
+    }
+    warm = np.arange(len(df)) >= 29   # 與 evaluate_alerts 一樣至少 30 根才評估
+
+    fwd = {}
+    for h in horizons:
+        r = np.full(len(close), np.nan)
+        r[:-h] = close[h:] / close[:-h] - 1
+        fwd[h] = r
+
+    frames = []
+    for rule, (mask, level) in fired.items():
+        pos = np.flatnonzero(mask & warm)
+        if not len(pos):
+            continue
+        frame = {"bar_ts": df.index[pos], "rule": rule, "atype": ALERT_RULE_TYPES[rule],
+                 "close": close[pos], "level": level[pos] if level is not None else np.nan}
+        frame.update({f"ret_{h}": fwd[h][pos] for h in horizons})
+        frames.append(pd.DataFrame(frame))
+    if not frames:
+        return pd.DataFrame(columns=cols), pd.DataFrame()
+    events = pd.concat(frames, ignore_index=True).sort_values(["bar_ts", "rule"],
+                                                              ignore_index=True)
+    return events, summarize_backtest(events, horizons)
+
+def summarize_backtest(events: pd.DataFrame, horizons=BACKTEST_HORIZONS) -> pd.DataFrame:
+    """依規則彙總：觸發次數、平均前瞻報酬(%)、勝率(%)（bear 規則以下跌為勝）"""
+    if events.empty:
+        return pd.DataFrame()
+    sign = np.where(events["atype"] == "bear", -1.0, 1.0)
+    agg  = {"hits": ("rule", "size")}
+    data = events[["rule"]].copy()
+    for h in horizons:
+        ret = events[f"ret_{h}"]
+        data[f"avg_{h}"] = ret * 100
+        data[f"win_{h}"] = np.where(ret.isna(), np.nan, (ret * sign > 0) * 100.0)
+        agg[f"avg_ret_{h}"]  = (f"avg_{h}", "mean")
+        agg[f"win_rate_{h}"] = (f"win_{h}", "mean")
+    return data.groupby("rule").agg(**agg).sort_values("hits", ascending=False)
+
+def backtest_watchlist(symbols: list, interval: str = "1d",
+                       horizons=BACKTEST_HORIZONS) -> tuple:
+    """多檔股票回測：先批次預載，再逐檔向量化評估；回傳 (全部事件, 跨股票彙總)"""
+    prefetch_data(symbols, [interval])
+    frames = []
+    for sym in symbols:
+        df = fetch_data(sym, interval)
+        if df.empty:
+            continue
+        events, _ = backtest_alerts(df, interval, horizons)
+        if not events.empty:
+            frames.append(events.assign(symbol=sym))
+    if not frames:
+        return pd.DataFrame(), pd.DataFrame()
+    events = pd.concat(frames, ignore_index=True)
+    return events, summarize_backtest(events, horizons)
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 篩選器：大量股票 × 多週期只算訊號，不建任何圖表
+# ══════════════════════════════════════════════════════════════════════════════
+SCREENER_BULL = {"多頭", "⬆金叉", "DIF↑", "多排↑", "EMA↑"}
+SCREENER_EMAS = (5, 12, 20, 26, 60, 200)
+
+@st.cache_resource
+def _screener_cache() -> dict:
+    """每組 (symbol, interval) 最近一次的訊號：{key: (資料指紋, 訊號)}，K 線沒變就不重算"""
+    return {"rows": {}, "lock": threading.Lock()}
+
+def screen_batch(frames: dict) -> dict:
+    """
+    同一週期的多檔 K 線一次算訊號：{symbol: df} → {symbol: (收盤, 前收, 趨勢, MACD, EMA)}。
+    收盤價靠右對齊、前面補 NaN 疊成一張寬表，每條 EMA 只呼叫一次 ewm 就算完全部股票；
+    adjust=False 的 ewm 從第一個有效值起算，結果與逐檔 calc_indicators 相同。
+    """
+    syms = [s for s, df in frames.items() if len(df)]
+    if not syms:
+        return {}
+    lens  = np.array([len(frames[s]) for s in syms])
+    width = int(lens.max())
+    mat   = np.full((width, len(syms)), np.nan)
+    for j, s in enumerate(syms):
+        mat[width - lens[j]:, j] = frames[s]["Close"].values
+    close = pd.DataFrame(mat)
+    ema   = {n: close.ewm(span=n, adjust=False).mean() for n in SCREENER_EMAS}
+    dif   = ema[12] - ema[26]
+    dea   = dif.ewm(span=9, adjust=False).mean().values[-2:]
+    dif   = dif.values[-2:]
+    last2 = {n: e.values[-2:] for n, e in ema.items()}
+
+    out = {}
+    for j, s in enumerate(syms):
+        n    = int(lens[j])
+        e    = {k: v[:, j] for k, v in last2.items()}
+        last = float(mat[-1, j])
+        prev = float(mat[-2, j]) if n > 1 else last
+        out[s] = (last, prev,
+                  _trend_of(n, e[5][1], e[20][1], e[60][1], e[200][1]),
+                  _macd_of(n, dif[:, j], dea[:, j]),
+                  _ema_of(n, e[5], e[20]))
+    return out
+
+def screen_signals(symbols: list, interval: str) -> dict:
+    """單一週期的訊號，K 線指紋沒變的沿用上次結果，其餘一次批次計算"""
+    cache = _screener_cache()
+    sigs, todo, keys = {}, {}, {}
+    for sym in symbols:
+        df = fetch_data(sym, interval)
+        if df.empty:
+            continue
+        keys[sym] = _frame_key(df)
+        with cache["lock"]:
+            hit = cache["rows"].get((sym, interval))
+        if hit is not None and hit[0] == keys[sym]:
+            sigs[sym] = hit[1]
+        else:
+            todo[sym] = df
+    fresh = screen_batch(todo)
+    with cache["lock"]:
+        for sym, sig in fresh.items():
+            cache["rows"][(sym, interval)] = (keys[sym], sig)
+    sigs.update(fresh)
+    return sigs
+
+@timed_stage("screener")
+def run_screener(symbols: list, intervals: list) -> pd.DataFrame:
+    """
+    篩選器主流程：批次預載 K 線（各週期並行）→ 每個週期一次算完所有股票的訊號 → 每檔一列。
+    價格/漲跌取自第一個有數據的週期；多頭分數 = 所有週期中偏多訊號的個數。
+    """
+    if not symbols or not intervals:
+        return pd.DataFrame()
+    prefetch_data(symbols, intervals)
+    by_itvl = {itvl: screen_signals(symbols, itvl) for itvl in intervals}
+
+    rows = []
+    for sym in symbols:
+        row, score, base = {"代號": sym}, 0, None
+        for itvl in intervals:
+            sig   = by_itvl[itvl].get(sym)
+            label = INTERVAL_LABELS[itvl]
+            if sig is None:
+                row.update({f"{label} 趨勢": "—", f"{label} MACD": "—", f"{label} EMA": "—"})
+                continue
+            base = base or sig
+            row.update({f"{label} 趨勢": sig[2], f"{label} MACD": sig[3], f"{label} EMA": sig[4]})
+            score += sum(x in SCREENER_BULL for x in sig[2:])
+        if base is None:
+            continue
+        last, prev = base[0], base[1]
+        row["價格"]  = last
+        row["漲跌%"] = (last - prev) / prev * 100 if prev else 0.0
+        row["多頭分數"] = score
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame()
+    table = pd.DataFrame(rows)
+    front = ["代號", "價格", "漲跌%", "多頭分數"]
+    return table[front + [c for c in table.columns if c not in front]]
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 建立 K 線圖
 # ══════════════════════════════════════════════════════════════════════════════
+FIG_CACHE_SIZE = 48
+
+@st.cache_resource
+def _figure_cache() -> dict:
+    """跨 rerun / session 共用的圖表 LRU：{(symbol, 週期, 資料指紋, 根數, compact): Figure}"""
+    return {"lru": OrderedDict(), "lock": threading.Lock()}
+
+def _anomaly_peaks(mask: np.ndarray, vol: np.ndarray) -> list:
+    """
+    把連續異常放量的段落找出來，每段回傳量最大那根的 integer position（同值取第一根，與 argmax 一致）。
+    """
+    # 邊緣 +1 = 段落起點
+    edges  = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    # 非異常的 bar 設為 -inf，reduceat 的區間就算跨到下一段起點前也不影響段內最大值
+    vol_m   = np.where(mask, vol, -np.inf)
+    seg_max = np.maximum.reduceat(vol_m, starts)
+    seg_id  = np.cumsum(edges[:-1] == 1) - 1
+
+    hit      = np.flatnonzero(mask & (vol_m == seg_max[np.maximum(seg_id, 0)]))
+    _, first = np.unique(seg_id[hit], return_index=True)
+    return hit[first].tolist()
+
+def _macd_crosses(dif: np.ndarray, dea: np.ndarray) -> list:
+    """所有原始交叉點 [(位置, "gold"/"dead")]：DIF-DEA 由 <=0 轉 >0 為金叉，由 >=0 轉 <0 為死叉"""
+    spread = dif - dea
+    gold   = (spread[1:] > 0) & (spread[:-1] <= 0)
+    dead   = (spread[1:] < 0) & (spread[:-1] >= 0)
+    return [(int(i), "gold" if gold[i-1] else "dead")
+            for i in np.flatnonzero(gold | dead) + 1]
+
+@timed_stage("chart")
 def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
+    """
+    K 線沒變、顯示參數也沒變就直接回傳上次建好的 Figure（無關的元件點擊不再重建圖表）。
+    回傳的是共用物件，呼叫端只讀不改。
+    """
     if df.empty: return None
+    key   = (symbol, interval_label, _frame_key(df), max(10, int(max_bars)), bool(compact))
+    cache = _figure_cache()
+    with cache["lock"]:
+        fig = cache["lru"].get(key)
+        if fig is not None:
+            cache["lru"].move_to_end(key)
+            return fig
+    fig = _make_chart(symbol, df, interval_label, compact, max_bars)
+    with cache["lock"]:
+        cache["lru"][key] = fig
+        while len(cache["lru"]) > FIG_CACHE_SIZE:
+            cache["lru"].popitem(last=False)
+    return fig
+
+def _make_chart(symbol, df, interval_label, compact=False, max_bars=90):
 
     # ── 限制最多顯示 90 根 K 線，避免圖表擁擠 ──
     # EMA/MACD 用完整數據計算（保留歷史），再截取最後 90 根顯示
     MAX_BARS = max(10, int(max_bars))   # 使用者自訂，最少10根
-    close_full, vol_full = df["Close"], df["Volume"]
-    ema_s_full = {n: calc_ema(close_full, n) for n, _ in EMA_CONFIGS}
-    ma_s_full  = {n: calc_ma(close_full,  n) for n, _, _ in MA_CONFIGS}
-    dif_full, dea_full, hist_full = calc_macd(close_full)
+    ind = get_indicators(df).tail(MAX_BARS)
 
     # 截取最後 90 根用於繪圖
     df   = df.tail(MAX_BARS).copy()
     close, vol = df["Close"], df["Volume"]
-    ema_s = {n: s.tail(MAX_BARS) for n, s in ema_s_full.items()}
-    ma_s  = {n: s.tail(MAX_BARS) for n, s in ma_s_full.items()}
-    dif   = dif_full.tail(MAX_BARS)
-    dea   = dea_full.tail(MAX_BARS)
-    hist  = hist_full.tail(MAX_BARS)
+    ema_s = {n: ind[f"EMA{n}"] for n, _ in EMA_CONFIGS}
+    ma_s  = {n: ind[f"MA{n}"]  for n, _, _ in MA_CONFIGS}
+    dif   = ind["DIF"]
+    dea   = ind["DEA"]
+    hist  = ind["HIST"]
+    vol_ma5 = ind["VOL_MA5"]
 
     # 支撐阻力用截取後的資料
     itvl_code = {v[0]: k for k, v in INTERVAL_MAP.items()}.get(interval_label, "1d")
@@ -1258,8 +3140,6 @@ def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
     intraday = interval_label in {"1分鐘","5分鐘","15分鐘","30分鐘"}
     fmt = "%m/%d %H:%M" if intraday else "%y/%m/%d"
     xlabels = [t.strftime(fmt) for t in df.index]
-    # 所有 series 也配對成同樣的字串 index，確保對齊
-    vol_ma5 = vol.rolling(5).mean()
 
     chart_h = 520 if compact else 820
     fig = make_subplots(
@@ -1329,7 +3209,6 @@ def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
                for c, o in zip(df["Close"], df["Open"])]
     fig.add_trace(go.Bar(x=xlabels, y=vol, marker_color=col_vol,
                          name="成交量", showlegend=False), row=2, col=1)
-    vol_ma5 = vol.rolling(5).mean()
     fig.add_trace(go.Scatter(x=xlabels, y=vol_ma5,
                               line=dict(color="#ffaa00", width=1.5), name="VOL MA5"), row=2, col=1)
 
@@ -1337,22 +3216,7 @@ def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
     # 策略：同一段密集放量只取最大的那根，避免連續出現滿屏標注
     anomaly_mask = (vol > vol_ma5 * 2).values
     if anomaly_mask.any():
-        # 把連續異常段落找出來，每段只取量最大的那根
-        groups, in_group, g_start = [], False, 0
-        for i, flag in enumerate(anomaly_mask):
-            if flag and not in_group:
-                in_group, g_start = True, i
-            elif not flag and in_group:
-                groups.append((g_start, i - 1))
-                in_group = False
-        if in_group:
-            groups.append((g_start, len(anomaly_mask) - 1))
-
-        # 每段取量最大的 bar 的 integer position
-        rep_pos = []
-        for g0, g1 in groups:
-            seg_vals = vol.values[g0:g1+1]
-            rep_pos.append(g0 + int(seg_vals.argmax()))
+        rep_pos  = _anomaly_peaks(anomaly_mask, vol.values)
 
         rep_x    = [xlabels[p]  for p in rep_pos]
         rep_vol  = [float(vol.values[p])    for p in rep_pos]
@@ -1382,13 +3246,7 @@ def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
                               line=dict(color="#0088ff", width=1.5), name="DEA"), row=3, col=1)
 
     # ── 金叉/死叉（智能去擁擠）────────────────────────────────────────────
-    # 收集所有原始交叉點
-    raw_crosses = []
-    for i in range(1, len(dif)):
-        if dif.iloc[i] > dea.iloc[i] and dif.iloc[i-1] <= dea.iloc[i-1]:
-            raw_crosses.append((i, "gold"))
-        elif dif.iloc[i] < dea.iloc[i] and dif.iloc[i-1] >= dea.iloc[i-1]:
-            raw_crosses.append((i, "dead"))
+    raw_crosses = _macd_crosses(dif.values, dea.values)
 
     # 間距過濾：相鄰標注至少 min_gap 根 K 線，且同方向連發只取最新
     total_bars = len(dif)
@@ -1488,6 +3346,74 @@ def build_chart(symbol, df, interval_label, compact=False, max_bars=90):
                      tickfont=dict(size=9 if compact else 10))
     return fig
 
+# ══════════════════════════════════════════════════════════════════════════════
+# 篩選器表格
+# ══════════════════════════════════════════════════════════════════════════════
+def render_screener(symbols, selected_intervals):
+    t0 = time.perf_counter()
+    with st.spinner(f"計算 {len(symbols)} 檔 × {len(selected_intervals)} 週期訊號中..."):
+        table = run_screener(symbols, selected_intervals)
+    if table.empty:
+        st.warning("⚠️ 沒有可用的數據")
+        return
+    st.caption(f"🔍 {len(table)}/{len(symbols)} 檔・{len(selected_intervals)} 個週期・"
+               f"{time.perf_counter() - t0:.1f}s")
+
+    f1, f2, f3 = st.columns([2, 2, 1])
+    trend_col  = f"{INTERVAL_LABELS[selected_intervals[0]]} 趨勢"
+    trends     = f1.multiselect(f"篩選 {trend_col}", ["多頭", "空頭", "盤整"],
+                                default=[], key="scr_trend")
+    query      = f2.text_input("代號搜尋", key="scr_query").strip().upper()
+    cross_only = f3.checkbox("只看交叉", key="scr_cross",
+                             help="任一週期出現 MACD 金叉/死叉或 EMA5/EMA20 交叉")
+
+    view = table
+    if trends:
+        view = view[view[trend_col].isin(trends)]
+    if query:
+        view = view[view["代號"].str.contains(query, regex=False)]
+    if cross_only:
+        sig_cols = [c for c in view.columns if c.endswith(("MACD", "EMA"))]
+        view = view[view[sig_cols].isin(["⬆金叉", "⬇死叉", "多排↑", "空排↓"]).any(axis=1)]
+
+    st.dataframe(
+        view.sort_values(["多頭分數", "漲跌%"], ascending=False),
+        hide_index=True, use_container_width=True,
+        height=min(38 + 35 * len(view), 800),
+        column_config={
+            "價格":    st.column_config.NumberColumn(format="$%.2f"),
+            "漲跌%":   st.column_config.NumberColumn(format="%+.2f%%"),
+            "多頭分數": st.column_config.ProgressColumn(
+                min_value=0, max_value=3 * len(selected_intervals), format="%d"),
+        })
+    st.download_button("📥 匯出篩選結果 CSV", view.to_csv(index=False, encoding="utf-8-sig"),
+                       "screener.csv", "text/csv")
+
+# ══════════════════════════════════════════════════════════════════════════════
+# 其他觀察中股票：只顯示精簡訊號列，不建圖表
+# ══════════════════════════════════════════════════════════════════════════════
+def render_watch_summary(symbols, intervals, show_alerts):
+    """未選中的股票：沿用篩選器的批次訊號一張小表呈現，警示仍逐檔偵測"""
+    if show_alerts:
+        for itvl in intervals:
+            label = INTERVAL_LABELS[itvl]
+            for sym in symbols:
+                df = fetch_data(sym, itvl)
+                if not df.empty:
+                    run_alerts(sym, label, df)
+    table = run_screener(symbols, intervals)
+    if table.empty:
+        return
+    st.markdown("##### 👀 其他觀察中股票")
+    st.dataframe(
+        table, hide_index=True, use_container_width=True,
+        column_config={
+            "價格":    st.column_config.NumberColumn(format="$%.2f"),
+            "漲跌%":   st.column_config.NumberColumn(format="%+.2f%%"),
+            "多頭分數": st.column_config.ProgressColumn(
+                min_value=0, max_value=3 * len(intervals), format="%d"),
+        })
+
 # ══════════════════════════════════════════════════════════════════════════════
 # 多週期摘要列
 # ══════════════════════════════════════════════════════════════════════════════
@@ -1569,9 +3495,10 @@ def render_mtf_charts(symbol, selected_intervals, layout_mode, max_bars=90):
                     else:
                         fig = build_chart(symbol, df, label, compact=True, max_bars=max_bars)
                         if fig:
-                            st.plotly_chart(fig, use_container_width=True,
-                                            config={"displayModeBar": False},
-                                            key=f"mtf_{symbol}_{itvl}")
+                            with stage_timer("serialize"):
+                                st.plotly_chart(fig, use_container_width=True,
+                                                config={"displayModeBar": False},
+                                                key=f"mtf_{symbol}_{itvl}")
     else:
         for itvl in selected_intervals:
             label, _ = INTERVAL_MAP[itvl]
@@ -1581,9 +3508,10 @@ def render_mtf_charts(symbol, selected_intervals, layout_mode, max_bars=90):
             else:
                 fig = build_chart(symbol, df, label, compact=False, max_bars=max_bars)
                 if fig:
-                    st.plotly_chart(fig, use_container_width=True,
-                                    config={"displayModeBar": True},
-                                    key=f"mtf_{symbol}_{itvl}_full")
+                    with stage_timer("serialize"):
+                        st.plotly_chart(fig, use_container_width=True,
+                                        config={"displayModeBar": True},
+                                        key=f"mtf_{symbol}_{itvl}_full")
 
 # ══════════════════════════════════════════════════════════════════════════════
 # 單週期渲染
@@ -1619,9 +3547,10 @@ def render_single(symbol, interval, show_alerts, max_bars=90):
             unsafe_allow_html=True)
 
     # EMA 列
+    ind   = get_indicators(df).iloc[-1]
     items = []
     for n, color in EMA_CONFIGS:
-        val   = float(calc_ema(close,n).iloc[-1])
+        val   = float(ind[f"EMA{n}"])
         arrow = "↑" if last > val else "↓"
         items.append(
             f'<span class="ema-item" style="color:{color}">'
@@ -1632,138 +3561,272 @@ def render_single(symbol, interval, show_alerts, max_bars=90):
 
     fig = build_chart(symbol, df, label, max_bars=max_bars)
     if fig:
-        st.plotly_chart(fig, use_container_width=True,
-                        config={"displayModeBar": True},
-                        key=f"single_{symbol}_{interval}")
+        with stage_timer("serialize"):
+            st.plotly_chart(fig, use_container_width=True,
+                            config={"displayModeBar": True},
+                            key=f"single_{symbol}_{interval}")
 
     if show_alerts:
         run_alerts(symbol, label, df)
+        with st.expander("📜 警示回測（全歷史）"):
+            events, summary = backtest_alerts(df, interval)
+            if summary.empty:
+                st.caption("此區間沒有觸發任何警示規則")
+            else:
+                st.caption(f"共 {len(df)} 根 K 線，觸發 {len(events)} 次；報酬與勝率為觸發後 "
+                           f"{'/'.join(map(str, BACKTEST_HORIZONS))} 根的表現(%)")
+                st.dataframe(summary.round(2), use_container_width=True)
 
     # ── AI 技術分析面板 ─────────────────────────────────────────────────────
     if show_ai:
         mkt = fetch_market_data() if show_market else {}
         st.markdown("---")
-        render_ai_analysis(symbol, label, df, mkt=mkt)
+        render_ai_analysis(symbol, label, df, mkt=mkt, watchlist=symbols)
 
 # ══════════════════════════════════════════════════════════════════════════════
-# Sidebar
+# 頁面渲染：只在 `streamlit run v19.py` 時執行；
+# 被 alert_engine.py 等模組匯入時只提供上方的數據/指標/警示函式
 # ══════════════════════════════════════════════════════════════════════════════
-with st.sidebar:
-    st.title("📈 美股監控系統")
-    st.markdown("---")
+if __name__ == "__main__":
+    page_t0 = time.perf_counter()
+    st.set_page_config(**PAGE_CONFIG)
+    st.markdown(PAGE_CSS, unsafe_allow_html=True)
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # Session State
+    # ══════════════════════════════════════════════════════════════════════════
+    if "alert_log"   not in st.session_state: st.session_state.alert_log   = []
+    if "alert_dedup" not in st.session_state: st.session_state.alert_dedup = OrderedDict()
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # Sidebar
+    # ══════════════════════════════════════════════════════════════════════════
+    with st.sidebar:
+        st.title("📈 美股監控系統")
+        st.markdown("---")
 
-    raw_input = st.text_area("股票代號（逗號分隔）", value="TSLA,AAPL,NVDA", height=80)
-    symbols   = [s.strip().upper() for s in raw_input.replace("，",",").split(",") if s.strip()]
+        raw_input = st.text_area("股票代號（逗號分隔）", value="TSLA,AAPL,NVDA", height=80)
+        symbols   = [s.strip().upper() for s in raw_input.replace("，",",").split(",") if s.strip()]
 
-    st.markdown("---")
-    st.markdown("#### 📅 監控模式")
-    mode = st.radio("", ["單一週期", "多週期同時監控"], horizontal=True,
-                    label_visibility="collapsed")
-
-    if mode == "單一週期":
-        single_interval = st.selectbox(
-            "時間週期",
-            ALL_INTERVALS,
-            format_func=lambda x: INTERVAL_LABELS[x],
-            index=4,
-        )
-        layout_mode = None
-        selected    = []
+        st.markdown("---")
+        st.markdown("#### 📅 監控模式")
+        mode = st.radio("", ["單一週期", "多週期同時監控", "篩選器"], horizontal=True,
+                        label_visibility="collapsed")
 
-    else:
-        st.markdown("**勾選要同時顯示的週期：**")
-        selected    = []
-        defaults    = {"5m", "15m", "1d"}
-        left_col, right_col = st.columns(2)
-        for i, itvl in enumerate(ALL_INTERVALS):
-            col = left_col if i % 2 == 0 else right_col
-            if col.checkbox(INTERVAL_LABELS[itvl], value=(itvl in defaults), key=f"cb_{itvl}"):
-                selected.append(itvl)
-        st.markdown("")
-        layout_mode = st.radio("圖表排列方式",
-                               ["並排（2欄）", "堆疊（全寬）"], horizontal=True)
+        if mode == "單一週期":
+            single_interval = st.selectbox(
+                "時間週期",
+                ALL_INTERVALS,
+                format_func=lambda x: INTERVAL_LABELS[x],
+                index=4,
+            )
+            layout_mode = None
+            selected    = []
 
-    st.markdown("---")
-    auto_refresh = st.toggle("自動刷新", value=False)
-    refresh_sec  = st.slider("刷新間隔（秒）", 60, 300, 60, step=30, disabled=not auto_refresh)
+        elif mode == "篩選器":
+            selected    = st.multiselect("篩選週期", ALL_INTERVALS, default=["1d"],
+                                         format_func=lambda x: INTERVAL_LABELS[x])
+            layout_mode = None
+            st.caption("可在上方貼上數百檔代號，只計算訊號、不繪製圖表")
 
-    st.markdown("---")
-    st.markdown("**📊 K 線顯示根數**")
-    max_bars = st.number_input(
-        "每張圖最多顯示幾根 K 線",
-        min_value=20, max_value=500, value=90, step=10,
-        help="建議：分鐘圖 60-120 根，日K 60-90 根，週K/月K 40-60 根",
-    )
+        else:
+            st.markdown("**勾選要同時顯示的週期：**")
+            selected    = []
+            defaults    = {"5m", "15m", "1d"}
+            left_col, right_col = st.columns(2)
+            for i, itvl in enumerate(ALL_INTERVALS):
+                col = left_col if i % 2 == 0 else right_col
+                if col.checkbox(INTERVAL_LABELS[itvl], value=(itvl in defaults), key=f"cb_{itvl}"):
+                    selected.append(itvl)
+            st.markdown("")
+            layout_mode = st.radio("圖表排列方式",
+                                   ["並排（2欄）", "堆疊（全寬）"], horizontal=True)
 
-    st.markdown("---")
-    show_alerts  = st.toggle("啟用警示偵測",     value=True)
-    show_market  = st.toggle("顯示市場環境面板",   value=True)
-    show_ai      = st.toggle("啟用 AI 技術分析",  value=True)
+        st.markdown("---")
+        auto_refresh = st.toggle("自動刷新", value=False)
+        refresh_sec  = st.slider("刷新間隔（秒）", 60, 300, 60, step=30, disabled=not auto_refresh)
+        live_stream  = st.toggle(
+            "⚡ 1分鐘即時串流", value=False,
+            help=f"1 分鐘 K 線改由成交推播即時更新，1 分鐘警示每 {STREAM_TICK} 秒檢查一次"
+                 "（來源由 STREAM_SOURCE 設定，預設 Yahoo WebSocket）")
 
-    if st.button("🗑️ 清除警示記錄"):
-        st.session_state.alert_log   = []
-        st.session_state.sent_alerts = set()
-        st.toast("警示記錄已清除")
+        st.markdown("---")
+        st.markdown("**📊 K 線顯示根數**")
+        max_bars = st.number_input(
+            "每張圖最多顯示幾根 K 線",
+            min_value=20, max_value=500, value=90, step=10,
+            help="建議：分鐘圖 60-120 根，日K 60-90 根，週K/月K 40-60 根",
+        )
 
-    if st.session_state.alert_log:
-        csv_data = pd.DataFrame(st.session_state.alert_log).to_csv(
-            index=False, encoding="utf-8-sig")
-        st.download_button("📥 匯出警示 CSV", csv_data, "alerts.csv", "text/csv")
+        st.markdown("---")
+        show_alerts  = st.toggle("啟用警示偵測",     value=True)
+        server_alerts = st.toggle(
+            "改用伺服器端警示引擎", value=False, disabled=not show_alerts,
+            help="由 alert_engine.py 在背景掃描觀察清單，本頁只訂閱結果，不重複計算與推送")
+        show_market  = st.toggle("顯示市場環境面板",   value=True)
+        show_ai      = st.toggle("啟用 AI 技術分析",  value=True)
+
+        if st.button("🗑️ 清除警示記錄"):
+            st.session_state.alert_log   = []
+            st.session_state.alert_dedup = OrderedDict()
+            st.toast("警示記錄已清除")
+
+        if st.session_state.alert_log:
+            csv_data = pd.DataFrame(st.session_state.alert_log).to_csv(
+                index=False, encoding="utf-8-sig")
+            st.download_button("📥 匯出警示 CSV", csv_data, "alerts.csv", "text/csv")
 
-    st.markdown("---")
-    st.caption("數據來源：Yahoo Finance\n\n⚠️ 僅供參考，不構成投資建議")
+        st.markdown("---")
+        st.caption("數據來源：Yahoo Finance\n\n⚠️ 僅供參考，不構成投資建議")
 
-# ══════════════════════════════════════════════════════════════════════════════
-# 主區域
-# ══════════════════════════════════════════════════════════════════════════════
-st.title("🇺🇸 美股即時監控系統")
+    # ══════════════════════════════════════════════════════════════════════════
+    # 主區域
+    # ══════════════════════════════════════════════════════════════════════════
+    st.title("🇺🇸 美股即時監控系統")
 
-if not symbols:
-    st.info("請在左側輸入股票代號")
-    st.stop()
+    if not symbols:
+        st.info("請在左側輸入股票代號")
+        st.stop()
 
-# ── 市場環境面板（置頂）──────────────────────────────────────────────────────
-if show_market:
-    render_market_environment()
-    st.markdown("---")
+    # ── 市場環境面板（置頂）──────────────────────────────────────────────────────
+    if show_market:
+        render_market_environment()
+        st.markdown("---")
+
+    # ── 預載：所有分頁渲染前一次批次抓齊數據 ─────────────────────────────────
+    prefetch_intervals = [single_interval] if mode == "單一週期" else selected
+    if prefetch_intervals:
+        pf = prefetch_data(symbols, prefetch_intervals)
+        if not pf["pairs"]:
+            st.sidebar.caption("⚡ K 線皆在新鮮期內，本輪未發出請求")
+        else:
+            st.sidebar.caption(
+                f"⚡ 預載 {pf['fetched']}/{pf['pairs']} 組數據 {pf['elapsed']:.1f}s"
+                f"（增量 {pf['incremental']}・完整 {pf['full']}）"
+                f"（序列估計 {pf['serial_est']:.1f}s，節省 {pf['saved']:.1f}s）")
+
+    # ── 警示：訂閱伺服器端引擎，或由本頁自行偵測 ─────────────────────────────
+    if show_alerts and server_alerts:
+        sync_server_alerts()
+    page_alerts = show_alerts and not server_alerts
+
+    # ── 即時串流：1 分鐘 K 線由推播更新，警示不必等整頁刷新 ─────────────────
+    if live_stream:
+        prefetch_data(symbols, [STREAM_INTERVAL])   # 串流只接續既有 K 線
+        start_stream(symbols, ttl=STREAM_SUB_TTL)
+
+        @st.fragment(run_every=STREAM_TICK)
+        def stream_panel():
+            state = start_stream(symbols, ttl=STREAM_SUB_TTL)   # 續約這個 session 的訂閱
+            with state["lock"]:
+                ticks, last, err = state["ticks"], state["last_tick"], state["error"]
+                fatal = state["fatal"]
+            if page_alerts:
+                head  = st.session_state.alert_log[0] if st.session_state.alert_log else None
+                label = INTERVAL_MAP[STREAM_INTERVAL][0]
+                for sym in symbols:
+                    df = fetch_data(sym, STREAM_INTERVAL)
+                    if not df.empty:
+                        run_alerts(sym, label, df)
+                for e in st.session_state.alert_log:
+                    if e is head:
+                        break
+                    st.toast(f"🔔 【{e['股票']}】{e['訊息']}")
+            if fatal:
+                st.caption(f"⚠️ 串流無法啟動：{err}")
+            elif err:
+                st.caption(f"⚠️ 串流中斷，{STREAM_RETRY_SEC} 秒後重連：{err}")
+            elif last:
+                st.caption(f"⚡ 串流中 {len(symbols)} 檔・{ticks} 筆成交・"
+                           f"{time.time() - last:.0f} 秒前更新")
+            else:
+                st.caption("⚡ 串流連線中…")
+
+        with st.sidebar:
+            stream_panel()
+    else:
+        stop_stream()   # 只取消這個 session 的訂閱，別的頁面還在看就不斷線
 
-stock_tabs = st.tabs([f"📊 {s}" for s in symbols])
+    if mode == "篩選器":
+        if not selected:
+            st.warning("⚠️ 請在左側至少選擇一個時間週期")
+        else:
+            render_screener(symbols, selected)
+    else:
+        # 只有選中的股票建圖表；其餘股票一張精簡訊號表，圖表數量不隨觀察清單增加
+        prev_active = st.session_state.get("active_symbol")
+        symbol = st.radio("觀察中股票", symbols, horizontal=True, label_visibility="collapsed",
+                          index=symbols.index(prev_active) if prev_active in symbols else 0,
+                          format_func=lambda s: f"📊 {s}")
+        st.session_state.active_symbol = symbol
+        others = [s for s in symbols if s != symbol]
 
-for tab, symbol in zip(stock_tabs, symbols):
-    with tab:
         if mode == "單一週期":
-            render_single(symbol, single_interval, show_alerts, max_bars=max_bars)
+            render_single(symbol, single_interval, page_alerts, max_bars=max_bars)
+            summary_intervals = [single_interval]
 
         else:
+            summary_intervals = selected
             if not selected:
                 st.warning("⚠️ 請在左側至少勾選一個時間週期")
             else:
                 # ① 多週期摘要
-                render_mtf_summary(symbol, selected, show_alerts)
+                render_mtf_summary(symbol, selected, page_alerts)
                 st.markdown("---")
                 # ② 多週期 K 線圖
                 render_mtf_charts(symbol, selected, layout_mode, max_bars=max_bars)
+                # ③ AI 分析：所有勾選週期合併成一個請求
+                if show_ai:
+                    st.markdown("---")
+                    render_ai_analysis(symbol, "+".join(INTERVAL_MAP[i][0] for i in selected),
+                                       fetch_data(symbol, selected[0]),
+                                       mkt=fetch_market_data() if show_market else {},
+                                       watchlist=symbols, intervals=selected)
+
+        if others and summary_intervals:
+            st.markdown("---")
+            render_watch_summary(others, summary_intervals, page_alerts)
+
+    # ══════════════════════════════════════════════════════════════════════════
+    # 警示面板
+    # ══════════════════════════════════════════════════════════════════════════
+    if st.session_state.alert_log:
+        st.markdown("---")
+        st.subheader("🔔 警示訊息記錄")
+        cls_map = {"bull":"alert-bull","bear":"alert-bear","vol":"alert-vol","info":"alert-info"}
+        for e in st.session_state.alert_log[:40]:
+            cls    = cls_map.get(e["類型"], "alert-info")
+            p_tag  = f'【{e["週期"]}】' if e.get("週期") else ""
+            st.markdown(
+                f'<div class="alert-box {cls}">'
+                f'🕐 {e["時間"]}　【{e["股票"]}】{p_tag}　{e["訊息"]}'
+                f'</div>',
+                unsafe_allow_html=True)
 
-# ══════════════════════════════════════════════════════════════════════════════
-# 警示面板
-# ══════════════════════════════════════════════════════════════════════════════
-if st.session_state.alert_log:
-    st.markdown("---")
-    st.subheader("🔔 警示訊息記錄")
-    cls_map = {"bull":"alert-bull","bear":"alert-bear","vol":"alert-vol","info":"alert-info"}
-    for e in st.session_state.alert_log[:40]:
-        cls    = cls_map.get(e["類型"], "alert-info")
-        p_tag  = f'【{e["週期"]}】' if e.get("週期") else ""
-        st.markdown(
-            f'<div class="alert-box {cls}">'
-            f'🕐 {e["時間"]}　【{e["股票"]}】{p_tag}　{e["訊息"]}'
-            f'</div>',
-            unsafe_allow_html=True)
+    # ══════════════════════════════════════════════════════════════════════════
+    # 自動刷新
+    # ══════════════════════════════════════════════════════════════════════════
+    # 不再整批清空 st.cache_data：K 線依 FRESHNESS 各自過期，
+    # 市場/VIX/新聞快取也以各自的 ttl 失效，rerun 時只會重抓過期的來源。
+    # 計時改由 fragment 定期觸發（不佔住 script 執行緒 sleep），
+    # 快到刷新時間先在背景預熱 K 線，整頁 rerun 時只需渲染已備妥的數據。
+    if auto_refresh:
+        if "next_refresh" not in st.session_state:
+            st.session_state.next_refresh = time.time() + refresh_sec
+
+        @st.fragment(run_every=REFRESH_TICK)
+        def refresh_timer():
+            remaining = st.session_state.next_refresh - time.time()
+            if remaining <= REFRESH_LEAD and prefetch_intervals:
+                schedule_prefetch(symbols, prefetch_intervals)
+            if remaining <= 0:
+                st.session_state.next_refresh = time.time() + refresh_sec
+                st.rerun(scope="app")
+            st.caption(f"🔄 {max(0, remaining):.0f} 秒後自動刷新")
+
+        with st.sidebar:
+            refresh_timer()
+    else:
+        st.session_state.pop("next_refresh", None)
 
-# ══════════════════════════════════════════════════════════════════════════════
-# 自動刷新
-# ══════════════════════════════════════════════════════════════════════════════
-if auto_refresh:
-    time.sleep(refresh_sec)
-    st.cache_data.clear()
-    st.rerun()
+    write_stage_log(time.perf_counter() - page_t0)